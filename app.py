@@ -1,20 +1,96 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import io
+import os
+import sys
 import re
+import hashlib
+import mmap
+import zlib
+import sqlite3
+import socket
+import argparse
 import time
 import random
+import queue
+import itertools
+import bisect
+import functools
+import threading
+import tracemalloc
+import cProfile
+import pstats
+import contextlib
+import logging
 from datetime import datetime
-from urllib.parse import quote_plus
+from pathlib import Path
+from urllib.parse import quote, quote_plus, urlparse, parse_qs, urljoin
 import json
-from typing import List, Dict, Tuple, Optional
+import uuid
+import asyncio
+import multiprocessing
+import http.client
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Tuple, Optional, Callable
 import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 
+# Process memory for the admin panel (not available on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Optional sparse matrices for HS code scoring; numpy postings are used without it
+try:
+    from scipy import sparse as scipy_sparse
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Optional regex engines for untrusted page text: RE2 is linear-time, `regex` supports scan timeouts
+try:
+    import re2
+    RE2_AVAILABLE = True
+except ImportError:
+    RE2_AVAILABLE = False
+
+try:
+    import regex as regex_engine
+    REGEX_AVAILABLE = True
+except ImportError:
+    REGEX_AVAILABLE = False
+
+# Optional Arrow: compact session strings and Parquet / Arrow IPC files
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Optional zstd compression of CSV files (gzip is always available)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Optional async HTTP client for the hybrid executor
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
 # Download required NLTK data with error handling
 @st.cache_resource
 def download_nltk_data():
@@ -38,97 +114,209 @@ def download_nltk_data():
 # Initialize NLTK
 nltk_ready = download_nltk_data()
 
-# Sahifa konfiguratsiyasi
-st.set_page_config(
-    page_title="Tovar tavsifi to'ldirish - Bojxona uchun",
-    page_icon="📝",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# CSS stillar
-st.markdown("""
-<style>
-    .main-header {
-        text-align: center;
-        color: #1f4e79;
-        font-size: 2.5rem;
-        margin-bottom: 1rem;
-    }
-    .sub-header {
-        text-align: center;
-        color: #666;
-        font-size: 1.2rem;
-        margin-bottom: 2rem;
-    }
-    .highlight-box {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-    }
-    .completeness-high {
-        background: linear-gradient(135deg, #4CAF50 0%, #45a049 100%);
-        color: white;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 0.5rem 0;
-        font-weight: bold;
-    }
-    .completeness-medium {
-        background: linear-gradient(135deg, #ff9800 0%, #f57c00 100%);
-        color: white;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 0.5rem 0;
-        font-weight: bold;
-    }
-    .completeness-low {
-        background: linear-gradient(135deg, #f44336 0%, #d32f2f 100%);
-        color: white;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 0.5rem 0;
-        font-weight: bold;
-    }
-    .metric-card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 10px;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-        text-align: center;
-    }
-    .metric-value {
-        font-size: 2rem;
-        font-weight: bold;
-        color: #2e7bcf;
-    }
-    .analysis-card {
-        background: #f8f9fa;
-        padding: 1rem;
-        border-radius: 8px;
-        border-left: 4px solid #007bff;
-        margin: 0.5rem 0;
-    }
-    .enhancement-card {
-        background: linear-gradient(135deg, #e3f2fd 0%, #bbdefb 100%);
-        color: #1565c0;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 0.5rem 0;
-        font-weight: bold;
-    }
-    .source-card {
-        background: #fff3e0;
-        color: #e65100;
-        padding: 0.8rem;
-        border-radius: 6px;
-        margin: 0.3rem 0;
-        font-size: 0.9rem;
+logger = logging.getLogger(__name__)
+
+# Local storage for checkpoints and other persistent state
+DATA_DIR = Path(os.environ.get('CUSTOMS_DATA_DIR', Path(__file__).parent / 'data'))
+
+# ========================= TEXT NORMALIZATION =========================
+
+class TextNormalizer:
+    """One normalization pass per description, cached and shared by every stage.
+    
+    Tokens are casefolded words and numbers, split where a number runs
+    into letters so "256GB" and "256 gb" both become ("256", "gb"), with
+    their character offsets in the original text. Digits after letters
+    stay in the word ("G8", "S24"), as in the raw description. Inch marks after a
+    number ('14"', "14''", '14″') are kept as one token, '"', for the
+    completeness patterns. With a lemmatizer the tokens also get lemmas
+    ("phones" -> "phone"). Results are cached per description and must
+    not be modified.
+    """
+    
+    token_pattern = re.compile(r'''\d+(?:\.\d+)?|[^\W\d_]+\d*|(?<=\d)\s*(?P<inch>''|′′|["″”'′])''')
+    
+    def __init__(self, lemmatize: bool = False, cache_size: int = 65536):
+        self.lemmatizer = None
+        if lemmatize:
+            try:
+                self.lemmatizer = WordNetLemmatizer()
+                self.lemmatizer.lemmatize('phones')
+            except LookupError:
+                self.lemmatizer = None
+        # Per-instance caches, so a normalizer and its lemmatizer are freed with it
+        self.normalize = functools.lru_cache(maxsize=cache_size)(self._normalize)
+        self._lemma = functools.lru_cache(maxsize=16384)(self._lemmatize)
+    
+    def _normalize(self, description: str) -> Dict:
+        matches = list(self.token_pattern.finditer(str(description)))
+        tokens = tuple('"' if match.lastgroup == 'inch' else match.group().casefold() for match in matches)
+        if self.lemmatizer is not None:
+            lemmas = tuple(self._lemma(token) for token in tokens)
+        else:
+            lemmas = tuple(token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token for token in tokens)
+        return {
+            'tokens': tokens,
+            'offsets': tuple(match.span() for match in matches),
+            'lemmas': lemmas,
+            'text': ' '.join(tokens),
+            'token_set': frozenset(tokens)
+        }
+    
+    def _lemmatize(self, token: str) -> str:
+        return token if token.isdigit() else self.lemmatizer.lemmatize(token)
+    
+    def contains(self, text: str, phrase: str) -> bool:
+        """Whether `phrase` appears in `text` as whole tokens, whatever the spacing and case"""
+        phrase_text = self.normalize(phrase)['text']
+        return bool(phrase_text) and f" {phrase_text} " in f" {self.normalize(text)['text']} "
+
+# ========================= SAFE PATTERN MATCHING =========================
+
+class PatternMatcher:
+    """Named patterns for untrusted text behind one search/findall interface.
+    
+    Backends, picked by CUSTOMS_REGEX_BACKEND or the best one installed:
+    're2' runs in linear time, 'regex' backtracks but every scan has a
+    timeout, and stdlib 're' cannot be interrupted, so it only gets the
+    text cap and the per-page budget between scans. Patterns RE2 cannot
+    compile (lookarounds, backreferences) use the next backend. Texts are
+    capped at `max_text` characters in every backend. A scan that runs out
+    of time returns no matches and its pattern name is recorded.
+    """
+    
+    def __init__(self, patterns: Dict[str, str], backend: Optional[str] = None, scan_timeout: float = 0.05, page_budget: float = 0.5, max_text: int = 200000):
+        self.backend = backend or os.environ.get('CUSTOMS_REGEX_BACKEND') or ('re2' if RE2_AVAILABLE else 'regex' if REGEX_AVAILABLE else 're')
+        self.scan_timeout = scan_timeout
+        self.page_budget = page_budget
+        self.max_text = max_text
+        self.timeouts = {}  # Pattern name -> scans that timed out
+        self._lock = threading.Lock()
+        self.compiled = {name: self._compile(source) for name, source in patterns.items()}
+    
+    def _compile(self, source: str) -> Tuple[str, object]:
+        if self.backend == 're2':
+            try:
+                return 're2', re2.compile(f"(?i){source}")
+            except Exception:
+                pass
+        if self.backend in ('re2', 'regex') and REGEX_AVAILABLE:
+            return 'regex', regex_engine.compile(source, regex_engine.IGNORECASE | regex_engine.VERSION0)
+        return 're', re.compile(source, re.IGNORECASE)
+    
+    def scan(self, text: str) -> 'PatternScan':
+        """Start scanning one text under a fresh page budget"""
+        return PatternScan(self, text[:self.max_text])
+    
+    def _record_timeout(self, name: str):
+        with self._lock:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+
+class PatternScan:
+    """The scans of one text, sharing its page budget"""
+    
+    def __init__(self, matcher: PatternMatcher, text: str):
+        self.matcher = matcher
+        self.text = text
+        self.deadline = time.monotonic() + matcher.page_budget
+        self.timed_out = []
+    
+    def _run(self, name: str, method: str):
+        engine, pattern = self.matcher.compiled[name]
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            self._timed_out(name)
+            return None
+        
+        try:
+            if engine == 'regex':
+                return getattr(pattern, method)(self.text, timeout=min(self.matcher.scan_timeout, remaining))
+            return getattr(pattern, method)(self.text)
+        except TimeoutError:
+            self._timed_out(name)
+            return None
+    
+    def _timed_out(self, name: str):
+        self.timed_out.append(name)
+        self.matcher._record_timeout(name)
+    
+    def first(self, name: str) -> Optional[str]:
+        """Group 1 of the first match"""
+        match = self._run(name, 'search')
+        return match.group(1) if match else None
+    
+    def findall(self, name: str) -> List:
+        return self._run(name, 'findall') or []
+
+# ========================= CATEGORY CLASSIFIER =========================
+
+class CategoryClassifier:
+    """Product category from a keyword -> category hash index over description tokens.
+    
+    A description is tokenized once and each token (and its singular form)
+    and each adjacent token pair is looked up in the index, so keywords only
+    match whole words. A category is returned only when it reaches
+    `min_score` hits and holds more than `min_confidence` of all hits;
+    otherwise the product is 'general'.
+    """
+    
+    CATEGORY_KEYWORDS = {
+        'electronics': ['phone', 'smartphone', 'laptop', 'computer', 'tablet', 'tv', 'camera', 'headphones', 'watch', 'smartwatch',
+                        'iphone', 'ipad', 'macbook', 'galaxy', 'pixel', 'airpods', 'earbuds', 'notebook', 'monitor', 'television',
+                        'console', 'playstation', 'xbox', 'speaker', 'smart tv', 'sony', 'samsung', 'huawei', 'xiaomi',
+                        'lenovo', 'dell', 'asus', 'canon', 'nikon', 'bose', 'jbl'],
+        'automotive': ['car', 'vehicle', 'auto', 'truck', 'motorcycle', 'bike', 'sedan', 'suv', 'bmw', 'mercedes', 'toyota',
+                       'tesla', 'audi', 'honda', 'ford', 'volkswagen', 'hyundai', 'kia', 'porsche', 'lexus', 'nissan', 'scooter'],
+        'clothing': ['shirt', 'pants', 'dress', 'shoes', 'jacket', 'clothing', 'apparel', 'fashion', 'nike', 'adidas',
+                     'sneakers', 'boots', 'jeans', 'hoodie', 'coat', 'puma', 'reebok', 'air max'],
+        'food_beverage': ['food', 'drink', 'beverage', 'juice', 'water', 'coffee', 'tea', 'snack', 'coca', 'pepsi',
+                          'cola', 'soda', 'chocolate', 'candy', 'coca cola']
     }
-</style>
-""", unsafe_allow_html=True)
+    
+    def __init__(self, normalizer: Optional[TextNormalizer] = None, keywords: Optional[Dict[str, List[str]]] = None, min_score: float = 1.0, min_confidence: float = 0.5):
+        self.normalizer = normalizer or TextNormalizer()
+        self.min_score = min_score
+        self.min_confidence = min_confidence
+        self.index = {}  # Keyword ('coca' or 'coca cola') -> categories
+        for category, category_keywords in (keywords or self.CATEGORY_KEYWORDS).items():
+            for keyword in category_keywords:
+                self.index.setdefault(self.normalizer.normalize(keyword)['text'], []).append(category)
+        self.phrase_starts = {keyword.split()[0] for keyword in self.index if ' ' in keyword}
+    
+    def classify_tokens(self, tokens: Tuple[str, ...], lemmas: Optional[Tuple[str, ...]] = None) -> Dict:
+        """{'category', 'confidence', 'scores'} of a token stream"""
+        index = self.index
+        lemmas = lemmas or tokens
+        matched = set()
+        for position, token in enumerate(tokens):
+            if token in index:
+                matched.add(token)
+            elif lemmas[position] in index:
+                matched.add(lemmas[position])
+            if token in self.phrase_starts and position + 1 < len(tokens):
+                phrase = f"{token} {tokens[position + 1]}"
+                if phrase in index:
+                    matched.add(phrase)
+        
+        # Each distinct keyword counts once
+        scores = {}
+        for keyword in matched:
+            for category in index[keyword]:
+                scores[category] = scores.get(category, 0) + 1
+        
+        total = sum(scores.values())
+        if not total:
+            return {'category': 'general', 'confidence': 0.0, 'scores': scores}
+        
+        best = max(scores, key=scores.get)
+        confidence = scores[best] / total
+        if scores[best] < self.min_score or confidence <= self.min_confidence:
+            return {'category': 'general', 'confidence': 1 - confidence, 'scores': scores}
+        return {'category': best, 'confidence': confidence, 'scores': scores}
+    
+    def classify(self, description: str) -> Dict:
+        normalized = self.normalizer.normalize(description)
+        return self.classify_tokens(normalized['tokens'], normalized['lemmas'])
 
 # ========================= PRODUCT DESCRIPTION ENHANCER =========================
 
@@ -136,25 +324,16 @@ class ProductDescriptionEnhancer:
     """Professional product description enhancer for customs officials"""
     
     def __init__(self):
-        # Initialize NLTK components with error handling
-        try:
-            if nltk_ready:
-                self.lemmatizer = WordNetLemmatizer()
-                self.stop_words = set(stopwords.words('english'))
-                self.nltk_available = True
-            else:
-                self.nltk_available = False
-                self.stop_words = set(['the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'from', 'up', 'about', 'into', 'through', 'during', 'before', 'after', 'above', 'below', 'between', 'among', 'under', 'over', 'within', 'without', 'along', 'following', 'across', 'behind', 'beyond', 'plus', 'except', 'but', 'up', 'out', 'off', 'down', 'under', 'again', 'further', 'then', 'once'])
-        except Exception as e:
-            self.nltk_available = False
-            self.stop_words = set(['the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'])
-            st.warning(f"NLTK yuklanmadi, oddiy rejimda ishlaydi: {e}")
+        # The normalizer falls back to plain suffix stripping if WordNet cannot be loaded
+        self.nltk_available = bool(nltk_ready)
         
-        # Essential information categories for customs
+        # Essential information categories for customs. Patterns run on the
+        # normalizer's token text: casefolded, one space between tokens, units
+        # split from numbers ("256GB" -> "256 gb") and "-", "&" read as spaces
         self.essential_info_categories = {
             'brand': {
                 'patterns': [
-                    r'\b(apple|samsung|huawei|xiaomi|oppo|vivo|oneplus|google|sony|lg|nokia|motorola|realme|asus|acer|hp|dell|lenovo|msi|razer|alienware|microsoft|surface|bmw|mercedes|audi|toyota|honda|ford|volkswagen|hyundai|tesla|mazda|nissan|kia|lexus|porsche|jaguar|volvo|nike|adidas|puma|reebok|new balance|converse|vans|under armour|fila|gucci|prada|louis vuitton|chanel|hermes|versace|armani|calvin klein|tommy hilfiger|zara|h&m|uniqlo|gap|coca cola|pepsi|nestlé|unilever|procter|gamble|johnson|dove|loreal|maybelline|revlon|mac|clinique|estee lauder|lancome|dior|chanel|ysl|tom ford|rolex|omega|seiko|casio|citizen|tissot|tag heuer|breitling|cartier|chopard|bulgari|tiffany|pandora|swarovski|canon|nikon|fujifilm|olympus|panasonic|leica|pentax|gopro|dji|zhiyun|rode|bose|sennheiser|audio technica|beats|jbl|harman kardon|marshall|klipsch|polk|yamaha|pioneer|kenwood|alpine|focal|b&w|kef|q acoustics|monitor audio|elac|definitive technology|svs|rel|velodyne|paradigm|pmc|tannoy|spendor|proac|harbeth|wilson audio|magico|focal|dynaudio|b&w|kef|monitor audio|elac|definitive technology|svs|rel|velodyne|paradigm|pmc|tannoy|spendor|proac|harbeth|wilson audio|magico|focal|dynaudio)\b',
+                    r'\b(apple|samsung|huawei|xiaomi|oppo|vivo|oneplus|google|sony|lg|nokia|motorola|realme|asus|acer|hp|dell|lenovo|msi|razer|alienware|microsoft|surface|bmw|mercedes|audi|toyota|honda|ford|volkswagen|hyundai|tesla|mazda|nissan|kia|lexus|porsche|jaguar|volvo|nike|adidas|puma|reebok|new balance|converse|vans|under armour|fila|gucci|prada|louis vuitton|chanel|hermes|versace|armani|calvin klein|tommy hilfiger|zara|h m|uniqlo|gap|coca cola|pepsi|nestlé|unilever|procter|gamble|johnson|dove|loreal|maybelline|revlon|mac|clinique|estee lauder|lancome|dior|chanel|ysl|tom ford|rolex|omega|seiko|casio|citizen|tissot|tag heuer|breitling|cartier|chopard|bulgari|tiffany|pandora|swarovski|canon|nikon|fujifilm|olympus|panasonic|leica|pentax|gopro|dji|zhiyun|rode|bose|sennheiser|audio technica|beats|jbl|harman kardon|marshall|klipsch|polk|yamaha|pioneer|kenwood|alpine|focal|b w|kef|q acoustics|monitor audio|elac|definitive technology|svs|rel|velodyne|paradigm|pmc|tannoy|spendor|proac|harbeth|wilson audio|magico|focal|dynaudio|b w|kef|monitor audio|elac|definitive technology|svs|rel|velodyne|paradigm|pmc|tannoy|spendor|proac|harbeth|wilson audio|magico|focal|dynaudio)\b',
                     r'\b([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\b'
                 ],
                 'weight': 25
@@ -162,7 +341,7 @@ class ProductDescriptionEnhancer:
             'model': {
                 'patterns': [
                     r'\b(iphone\s+\d+\s*(?:pro|max|plus|mini|se)?)\b',
-                    r'\b(galaxy\s+[a-z]+\d+\s*(?:ultra|plus|pro)?)\b',
+                    r'\b(galaxy\s+[a-z]+\s*\d+\s*(?:ultra|plus|pro)?)\b',
                     r'\b(pixel\s+\d+\s*(?:pro|xl)?)\b',
                     r'\b(macbook\s+(?:air|pro)\s*\d*)\b',
                     r'\b(surface\s+(?:pro|laptop|book|studio)\s*\d*)\b',
@@ -175,13 +354,13 @@ class ProductDescriptionEnhancer:
             'technical_specs': {
                 'patterns': [
                     r'\b(\d+)\s*(gb|tb|mb)\s*(?:ram|memory|storage|ssd|hdd|rom)?\b',
-                    r'\b(\d+\.?\d*)\s*(inch|"|\')\s*(?:display|screen|monitor)?\b',
+                    r'\b(\d+\.?\d*)\s*(inch|inches|")(?!\w)\s*(?:display|screen|monitor)?',
                     r'\b(\d+)\s*(mp|megapixel|megapixels)\s*(?:camera)?\b',
                     r'\b(\d+)\s*(mah|wh|hours?)\s*(?:battery)?\b',
                     r'\b(\d+)\s*(hz|ghz|mhz)\s*(?:refresh|processor|cpu)?\b',
                     r'\b(\d+)\s*(core|cores)\s*(?:processor|cpu)?\b',
-                    r'\b(\d+k|4k|8k|uhd|hd|full hd|qhd)\b',
-                    r'\b(wifi|bluetooth|5g|4g|lte|3g|nfc|usb|hdmi|ethernet|wi-fi)\b',
+                    r'\b(\d+\s*k|uhd|hd|full hd|qhd)\b',
+                    r'\b(wifi|bluetooth|5g|4g|lte|3g|nfc|usb|hdmi|ethernet|wi fi)\b',
                     r'\b(android|ios|windows|macos|linux|chrome os)\s*(\d+\.?\d*)?\b',
                     r'\b(amoled|oled|lcd|led|qled|ips|tn|va|retina|super retina)\b'
                 ],
@@ -201,13 +380,13 @@ class ProductDescriptionEnhancer:
                 'patterns': [
                     r'\b(smartphone|phone|mobile|cellular|handset|device)\b',
                     r'\b(laptop|notebook|computer|pc|desktop|workstation|ultrabook|chromebook|macbook)\b',
-                    r'\b(tablet|ipad|slate|e-reader|kindle)\b',
+                    r'\b(tablet|ipad|slate|e reader|kindle)\b',
                     r'\b(television|tv|monitor|display|smart tv|led tv|oled tv)\b',
                     r'\b(camera|dslr|mirrorless|camcorder|webcam|action cam|security cam)\b',
                     r'\b(headphones|earphones|earbuds|headset|speakers|soundbar|audio)\b',
                     r'\b(watch|smartwatch|fitness tracker|wearable|band|strap)\b',
                     r'\b(car|vehicle|automobile|sedan|suv|hatchback|coupe|truck|van|motorcycle|bike|scooter)\b',
-                    r'\b(shirt|t-shirt|pants|jeans|dress|jacket|coat|shoes|sneakers|boots|sandals|clothing|apparel)\b',
+                    r'\b(shirt|t shirt|pants|jeans|dress|jacket|coat|shoes|sneakers|boots|sandals|clothing|apparel)\b',
                     r'\b(food|beverage|drink|juice|soda|water|coffee|tea|snack|candy|chocolate|supplement|vitamin)\b',
                     r'\b(furniture|chair|table|bed|sofa|desk|cabinet|shelf|lamp|mirror|curtain|carpet)\b',
                     r'\b(appliance|refrigerator|washing machine|microwave|oven|dishwasher|vacuum|cleaner|air conditioner)\b'
@@ -219,12 +398,21 @@ class ProductDescriptionEnhancer:
                     r'\b(20[0-9]{2})\s*(?:model|year|edition|version)?\b',
                     r'\b(?:model|year|edition|version)\s*(20[0-9]{2})\b',
                     r'\b(generation|gen)\s*(\d+)\b',
-                    r'\b(\d+)(?:st|nd|rd|th)\s*(?:generation|gen)\b'
+                    r'\b(\d+)\s*(?:st|nd|rd|th)\s*(?:generation|gen)\b'
                 ],
                 'weight': 10
             }
         }
         
+        # Patterns compiled once; the brand pattern for capitalized words relies on re.IGNORECASE
+        self.compiled_categories = {
+            category: [re.compile(pattern, re.IGNORECASE) for pattern in config['patterns']]
+            for category, config in self.essential_info_categories.items()
+        }
+        
+        self.normalizer = TextNormalizer(lemmatize=self.nltk_available)
+        self.category_classifier = CategoryClassifier(self.normalizer)
+        
         # Country and origin information
         self.country_patterns = [
             r'\b(made in|manufactured in|produced in|origin|country of origin|assembled in)\s*([a-z\s]+)\b',
@@ -240,6 +428,53 @@ class ProductDescriptionEnhancer:
     def analyze_description_completeness(self, description: str) -> Dict:
         """Analyze how complete the product description is for customs purposes"""
         
+        if not description or len(description.strip()) < 5:
+            return self._build_analysis(description, None, 0)
+        
+        category_matches = self._match_categories(description)
+        
+        # Calculate completeness score
+        total_possible_score = sum(config['weight'] for config in self.essential_info_categories.values())
+        achieved_score = sum(config['weight'] for category, config in self.essential_info_categories.items()
+                             if category_matches[category])
+        completeness_score = (achieved_score / total_possible_score) * 100 if total_possible_score > 0 else 0
+        
+        return self._build_analysis(description, category_matches, completeness_score)
+    
+    def analyze_descriptions_batch(self, descriptions: List[str]) -> List[Dict]:
+        """Analyze many descriptions at once.
+        
+        Repeated descriptions are matched once, and all completeness scores
+        come from one category-hit matrix times the category weights.
+        """
+        unique = list(dict.fromkeys(descriptions))
+        categories = list(self.essential_info_categories)
+        weights = np.array([self.essential_info_categories[category]['weight'] for category in categories], dtype=float)
+        
+        matches = [self._match_categories(description) if description and len(description.strip()) >= 5 else None
+                   for description in unique]
+        hits = np.array([[bool(category_matches and category_matches[category]) for category in categories]
+                         for category_matches in matches], dtype=float).reshape(len(unique), len(categories))
+        scores = hits @ weights / weights.sum() * 100
+        
+        analyses = {
+            description: self._build_analysis(description, category_matches, float(score) if category_matches is not None else 0)
+            for description, category_matches, score in zip(unique, matches, scores)
+        }
+        return [dict(analyses[description]) for description in descriptions]
+    
+    def _match_categories(self, description: str) -> Dict[str, List]:
+        """Pattern matches of each essential category, found in the shared normalized text"""
+        text = self.normalizer.normalize(description)['text']
+        category_matches = {}
+        for category, patterns in self.compiled_categories.items():
+            found_items = []
+            for pattern in patterns:
+                found_items.extend(pattern.findall(text))
+            category_matches[category] = found_items
+        return category_matches
+    
+    def _build_analysis(self, description: str, category_matches: Optional[Dict[str, List]], completeness_score: float) -> Dict:
         analysis = {
             'original_description': description,
             'completeness_score': 0,
@@ -250,36 +485,23 @@ class ProductDescriptionEnhancer:
             'recommendations': []
         }
         
-        if not description or len(description.strip()) < 5:
+        classification = self.category_classifier.classify(description)
+        analysis['product_category'] = classification['category']
+        analysis['category_confidence'] = classification['confidence']
+        
+        if category_matches is None:
             analysis['missing_elements'] = ['Description too short or empty']
             analysis['recommendations'] = ['Provide a detailed product description']
             return analysis
         
-        description_lower = description.lower()
-        total_possible_score = 0
-        achieved_score = 0
-        
         # Check each category
-        for category, config in self.essential_info_categories.items():
-            total_possible_score += config['weight']
-            category_found = False
-            found_items = []
-            
-            for pattern in config['patterns']:
-                matches = re.findall(pattern, description, re.IGNORECASE)
-                if matches:
-                    category_found = True
-                    found_items.extend(matches)
-            
-            if category_found:
-                achieved_score += config['weight']
+        for category, found_items in category_matches.items():
+            if found_items:
                 analysis['found_elements'][category] = found_items
             else:
                 analysis['missing_elements'].append(category)
         
-        # Calculate completeness score
-        if total_possible_score > 0:
-            analysis['completeness_score'] = (achieved_score / total_possible_score) * 100
+        analysis['completeness_score'] = completeness_score
         
         # Determine customs readiness
         if analysis['completeness_score'] >= 80:
@@ -316,17 +538,430 @@ class ProductDescriptionEnhancer:
         
         return recommendations
 
+# ========================= HOST LATENCY =========================
+
+class HostLatencyTracker:
+    """Recent response times and failures per host, for adaptive timeouts, hedging and cool-off.
+    
+    Timeouts and hedge delays come from the host's own latency percentiles
+    once it has `min_samples` responses, and from all hosts pooled before
+    that (most vendor sites are seen only a few times). A host that fails
+    `failure_limit` times in a row, or whose median latency is close to
+    the default timeout, is skipped for `cooloff` seconds.
+    """
+    
+    def __init__(self, window: int = 100, min_samples: int = 5, timeout_factor: float = 3.0, min_timeout: float = 2.0, failure_limit: int = 3, slow_fraction: float = 0.8, cooloff: float = 120.0):
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.failure_limit = failure_limit
+        self.slow_fraction = slow_fraction
+        self.cooloff = cooloff
+        self.hosts = {}
+        self.pooled = deque(maxlen=window * 10)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def host(url: str) -> str:
+        return urlparse(url).hostname or ''
+    
+    def _host_state(self, host: str) -> Dict:
+        if host not in self.hosts:
+            self.hosts[host] = {'latencies': deque(maxlen=self.window), 'failures': 0, 'cool_until': 0.0, 'requests': 0, 'failed': 0, 'cooled': 0}
+        return self.hosts[host]
+    
+    def _latencies(self, url: str) -> List[float]:
+        with self._lock:
+            state = self.hosts.get(self.host(url))
+            if state is not None and len(state['latencies']) >= self.min_samples:
+                return list(state['latencies'])
+            return list(self.pooled) if len(self.pooled) >= self.min_samples else []
+    
+    def timeout(self, url: str, default: float) -> float:
+        """A few times the usual p95 of the host, never above `default`"""
+        latencies = self._latencies(url)
+        if not latencies:
+            return default
+        return min(default, max(self.min_timeout, float(np.percentile(latencies, 95)) * self.timeout_factor))
+    
+    def hedge_after(self, url: str) -> Optional[float]:
+        """Seconds after which a download from this host is slower than 90% of them"""
+        latencies = self._latencies(url)
+        return float(np.percentile(latencies, 90)) if latencies else None
+    
+    def available(self, url: str) -> bool:
+        with self._lock:
+            state = self.hosts.get(self.host(url))
+            return state is None or state['cool_until'] <= time.monotonic()
+    
+    def record(self, url: str, seconds: float, ok: bool, default_timeout: float):
+        """Add a response (ok) or a timeout/connection/server error; cool the host off when it keeps failing or crawling"""
+        with self._lock:
+            state = self._host_state(self.host(url))
+            state['requests'] += 1
+            state['latencies'].append(seconds)
+            self.pooled.append(seconds)
+            state['failures'] = 0 if ok else state['failures'] + 1
+            state['failed'] += 0 if ok else 1
+            
+            crawling = len(state['latencies']) >= self.min_samples and float(np.median(state['latencies'])) >= default_timeout * self.slow_fraction
+            if state['failures'] >= self.failure_limit or crawling:
+                state['cool_until'] = time.monotonic() + self.cooloff
+                state['cooled'] += 1
+                state['failures'] = 0
+                state['latencies'].clear()
+    
+    def report(self, limit: int = 20) -> pd.DataFrame:
+        """Slowest hosts first, for the admin panel"""
+        now = time.monotonic()
+        with self._lock:
+            rows = [
+                {
+                    'host': host,
+                    'requests': state['requests'],
+                    'failed': state['failed'],
+                    'p50_ms': float(np.percentile(state['latencies'], 50)) * 1000 if state['latencies'] else None,
+                    'p90_ms': float(np.percentile(state['latencies'], 90)) * 1000 if state['latencies'] else None,
+                    'cooloffs': state['cooled'],
+                    'cooling_s': max(state['cool_until'] - now, 0.0)
+                }
+                for host, state in self.hosts.items()
+            ]
+        return pd.DataFrame(rows).sort_values(['cooling_s', 'p90_ms'], ascending=False).head(limit) if rows else pd.DataFrame(rows)
+
+# ========================= SOURCE YIELD =========================
+
+class SourceYieldStore:
+    """How often pages of each domain filled missing elements, used to rank and skip search results.
+    
+    Domains are ordered by their yield, shrunk towards the average of all
+    domains while they have few pages, so unknown domains keep the search
+    engine's order among themselves. Domains with `min_pages` or more pages
+    and a yield below `skip_below` are not downloaded at all. An `explore`
+    share of the rankings keeps the search order and skips nothing, so
+    domains can recover. Counts are added to SQLite every `flush_every`
+    pages and at the end of a batch.
+    """
+    
+    # Pseudo-observations (pages, useful) for sites that rarely carry specifications
+    PRIORS = {domain: (4, 0) for domain in ['youtube.com', 'facebook.com', 'instagram.com', 'tiktok.com', 'reddit.com', 'quora.com', 'pinterest.com', 'twitter.com', 'x.com', 'vk.com']}
+    
+    def __init__(self, db_path: Optional[Path] = None, min_pages: int = 8, skip_below: float = 0.1, explore: float = 0.05, prior_weight: float = 2.0, flush_every: int = 100):
+        self.db_path = Path(db_path) if db_path else DATA_DIR / 'source_yield.db'
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.min_pages = min_pages
+        self.skip_below = skip_below
+        self.explore = explore
+        self.prior_weight = prior_weight
+        self.flush_every = flush_every
+        self.pending = {}  # Domain -> [pages, useful] not yet written
+        self.skipped = 0
+        self.random = random.Random()
+        self._lock = threading.Lock()
+        
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS source_yield ('
+                'domain TEXT PRIMARY KEY, pages INTEGER NOT NULL, useful INTEGER NOT NULL, updated_at TEXT NOT NULL)'
+            )
+            self.counts = {domain: [pages, useful] for domain, pages, useful in conn.execute('SELECT domain, pages, useful FROM source_yield')}
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    @staticmethod
+    def domain(url: str) -> str:
+        host = urlparse(url).hostname or ''
+        for prefix in ('www.', 'm.'):
+            if host.startswith(prefix):
+                return host[len(prefix):]
+        return host
+    
+    def _yield(self, domain: str, average: float) -> Tuple[float, int]:
+        pages, useful = self.counts.get(domain, (0, 0))
+        prior_pages, prior_useful = self.PRIORS.get(domain, (0, 0))
+        pages, useful = pages + prior_pages, useful + prior_useful
+        return (useful + self.prior_weight * average) / (pages + self.prior_weight), pages
+    
+    def rank(self, candidates: List[Dict]) -> List[Dict]:
+        """Search results to download, best-yielding domains first"""
+        with self._lock:
+            if self.random.random() < self.explore:
+                return list(candidates)
+            
+            total_pages = sum(pages for pages, _ in self.counts.values())
+            average = sum(useful for _, useful in self.counts.values()) / total_pages if total_pages else 0.5
+            scored = []
+            for rank, result in enumerate(candidates):
+                domain_yield, pages = self._yield(self.domain(result['link']), average)
+                if pages >= self.min_pages and domain_yield < self.skip_below:
+                    self.skipped += 1
+                    continue
+                scored.append((-domain_yield, rank, result))
+        return [result for _, _, result in sorted(scored, key=lambda item: item[:2])]
+    
+    def record(self, url: str, useful: bool):
+        domain = self.domain(url)
+        with self._lock:
+            for counts in (self.counts.setdefault(domain, [0, 0]), self.pending.setdefault(domain, [0, 0])):
+                counts[0] += 1
+                counts[1] += int(useful)
+            flush = sum(pages for pages, _ in self.pending.values()) >= self.flush_every
+        if flush:
+            self.flush()
+    
+    def flush(self):
+        """Add the pending counts to the database (other processes add theirs too)"""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO source_yield (domain, pages, useful, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(domain) DO UPDATE SET pages = pages + excluded.pages, useful = useful + excluded.useful, updated_at = excluded.updated_at',
+                [(domain, pages, useful, now) for domain, (pages, useful) in pending.items()]
+            )
+    
+    def report(self, limit: int = 20) -> pd.DataFrame:
+        """Domains with the most pages and their yield, for the admin panel"""
+        with self._lock:
+            rows = [{'domain': domain, 'pages': pages, 'useful': useful, 'yield': useful / pages} for domain, (pages, useful) in self.counts.items() if pages]
+        return pd.DataFrame(rows).sort_values('pages', ascending=False).head(limit) if rows else pd.DataFrame(rows)
+
 # ========================= ENHANCED WEB SCRAPER =========================
 
-class CustomsReadyProductScraper:
-    """Scraper focused on getting customs-ready product information"""
+class PageParser:
+    """Page parsing and pattern extraction, without network state.
+    
+    The scraper is one; the parse processes of HybridBatchPipeline build
+    their own, so they do not start a fetch pool or load an analyzer.
+    """
     
     def __init__(self):
+        # Patterns applied once to every downloaded page; the extractors
+        # work from the compact per-page records they produce
+        self.page_patterns = {
+            'brand': re.compile(r'\b(Apple|Samsung|Huawei|Xiaomi|BMW|Mercedes|Nike|Adidas|Coca Cola|Pepsi|Sony|LG|Dell|HP|Lenovo|Asus|MSI|Canon|Nikon|Bose|JBL|Rolex|Omega|Gucci|Prada|Louis Vuitton|Chanel|Toyota|Honda|Ford|Volkswagen|Audi|Porsche|Jaguar|Volvo|Tesla|Hyundai|Kia|Mazda|Nissan|Lexus|Infiniti|Acura|Cadillac|Chevrolet|Dodge|Jeep|Ram|GMC|Buick|Lincoln|Chrysler|Fiat|Alfa Romeo|Maserati|Ferrari|Lamborghini|Bentley|Rolls Royce|Aston Martin|McLaren|Bugatti|Koenigsegg|Pagani)\b', re.IGNORECASE),
+            'brand_short': re.compile(r'\b(Apple|Samsung|Huawei|Xiaomi|BMW|Mercedes|Nike|Adidas|Coca Cola|Pepsi|Sony|LG|Dell|HP|Lenovo|Asus)\b', re.IGNORECASE),
+            'models': [re.compile(pattern, re.IGNORECASE) for pattern in [
+                r'\b(iPhone\s+\d+\s*(?:Pro|Max|Plus|Mini|SE)?)\b',
+                r'\b(Galaxy\s+[A-Z]+\d+\s*(?:Ultra|Plus|Pro)?)\b',
+                r'\b(Pixel\s+\d+\s*(?:Pro|XL)?)\b',
+                r'\b(MacBook\s+(?:Air|Pro)\s*\d*)\b',
+                r'\b(iPad\s+(?:Pro|Air|Mini)?\s*\d*)\b'
+            ]],
+            'specs': [re.compile(pattern, re.IGNORECASE) for pattern in [
+                r'\b(\d+(?:GB|TB|MB))\b',
+                r'\b(\d+\.?\d*(?:inch|"))\b',
+                r'\b(\d+MP)\b',
+                r'\b(\d+mAh)\b',
+                r'\b(4K|8K|HD|Full HD|UHD)\b',
+                r'\b(WiFi|Bluetooth|5G|4G|LTE|NFC)\b'
+            ]],
+            'enhanced_color': re.compile(r'\b(Black|White|Red|Blue|Green|Yellow|Orange|Purple|Pink|Gray|Grey|Silver|Gold|Rose|Space|Midnight|Starlight|Alpine|Sierra|Pacific|Phantom|Mystic|Prism|Aura|Titanium|Ceramic|Leather|Aluminum|Steel|Plastic|Glass|Carbon|Fiber)\b', re.IGNORECASE),
+            'year': re.compile(r'\b(20[0-9]{2})\b'),
+            'memory': re.compile(r'\b(\d+(?:GB|TB|MB))\b', re.IGNORECASE),
+            'display': re.compile(r'\b(\d+\.?\d*(?:inch|"))\b', re.IGNORECASE),
+            'camera': re.compile(r'\b(\d+MP)\b', re.IGNORECASE),
+            'battery': re.compile(r'\b(\d+mAh)\b', re.IGNORECASE),
+            'connectivity': re.compile(r'\b(WiFi|Bluetooth|5G|4G|LTE|NFC|USB|HDMI|Ethernet)\b', re.IGNORECASE),
+            'color': re.compile(r'\b(Black|White|Red|Blue|Green|Yellow|Orange|Purple|Pink|Gray|Grey|Silver|Gold|Rose|Space|Midnight|Starlight|Alpine|Sierra|Pacific|Phantom|Mystic|Prism|Aura|Titanium|Ceramic)\b', re.IGNORECASE),
+            'material': re.compile(r'\b(Aluminum|Steel|Plastic|Glass|Carbon|Fiber|Leather|Silicone|Rubber|Wood|Metal|Ceramic|Titanium)\b', re.IGNORECASE),
+            'dimensions': re.compile(r'\b(\d+\.?\d*\s*(?:mm|cm|inch|"))\b', re.IGNORECASE),
+            'weight': re.compile(r'\b(\d+\.?\d*\s*(?:g|kg|lbs|oz))\b', re.IGNORECASE),
+            'operating_system': re.compile(r'\b(Android|iOS|Windows|macOS|Linux|Chrome OS)\s*(\d+\.?\d*)?\b', re.IGNORECASE),
+            'years': re.compile(r'\b(20[0-9]{2})\b'),
+            'special_features': re.compile(r'\b(Waterproof|Wireless|Fast Charging|Face ID|Touch ID|Fingerprint|Dual SIM|Triple Camera|Quad Camera|AI|Smart|Pro|Max|Ultra|Premium|Limited Edition)\b', re.IGNORECASE),
+            'country_origin': re.compile(r'\b(?:Made in|Manufactured in|Origin|Country of origin|Assembled in)\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\b', re.IGNORECASE)
+        }
+        self.first_match_fields = ['brand', 'brand_short', 'enhanced_color', 'year']
+        self.distinct_match_fields = ['memory', 'display', 'camera', 'battery', 'connectivity',
+                                      'color', 'material', 'dimensions', 'weight',
+                                      'years', 'special_features', 'country_origin']
+        
+        # Page text is untrusted: it is scanned through the guarded matcher ('models.0', 'specs.3', ...)
+        self.page_matcher = PatternMatcher({
+            f"{key}.{index}" if isinstance(value, list) else key: pattern.pattern
+            for key, value in self.page_patterns.items()
+            for index, pattern in (enumerate(value) if isinstance(value, list) else [(None, value)])
+        })
+    
+    def _parse_search_results(self, content: bytes) -> List[Dict]:
+        """Parse result titles and links from a search results page"""
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
+            results = []
+                
+            for result in soup.select('div.g')[:5]:
+                title_elem = result.select_one('h3')
+                link_elem = result.select_one('a')
+                
+                if title_elem and link_elem:
+                    title = title_elem.get_text(strip=True)
+                    link = link_elem.get('href')
+                    
+                    if link and 'http' in link:
+                        results.append({
+                            'title': title,
+                            'link': link
+                        })
+            
+            return results
+            
+        except Exception:
+            return []
+    
+    def _page_record(self, content: bytes) -> Optional[Dict]:
+        """Parse a downloaded page straight into its compact record"""
+        page_info = self._parse_page(content)
+        if not page_info:
+            return None
+        return self._summarize_page(page_info['text'])
+    
+    def _parse_page(self, content: bytes) -> Optional[Dict]:
+        """Parse a downloaded page into text and structured data"""
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
+            
+            # Extract text content
+            text_content = soup.get_text()
+            
+            # Extract structured data
+            structured_data = {
+                'title': self._extract_title(soup),
+                'description': self._extract_description(soup),
+                'specifications': self._extract_specifications(soup),
+                'features': self._extract_features(soup)
+            }
+            
+            return {
+                'text': text_content,
+                'structured': structured_data
+            }
+            
+        except Exception:
+            return None
+    
+    def _extract_title(self, soup: BeautifulSoup) -> str:
+        """Extract page title"""
+        title_elem = soup.find('title')
+        return title_elem.get_text(strip=True) if title_elem else ''
+    
+    def _extract_description(self, soup: BeautifulSoup) -> str:
+        """Extract page description"""
+        desc_elem = soup.find('meta', {'name': 'description'})
+        if desc_elem:
+            return desc_elem.get('content', '')
+        
+        # Try other description sources
+        og_desc = soup.find('meta', {'property': 'og:description'})
+        if og_desc:
+            return og_desc.get('content', '')
+        
+        return ''
+    
+    def _extract_specifications(self, soup: BeautifulSoup) -> Dict:
+        """Extract technical specifications"""
+        specs = {}
+        
+        # Look for specification tables
+        spec_tables = soup.find_all('table')
+        for table in spec_tables:
+            rows = table.find_all('tr')
+            for row in rows:
+                cols = row.find_all(['td', 'th'])
+                if len(cols) >= 2:
+                    key = cols[0].get_text(strip=True)
+                    value = cols[1].get_text(strip=True)
+                    if key and value:
+                        specs[key] = value
+        
+        return specs
+    
+    def _extract_features(self, soup: BeautifulSoup) -> List[str]:
+        """Extract product features"""
+        features = []
+        
+        # Look for feature lists
+        feature_lists = soup.find_all(['ul', 'ol'])
+        for ul in feature_lists:
+            items = ul.find_all('li')
+            for item in items:
+                text = item.get_text(strip=True)
+                if text and len(text) > 10 and len(text) < 100:
+                    features.append(text)
+        
+        return features[:10]  # Limit to 10 features
+    
+    def _summarize_page(self, text: str) -> Dict:
+        """Run every extractor pattern over one page and keep only the matches.
+        
+        The record is small enough to pass between processes. Records of
+        several pages merge to the same matches as scanning the joined text.
+        """
+        scan = self.page_matcher.scan(text)
+        
+        def distinct(name):
+            return list(dict.fromkeys(scan.findall(name)))
+        
+        record = {
+            'text_length': len(text),
+            'models': [scan.first(f"models.{index}") for index in range(len(self.page_patterns['models']))],
+            'specs': [distinct(f"specs.{index}") for index in range(len(self.page_patterns['specs']))],
+            'operating_system': list(dict.fromkeys(
+                f"{match[0]} {match[1]}" if match[1] else match[0]
+                for match in scan.findall('operating_system')
+            ))
+        }
+        for key in self.first_match_fields:
+            record[key] = scan.first(key)
+        for key in self.distinct_match_fields:
+            record[key] = distinct(key)
+        
+        # Patterns that ran out of time on this page
+        record['timed_out'] = scan.timed_out
+        return record
+    
+    def _merge_page_records(self, records: List[Dict]) -> Dict:
+        """Combine page records in page order"""
+        merged = {
+            'text_length': sum(record['text_length'] for record in records) + max(len(records) - 1, 0),
+            'models': [next((record['models'][index] for record in records if record['models'][index]), None)
+                       for index in range(len(self.page_patterns['models']))],
+            'specs': [list(dict.fromkeys(spec for record in records for spec in record['specs'][index]))
+                      for index in range(len(self.page_patterns['specs']))],
+            'operating_system': list(dict.fromkeys(value for record in records for value in record['operating_system'])),
+            'timed_out': list(dict.fromkeys(name for record in records for name in record.get('timed_out', [])))
+        }
+        for key in self.first_match_fields:
+            merged[key] = next((record[key] for record in records if record[key]), None)
+        for key in self.distinct_match_fields:
+            merged[key] = list(dict.fromkeys(value for record in records for value in record[key]))
+        
+        return merged
+
+class CustomsReadyProductScraper(PageParser):
+    """Scraper focused on getting customs-ready product information"""
+    
+    def __init__(self, enhancer: Optional[ProductDescriptionEnhancer] = None):
+        super().__init__()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         }
         self.session = requests.Session()
         self.session.headers.update(self.headers)
+        self.enrichment_cache: Optional['EnrichmentCache'] = None  # Set to remember results for the instant path
+        self.cassette: Optional['CassetteAdapter'] = None  # Mounted by attach_cassette to record or replay traffic
+        self.host_latency = HostLatencyTracker()
+        self.source_yield: Optional[SourceYieldStore] = None  # Set to rank and skip result links by learned domain yield
+        self.catalog: Optional['ProductCatalogIndex'] = None  # Set to fill exact GTIN / model-number hits without scraping
+        self.fetch_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='page-fetch')  # Hedged page downloads
+        self.pages_per_search = 2  # Pages used from each search
         
         # Specialized search strategies for different product types
         self.search_strategies = {
@@ -361,10 +996,44 @@ class CustomsReadyProductScraper:
                 '{product} official information'
             ]
         }
+        
+        # Analyzer used to re-check which missing elements are already filled
+        self.analyzer = enhancer or ProductDescriptionEnhancer()
+        
+        # Keywords telling which missing element a query targets. Only elements
+        # that _create_enhanced_description can add are listed here
+        self.query_targets = {
+            'brand': ['brand', 'manufacturer'],
+            'model': ['model', 'version'],
+            'technical_specs': ['specifications', 'specs', 'technical', 'features', 'engine'],
+            'physical_attributes': ['dimensions', 'size', 'weight', 'material', 'fabric', 'color'],
+            'year_model': ['year', 'released']
+        }
+        self.max_queries = 6  # Limit queries per product to avoid rate limiting
+        self._template_targets = functools.lru_cache(maxsize=256)(self._match_template_targets)
     
-    def enhance_product_description(self, original_description: str, missing_elements: List[str]) -> Dict:
+    def enhance_product_description(self, original_description: str, missing_elements: List[str], budget: Optional['BatchBudget'] = None) -> Dict:
         """Enhance product description for customs readiness"""
         
+        # Exact catalog hits need no searching
+        catalog_result = self._catalog_enhancement(original_description)
+        if catalog_result is not None:
+            return catalog_result
+        
+        # Determine product category for targeted search
+        category = self._determine_product_category(original_description)
+        
+        # Create targeted search plan
+        search_plan = self._plan_search_queries(original_description, category, missing_elements)
+        
+        # Execute searches until the missing elements are filled
+        collected_info = self._execute_searches(search_plan, original_description, missing_elements, budget)
+        
+        return self._build_enhancement_result(original_description, collected_info)
+    
+    def _build_enhancement_result(self, original_description: str, collected_info: Dict) -> Dict:
+        """Turn the collected page information into an enhancement result"""
+        
         enhancement_result = {
             'original_description': original_description,
             'enhanced_description': original_description,
@@ -375,18 +1044,11 @@ class CustomsReadyProductScraper:
             'physical_attributes': {},
             'sources_used': [],
             'confidence_score': 0,
-            'customs_readiness_improved': False
+            'customs_readiness_improved': False,
+            'requests_made': 0,
+            'timed_out_patterns': []
         }
         
-        # Determine product category for targeted search
-        category = self._determine_product_category(original_description)
-        
-        # Create targeted search queries
-        search_queries = self._create_search_queries(original_description, category, missing_elements)
-        
-        # Execute searches and collect information
-        collected_info = self._execute_searches(search_queries)
-        
         # Process and enhance the description
         enhanced_description = self._create_enhanced_description(original_description, collected_info)
         enhancement_result['enhanced_description'] = enhanced_description
@@ -400,6 +1062,8 @@ class CustomsReadyProductScraper:
         # Track improvements
         enhancement_result['improvements_made'] = self._track_improvements(original_description, enhanced_description)
         enhancement_result['sources_used'] = [source['title'] for source in collected_info.get('sources', [])]
+        enhancement_result['requests_made'] = collected_info.get('requests_made', 0)
+        enhancement_result['timed_out_patterns'] = self._collected_record(collected_info)['timed_out']
         
         # Calculate confidence score
         enhancement_result['confidence_score'] = self._calculate_confidence_score(collected_info)
@@ -409,253 +1073,344 @@ class CustomsReadyProductScraper:
         enhanced_score = len(enhanced_description.split())
         enhancement_result['customs_readiness_improved'] = enhanced_score > original_score * 1.5
         
+        if self.enrichment_cache is not None:
+            self.enrichment_cache.put(original_description, enhancement_result)
+        
         return enhancement_result
     
-    def _determine_product_category(self, description: str) -> str:
-        """Determine the most likely product category"""
-        desc_lower = description.lower()
-        
-        category_keywords = {
-            'electronics': ['phone', 'smartphone', 'laptop', 'computer', 'tablet', 'tv', 'camera', 'headphones', 'watch', 'smartwatch'],
-            'automotive': ['car', 'vehicle', 'auto', 'truck', 'motorcycle', 'bike', 'sedan', 'suv', 'bmw', 'mercedes', 'toyota'],
-            'clothing': ['shirt', 'pants', 'dress', 'shoes', 'jacket', 'clothing', 'apparel', 'fashion', 'nike', 'adidas'],
-            'food_beverage': ['food', 'drink', 'beverage', 'juice', 'water', 'coffee', 'tea', 'snack', 'coca', 'pepsi']
-        }
-        
-        category_scores = {}
-        for category, keywords in category_keywords.items():
-            score = sum(1 for keyword in keywords if keyword in desc_lower)
-            category_scores[category] = score
+    def _catalog_enhancement(self, original_description: str) -> Optional[Dict]:
+        """Enhancement from the product catalog entry of a GTIN or model number in the description, None without a hit"""
+        entry = self.catalog.lookup(original_description) if self.catalog is not None else None
+        if entry is None:
+            return None
         
-        if category_scores:
-            return max(category_scores, key=category_scores.get)
+        contains = self.analyzer.normalizer.contains
+        enhanced = original_description
+        if entry['brand'] and not contains(enhanced, entry['brand']):
+            enhanced = f"{entry['brand']} {enhanced}"
+        name_words = [word for word in entry['name'].split() if not contains(enhanced, word)]
+        for value in [' '.join(name_words), entry['model'], entry['category']]:
+            if value and not contains(enhanced, value):
+                enhanced = f"{enhanced} {value}"
+        specs_found = [value for value in entry['specs'].values() if not contains(enhanced, value)]
+        if specs_found:
+            enhanced += f" - {', '.join(specs_found[:6])}"
+        enhanced = re.sub(r'\s+', ' ', enhanced).strip()
         
-        return 'general'
+        label = 'GTIN' if entry['match'] == 'gtin' else 'Model'
+        original_score = len(original_description.split())
+        return {
+            'original_description': original_description,
+            'enhanced_description': enhanced,
+            'improvements_made': [f"Katalogdan to'ldirildi ({label} {entry['matched']})"] + self._track_improvements(original_description, enhanced),
+            'additional_specs': {'category': [entry['category']] if entry['category'] else [], 'gtin': [entry['gtin']] if entry['gtin'] else []},
+            'brand_model_found': {'brand': entry['brand'], 'model': entry['model'], 'series': entry['name']},
+            'technical_details': {key: [value] for key, value in entry['specs'].items()},
+            'physical_attributes': {},
+            'sources_used': [f"Katalog: {entry['name'] or entry['model'] or entry['gtin']}"],
+            'confidence_score': 100 if entry['match'] == 'gtin' else 90,
+            'customs_readiness_improved': len(enhanced.split()) > original_score * 1.5,
+            'requests_made': 0,
+            'timed_out_patterns': [],
+            'catalog_match': {'by': entry['match'], 'key': entry['matched']}
+        }
+    
+    def _determine_product_category(self, description: str) -> str:
+        """Determine the most likely product category ('general' when unclear)"""
+        return self.analyzer.category_classifier.classify(description)['category']
     
     def _create_search_queries(self, description: str, category: str, missing_elements: List[str]) -> List[str]:
         """Create targeted search queries based on missing elements"""
-        queries = []
+        return [item['query'] for item in self._plan_search_queries(description, category, missing_elements)]
+    
+    def _plan_search_queries(self, description: str, category: str, missing_elements: List[str]) -> List[Dict]:
+        """Create search queries annotated with the missing elements they target"""
+        templates = []
         
         # Base queries from strategy
-        base_queries = self.search_strategies.get(category, self.search_strategies['general'])
-        for query_template in base_queries:
-            queries.append(query_template.format(product=description))
+        templates.extend(self.search_strategies.get(category, self.search_strategies['general']))
         
         # Targeted queries for missing elements
         if 'brand' in missing_elements:
-            queries.append(f"{description} brand manufacturer who makes")
+            templates.append("{product} brand manufacturer who makes")
         
         if 'model' in missing_elements:
-            queries.append(f"{description} model number version type")
+            templates.append("{product} model number version type")
         
         if 'technical_specs' in missing_elements:
-            queries.append(f"{description} technical specifications features")
+            templates.append("{product} technical specifications features")
         
         if 'physical_attributes' in missing_elements:
-            queries.append(f"{description} dimensions size weight color material")
+            templates.append("{product} dimensions size weight color material")
         
         if 'year_model' in missing_elements:
-            queries.append(f"{description} year model when released")
+            templates.append("{product} year model when released")
+        
+        plan = []
+        for template in templates:
+            plan.append({
+                'query': template.format(product=description),
+                'targets': self._template_targets(template)
+            })
+        
+        fillable = [element for element in missing_elements if element in self.query_targets]
+        return self._order_search_plan(plan, fillable)[:self.max_queries]
+    
+    def _match_template_targets(self, template: str) -> Tuple[str, ...]:
+        """Elements a query template targets; templates are fixed, so this is worked out once"""
+        template_lower = template.lower()
+        return tuple(element for element, keywords in self.query_targets.items()
+                     if any(keyword in template_lower for keyword in keywords))
+    
+    def _order_search_plan(self, plan: List[Dict], unfilled: List[str]) -> List[Dict]:
+        """Order queries by how many unfilled elements they target, dropping spent ones"""
+        ordered = []
+        for position, item in enumerate(plan):
+            if item['targets']:
+                hits = len(set(item['targets']) & set(unfilled))
+                if hits == 0:
+                    continue
+            else:
+                hits = 0.5  # General queries are kept as a fallback
+            ordered.append((-hits, position, item))
         
-        return queries[:6]  # Limit to 6 queries to avoid rate limiting
+        ordered.sort(key=lambda entry: entry[:2])
+        return [item for _, _, item in ordered]
+    
+    def _unfilled_elements(self, description: str, collected_info: Dict, elements: List[str]) -> List[str]:
+        """Re-check which elements are still missing after the collected information"""
+        enhanced = self._create_enhanced_description(description, collected_info)
+        analysis = self.analyzer.analyze_description_completeness(enhanced)
+        return [element for element in elements if element in analysis['missing_elements']]
+    
+    def _record_yield(self, description: str, elements: List[str], url: str, record: Dict):
+        """Credit a page's domain when the page alone fills one of the product's missing elements"""
+        if self.source_yield is None or not elements:
+            return
+        useful = len(self._unfilled_elements(description, {'records': [record]}, elements)) < len(elements)
+        self.source_yield.record(url, useful)
     
-    def _execute_searches(self, queries: List[str]) -> Dict:
-        """Execute multiple searches and collect information"""
+    def _execute_searches(self, search_plan: List[Dict], description: str, missing_elements: List[str], budget: Optional['BatchBudget'] = None) -> Dict:
+        """Execute searches and collect information until the missing elements are filled"""
         collected_info = {
-            'raw_text': [],
+            'records': [],
             'sources': [],
-            'structured_data': {}
+            'structured_data': {},
+            'requests_made': 0
         }
         
-        for query in queries:
-            try:
-                # Perform Google search
-                search_results = self._google_search(query)
-                
-                # Extract information from top results
-                for result in search_results[:2]:  # Top 2 results per query
-                    page_info = self._extract_page_information(result['link'])
-                    if page_info:
-                        collected_info['raw_text'].append(page_info['text'])
-                        collected_info['sources'].append({
+        unfilled = [element for element in missing_elements if element in self.query_targets]
+        fillable = list(unfilled)
+        remaining = list(search_plan)
+        
+        def acquire() -> bool:
+            if budget and not budget.allows(collected_info['requests_made']):
+                return False
+            collected_info['requests_made'] += 1
+            if budget:
+                budget.charge()
+            return True
+        
+        while remaining and unfilled:
+            if budget and not budget.allows(collected_info['requests_made']):
+                break
+            
+            query = remaining.pop(0)['query']
+            try:
+                # Perform Google search (charged only if the request is sent)
+                search_results = self._google_search(query, acquire)
+                
+                # Extract information from the top results
+                for result, content in self._fetch_hedged(search_results, self.pages_per_search, acquire):
+                    page_info = self._parse_page(content)
+                    if page_info:
+                        record = self._summarize_page(page_info['text'])
+                        self._record_yield(description, fillable, result['link'], record)
+                        collected_info['records'].append(record)
+                        collected_info['sources'].append({
                             'title': result['title'],
                             'url': result['link']
                         })
+                        
+                        # Stop as soon as nothing is left to fill
+                        unfilled = self._unfilled_elements(description, collected_info, unfilled)
+                        if not unfilled:
+                            break
+                
+                remaining = self._order_search_plan(remaining, unfilled)
                 
                 # Rate limiting
-                time.sleep(1)
+                if remaining and unfilled:
+                    time.sleep(1)
                 
             except Exception as e:
                 continue
         
         return collected_info
     
-    def _google_search(self, query: str) -> List[Dict]:
+    def _google_search(self, query: str, acquire: Optional[Callable[[], bool]] = None) -> List[Dict]:
         """Perform Google search and return results"""
-        try:
-            search_url = f"https://www.google.com/search?q={quote_plus(query)}&num=5"
-            response = self.session.get(search_url, timeout=10)
-            
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.content, 'html.parser')
-                results = []
-                
-                for result in soup.select('div.g')[:5]:
-                    title_elem = result.select_one('h3')
-                    link_elem = result.select_one('a')
-                    
-                    if title_elem and link_elem:
-                        title = title_elem.get_text(strip=True)
-                        link = link_elem.get('href')
-                        
-                        if link and 'http' in link:
-                            results.append({
-                                'title': title,
-                                'link': link
-                            })
-                
-                return results
-            
-            return []
-            
-        except Exception:
+        content = self._http_get(self._search_url(query), timeout=10, acquire=acquire)
+        if content is None:
             return []
+        return self._parse_search_results(content)
     
-    def _extract_page_information(self, url: str) -> Optional[Dict]:
-        """Extract relevant information from a web page"""
+    def _search_url(self, query: str) -> str:
+        return f"https://www.google.com/search?q={quote_plus(query)}&num=5"
+    
+    def _http_get(self, url: str, timeout: float, acquire: Optional[Callable[[], bool]] = None) -> Optional[bytes]:
+        """GET a URL and return the body of a successful response.
+        
+        `timeout` is the ceiling; hosts with a latency history get a
+        shorter one, and hosts cooling off are not contacted at all.
+        `acquire` is called just before the request is sent, so only sent
+        requests are charged; nothing is sent when it returns False.
+        """
+        if not self.host_latency.available(url):
+            return None
+        if acquire is not None and not acquire():
+            return None
+        
+        started = time.monotonic()
         try:
-            response = self.session.get(url, timeout=8)
+            response = self.session.get(url, timeout=self.host_latency.timeout(url, timeout))
+            self.host_latency.record(url, time.monotonic() - started, response.status_code < 500, timeout)
             if response.status_code != 200:
                 return None
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Extract text content
-            text_content = soup.get_text()
-            
-            # Extract structured data
-            structured_data = {
-                'title': self._extract_title(soup),
-                'description': self._extract_description(soup),
-                'specifications': self._extract_specifications(soup),
-                'features': self._extract_features(soup)
-            }
-            
-            return {
-                'text': text_content,
-                'structured': structured_data
-            }
-            
+            return response.content
+        
         except Exception:
+            self.host_latency.record(url, time.monotonic() - started, False, timeout)
             return None
     
-    def _extract_title(self, soup: BeautifulSoup) -> str:
-        """Extract page title"""
-        title_elem = soup.find('title')
-        return title_elem.get_text(strip=True) if title_elem else ''
-    
-    def _extract_description(self, soup: BeautifulSoup) -> str:
-        """Extract page description"""
-        desc_elem = soup.find('meta', {'name': 'description'})
-        if desc_elem:
-            return desc_elem.get('content', '')
+    def _fetch_hedged(self, candidates: List[Dict], wanted: int, acquire: Callable[[], bool], on_response: Optional[Callable[[Optional[bytes]], None]] = None) -> List[Tuple[Dict, bytes]]:
+        """Download `wanted` pages from ranked search results, hedging slow hosts.
         
-        # Try other description sources
-        og_desc = soup.find('meta', {'property': 'og:description'})
-        if og_desc:
-            return og_desc.get('content', '')
+        The top `wanted` results start together. When a download fails, or
+        runs past its host's p90 latency, the next candidate is started next
+        to it and the first pages to arrive are used. Every started download
+        is charged through `acquire`; downloads still running at the end are
+        abandoned. Pages are returned in result rank order.
+        """
+        if self.source_yield is not None:
+            candidates = self.source_yield.rank(candidates)
+        waiting = [(rank, result) for rank, result in enumerate(candidates) if self.host_latency.available(result['link'])]
+        running = {}  # Future -> (rank, result, hedge deadline)
+        pages = []
         
-        return ''
-    
-    def _extract_specifications(self, soup: BeautifulSoup) -> Dict:
-        """Extract technical specifications"""
-        specs = {}
+        def start_next() -> bool:
+            # Skip hosts that started cooling off since ranking, before charging for them
+            while waiting and not self.host_latency.available(waiting[0][1]['link']):
+                waiting.pop(0)
+            if not waiting or not acquire():
+                return False
+            rank, result = waiting.pop(0)
+            future = self.fetch_pool.submit(self._fetch_page, result['link'])
+            if on_response:
+                future.add_done_callback(lambda done: on_response(done.result()))
+            hedge_after = self.host_latency.hedge_after(result['link'])
+            running[future] = (rank, result, time.monotonic() + hedge_after if hedge_after is not None else None)
+            return True
         
-        # Look for specification tables
-        spec_tables = soup.find_all('table')
-        for table in spec_tables:
-            rows = table.find_all('tr')
-            for row in rows:
-                cols = row.find_all(['td', 'th'])
-                if len(cols) >= 2:
-                    key = cols[0].get_text(strip=True)
-                    value = cols[1].get_text(strip=True)
-                    if key and value:
-                        specs[key] = value
+        for _ in range(wanted):
+            start_next()
         
-        return specs
+        while running and len(pages) < wanted:
+            deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+            timeout = max(min(deadlines) - time.monotonic(), 0.0) if deadlines else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                rank, result, _ = running.pop(future)
+                content = future.result()
+                if content is not None:
+                    pages.append((rank, result, content))
+                elif len(pages) + len(running) < wanted:
+                    start_next()
+            
+            # Hedge each download that passed its deadline (once)
+            now = time.monotonic()
+            for future, (rank, result, deadline) in list(running.items()):
+                if deadline is not None and deadline <= now:
+                    running[future] = (rank, result, None)
+                    start_next()
+        
+        return [(result, content) for _, result, content in sorted(pages, key=lambda page: page[0])[:wanted]]
     
-    def _extract_features(self, soup: BeautifulSoup) -> List[str]:
-        """Extract product features"""
-        features = []
+    def _extract_page_information(self, url: str) -> Optional[Dict]:
+        """Extract relevant information from a web page"""
+        content = self._fetch_page(url)
+        if content is None:
+            return None
+        return self._parse_page(content)
+    
+    def _fetch_page(self, url: str) -> Optional[bytes]:
+        """Download a web page"""
+        return self._http_get(url, timeout=8)
+    
+    def _collected_record(self, collected_info: Dict) -> Dict:
+        return self._merge_page_records(collected_info.get('records', []))
+    
+    def _project_collected(self, collected_info: Dict, description: str) -> Dict:
+        """Information collected for a product family as seen by one member.
         
-        # Look for feature lists
-        feature_lists = soup.find_all(['ul', 'ol'])
-        for ul in feature_lists:
-            items = ul.find_all('li')
-            for item in items:
-                text = item.get_text(strip=True)
-                if text and len(text) > 10 and len(text) < 100:
-                    features.append(text)
+        Whatever the member already states (its model, memory, colour, ...)
+        is dropped from the shared record, so variant specifics are never
+        overwritten by the ones of the scraped representative.
+        """
+        patterns = self.page_patterns
+        record = dict(self._collected_record(collected_info))
+        record['models'] = [None if pattern.search(description) else model for pattern, model in zip(patterns['models'], record['models'])]
+        record['specs'] = [[] if pattern.search(description) else specs for pattern, specs in zip(patterns['specs'], record['specs'])]
+        for key in ['enhanced_color', 'year']:
+            if patterns[key].search(description):
+                record[key] = None
+        for key in self.distinct_match_fields:
+            if patterns[key].search(description):
+                record[key] = []
         
-        return features[:10]  # Limit to 10 features
+        return {**collected_info, 'records': [record], 'requests_made': 0}
     
     def _create_enhanced_description(self, original: str, collected_info: Dict) -> str:
         """Create enhanced product description"""
         enhanced = original
         
-        # Extract key information from collected text
-        all_text = ' '.join(collected_info.get('raw_text', []))
+        # Key information from the collected pages
+        page = self._collected_record(collected_info)
+        
+        # Presence checks compare normalized tokens, so "256 gb" already covers "256GB"
+        contains = self.analyzer.normalizer.contains
         
         # Extract brand if missing
-        brand_match = re.search(r'\b(Apple|Samsung|Huawei|Xiaomi|BMW|Mercedes|Nike|Adidas|Coca Cola|Pepsi|Sony|LG|Dell|HP|Lenovo|Asus|MSI|Canon|Nikon|Bose|JBL|Rolex|Omega|Gucci|Prada|Louis Vuitton|Chanel|Toyota|Honda|Ford|Volkswagen|Audi|Porsche|Jaguar|Volvo|Tesla|Hyundai|Kia|Mazda|Nissan|Lexus|Infiniti|Acura|Cadillac|Chevrolet|Dodge|Jeep|Ram|GMC|Buick|Lincoln|Chrysler|Fiat|Alfa Romeo|Maserati|Ferrari|Lamborghini|Bentley|Rolls Royce|Aston Martin|McLaren|Bugatti|Koenigsegg|Pagani)\b', all_text, re.IGNORECASE)
-        if brand_match and brand_match.group(1).lower() not in original.lower():
-            enhanced = f"{brand_match.group(1)} {enhanced}"
+        if page['brand'] and not contains(original, page['brand']):
+            enhanced = f"{page['brand']} {enhanced}"
         
         # Extract model information
-        model_patterns = [
-            r'\b(iPhone\s+\d+\s*(?:Pro|Max|Plus|Mini|SE)?)\b',
-            r'\b(Galaxy\s+[A-Z]+\d+\s*(?:Ultra|Plus|Pro)?)\b',
-            r'\b(Pixel\s+\d+\s*(?:Pro|XL)?)\b',
-            r'\b(MacBook\s+(?:Air|Pro)\s*\d*)\b',
-            r'\b(iPad\s+(?:Pro|Air|Mini)?\s*\d*)\b'
-        ]
-        
-        for pattern in model_patterns:
-            model_match = re.search(pattern, all_text, re.IGNORECASE)
-            if model_match and model_match.group(1).lower() not in original.lower():
-                enhanced = f"{enhanced} {model_match.group(1)}"
+        for model in page['models']:
+            if model and not contains(original, model):
+                enhanced = f"{enhanced} {model}"
                 break
         
         # Extract technical specifications
-        spec_patterns = [
-            r'\b(\d+(?:GB|TB|MB))\b',
-            r'\b(\d+\.?\d*(?:inch|"))\b',
-            r'\b(\d+MP)\b',
-            r'\b(\d+mAh)\b',
-            r'\b(4K|8K|HD|Full HD|UHD)\b',
-            r'\b(WiFi|Bluetooth|5G|4G|LTE|NFC)\b'
-        ]
-        
         specs_found = []
-        for pattern in spec_patterns:
-            spec_matches = re.findall(pattern, all_text, re.IGNORECASE)
+        seen_specs = set()
+        for spec_matches in page['specs']:
             for spec in spec_matches:
-                if spec not in enhanced and spec not in specs_found:
+                spec_text = self.analyzer.normalizer.normalize(spec)['text']
+                if spec_text not in seen_specs and not contains(enhanced, spec):
                     specs_found.append(spec)
+                    seen_specs.add(spec_text)
         
         if specs_found:
             enhanced += f" - {', '.join(specs_found[:5])}"
         
         # Extract color information
-        color_match = re.search(r'\b(Black|White|Red|Blue|Green|Yellow|Orange|Purple|Pink|Gray|Grey|Silver|Gold|Rose|Space|Midnight|Starlight|Alpine|Sierra|Pacific|Phantom|Mystic|Prism|Aura|Titanium|Ceramic|Leather|Aluminum|Steel|Plastic|Glass|Carbon|Fiber)\b', all_text, re.IGNORECASE)
-        if color_match and color_match.group(1).lower() not in original.lower():
-            enhanced += f" - {color_match.group(1)}"
+        if page['enhanced_color'] and not contains(original, page['enhanced_color']):
+            enhanced += f" - {page['enhanced_color']}"
         
         # Extract year information
-        year_match = re.search(r'\b(20[0-9]{2})\b', all_text)
-        if year_match and year_match.group(1) not in original:
-            enhanced += f" ({year_match.group(1)} model)"
+        if page['year'] and not contains(original, page['year']):
+            enhanced += f" ({page['year']} model)"
         
         # Clean up the enhanced description
         enhanced = re.sub(r'\s+', ' ', enhanced).strip()
@@ -664,7 +1419,7 @@ class CustomsReadyProductScraper:
     
     def _extract_brand_model(self, collected_info: Dict) -> Dict:
         """Extract brand and model information"""
-        all_text = ' '.join(collected_info.get('raw_text', []))
+        page = self._collected_record(collected_info)
         
         brand_model = {
             'brand': '',
@@ -673,262 +1428,3538 @@ class CustomsReadyProductScraper:
         }
         
         # Extract brand
-        brand_match = re.search(r'\b(Apple|Samsung|Huawei|Xiaomi|BMW|Mercedes|Nike|Adidas|Coca Cola|Pepsi|Sony|LG|Dell|HP|Lenovo|Asus)\b', all_text, re.IGNORECASE)
-        if brand_match:
-            brand_model['brand'] = brand_match.group(1)
-        
-        # Extract model
-        model_patterns = [
-            r'\b(iPhone\s+\d+\s*(?:Pro|Max|Plus|Mini|SE)?)\b',
-            r'\b(Galaxy\s+[A-Z]+\d+\s*(?:Ultra|Plus|Pro)?)\b',
-            r'\b(Pixel\s+\d+\s*(?:Pro|XL)?)\b'
-        ]
+        if page['brand_short']:
+            brand_model['brand'] = page['brand_short']
         
-        for pattern in model_patterns:
-            model_match = re.search(pattern, all_text, re.IGNORECASE)
-            if model_match:
-                brand_model['model'] = model_match.group(1)
+        # Extract model (iPhone, Galaxy and Pixel patterns)
+        for model in page['models'][:3]:
+            if model:
+                brand_model['model'] = model
                 break
         
         return brand_model
     
     def _extract_technical_details(self, collected_info: Dict) -> Dict:
         """Extract technical details"""
-        all_text = ' '.join(collected_info.get('raw_text', []))
-        
-        tech_details = {
-            'memory': [],
-            'display': [],
-            'camera': [],
-            'battery': [],
-            'connectivity': [],
+        page = self._collected_record(collected_info)
+        
+        return {
+            'memory': page['memory'],
+            'display': page['display'],
+            'camera': page['camera'],
+            'battery': page['battery'],
+            'connectivity': page['connectivity'],
             'processor': []
         }
+    
+    def _extract_physical_attributes(self, collected_info: Dict) -> Dict:
+        """Extract physical attributes"""
+        page = self._collected_record(collected_info)
+        
+        return {
+            'color': page['color'],
+            'material': page['material'],
+            'dimensions': page['dimensions'],
+            'weight': page['weight']
+        }
+    
+    def _extract_additional_specs(self, collected_info: Dict) -> Dict:
+        """Extract additional specifications"""
+        page = self._collected_record(collected_info)
+        
+        return {
+            'operating_system': page['operating_system'],
+            'year': page['years'],
+            'special_features': page['special_features'],
+            'country_origin': page['country_origin']
+        }
+    
+    def _track_improvements(self, original: str, enhanced: str) -> List[str]:
+        """Track what improvements were made"""
+        improvements = []
+        
+        if len(enhanced) > len(original) * 1.2:
+            improvements.append("Tavsif uzaytirildi")
+        
+        # Only tokens the enhancement added count
+        added = self.analyzer.normalizer.normalize(enhanced)['token_set'] - self.analyzer.normalizer.normalize(original)['token_set']
+        
+        if added & {'apple', 'samsung', 'bmw', 'mercedes', 'nike', 'adidas'}:
+            improvements.append("Brend qo'shildi")
+        
+        if added & {'gb', 'tb', 'inch', 'mp', 'mah'}:
+            improvements.append("Texnik xususiyatlar qo'shildi")
+        
+        if added & {'black', 'white', 'red', 'blue', 'silver', 'gold'}:
+            improvements.append("Rang ma'lumoti qo'shildi")
         
-        # Memory
-        memory_matches = re.findall(r'\b(\d+(?:GB|TB|MB))\b', all_text, re.IGNORECASE)
-        tech_details['memory'] = list(set(memory_matches))
+        if any(re.fullmatch(r'20[0-9]{2}', token) for token in added):
+            improvements.append("Yil ma'lumoti qo'shildi")
         
-        # Display
-        display_matches = re.findall(r'\b(\d+\.?\d*(?:inch|"))\b', all_text, re.IGNORECASE)
-        tech_details['display'] = list(set(display_matches))
+        return improvements
+    
+    def _calculate_confidence_score(self, collected_info: Dict) -> float:
+        """Calculate confidence score for the enhancement"""
+        score = 0
         
-        # Camera
-        camera_matches = re.findall(r'\b(\d+MP)\b', all_text, re.IGNORECASE)
-        tech_details['camera'] = list(set(camera_matches))
+        # Base score for having sources
+        sources_count = len(collected_info.get('sources', []))
+        score += min(sources_count * 15, 60)
         
-        # Battery
-        battery_matches = re.findall(r'\b(\d+mAh)\b', all_text, re.IGNORECASE)
-        tech_details['battery'] = list(set(battery_matches))
+        # Score for text content
+        text_length = self._collected_record(collected_info)['text_length']
+        if text_length > 1000:
+            score += 20
+        elif text_length > 500:
+            score += 15
+        elif text_length > 200:
+            score += 10
         
-        # Connectivity
-        connectivity_matches = re.findall(r'\b(WiFi|Bluetooth|5G|4G|LTE|NFC|USB|HDMI|Ethernet)\b', all_text, re.IGNORECASE)
-        tech_details['connectivity'] = list(set(connectivity_matches))
+        # Score for structured data
+        structured_data = collected_info.get('structured_data', {})
+        if structured_data:
+            score += 20
         
-        return tech_details
+        return min(score, 100)
+
+# ========================= BATCH BUDGET =========================
+
+class BatchBudget:
+    """Wall-clock and request budget shared by every product of a batch run"""
     
-    def _extract_physical_attributes(self, collected_info: Dict) -> Dict:
-        """Extract physical attributes"""
-        all_text = ' '.join(collected_info.get('raw_text', []))
+    def __init__(self, time_limit: Optional[float] = None, max_requests: Optional[int] = None, per_product_requests: Optional[int] = None):
+        # None or 0 means unlimited
+        self.deadline = time.monotonic() + time_limit if time_limit else None
+        self.max_requests = max_requests or None
+        self.per_product_requests = per_product_requests or None
+        self.requests_made = 0
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+    
+    def cancel(self):
+        """Stop outstanding work; products in flight stop before their next request"""
+        self.cancelled.set()
+    
+    def exhausted(self) -> bool:
+        """True once the run is cancelled, the deadline has passed or all requests are spent"""
+        if self.cancelled.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        if self.max_requests is not None and self.requests_made >= self.max_requests:
+            return True
+        return False
+    
+    def allows(self, product_requests: int) -> bool:
+        """Check whether a product that already made `product_requests` may make another"""
+        if self.per_product_requests is not None and product_requests >= self.per_product_requests:
+            return False
+        return not self.exhausted()
+    
+    def charge(self, requests_count: int = 1):
+        """Record outbound requests"""
+        with self._lock:
+            self.requests_made += requests_count
+    
+    def acquire(self, product_requests: int) -> bool:
+        """Atomically check `allows` and charge one request; used by concurrent workers"""
+        with self._lock:
+            if not self.allows(product_requests):
+                return False
+            self.requests_made += 1
+            return True
+    
+    def remaining_time(self) -> Optional[float]:
+        """Seconds left until the deadline"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+# ========================= BATCH CHECKPOINT =========================
+
+class BatchCheckpoint:
+    """Durable store of completed result rows, keyed by input file hash, row position and ID.
+    
+    The position keeps rows that share an ID (a file may repeat one) apart.
+    """
+    
+    def __init__(self, file_hash: str, db_path: Optional[Path] = None):
+        self.file_hash = file_hash
+        self.db_path = Path(db_path) if db_path else DATA_DIR / 'checkpoints.db'
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
         
-        attributes = {
-            'color': [],
-            'material': [],
-            'dimensions': [],
-            'weight': []
-        }
+        with self._connect() as conn:
+            # Checkpoints from before rows were keyed by position cannot be matched to a row; drop them
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(checkpoints)')}
+            if columns and 'position' not in columns:
+                conn.execute('DROP TABLE checkpoints')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoints ('
+                'file_hash TEXT NOT NULL, position INTEGER NOT NULL, row_id TEXT NOT NULL, result TEXT NOT NULL, '
+                'PRIMARY KEY (file_hash, position, row_id))'
+            )
+    
+    @staticmethod
+    def hash_file(content: bytes) -> str:
+        """Hash of the uploaded file content"""
+        return hashlib.sha256(content).hexdigest()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    def load(self) -> Dict[Tuple[int, str], Dict]:
+        """Return the completed rows of this file by (position, ID)"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT position, row_id, result FROM checkpoints WHERE file_hash = ?', (self.file_hash,)).fetchall()
+        return {(position, row_id): json.loads(result) for position, row_id, result in rows}
+    
+    def save(self, position: int, result_row: Dict):
+        """Persist a completed row"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO checkpoints (file_hash, position, row_id, result) VALUES (?, ?, ?, ?)',
+                (self.file_hash, position, str(result_row['ID']), json.dumps(result_row, ensure_ascii=False, default=str))
+            )
+    
+    def clear(self, positions: Optional[List[int]] = None):
+        """Forget the completed rows of this file, or only those at `positions`"""
+        with self._connect() as conn:
+            if positions is None:
+                conn.execute('DELETE FROM checkpoints WHERE file_hash = ?', (self.file_hash,))
+            else:
+                conn.executemany(
+                    'DELETE FROM checkpoints WHERE file_hash = ? AND position = ?',
+                    [(self.file_hash, position) for position in positions]
+                )
+
+# ========================= ENRICHMENT CACHE =========================
+
+class EnrichmentCache:
+    """Enhancement results of past scrapes, keyed by normalized description"""
+    
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = Path(db_path) if db_path else DATA_DIR / 'enrichment.db'
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS enrichment ('
+                'cache_key TEXT PRIMARY KEY, result TEXT NOT NULL, updated_at TEXT NOT NULL)'
+            )
+    
+    @staticmethod
+    def key(description: str) -> str:
+        return ' '.join(str(description).casefold().split())
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    def get(self, description: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT result FROM enrichment WHERE cache_key = ?', (self.key(description),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+    
+    def put(self, description: str, enhancement_result: Dict):
+        """Keep a result that found sources; empty (budget-skipped) results never replace a good one"""
+        if not enhancement_result.get('sources_used'):
+            return
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO enrichment (cache_key, result, updated_at) VALUES (?, ?, ?)',
+                (self.key(description), json.dumps(enhancement_result, ensure_ascii=False, default=str), datetime.now().isoformat(timespec='seconds'))
+            )
+
+# ========================= HS NOMENCLATURE INDEX =========================
+
+HS_NOMENCLATURE_PATH = Path(os.environ.get('CUSTOMS_HS_NOMENCLATURE', DATA_DIR / 'hs_nomenclature.csv'))
+
+class HSNomenclatureIndex:
+    """BM25 index over a local HS / TN VED nomenclature file, memory-mapped from disk.
+    
+    BM25 weights are precomputed per (term, entry) and stored as term-major CSR arrays
+    (indptr/indices/data .npy files), so a batch of descriptions is scored with one sparse
+    product of its term matrix and the postings. Subheadings also index the text of their
+    4-digit heading, since their own text is often just "other".
+    """
+    
+    normalizer = TextNormalizer()  # No lemmatizer: index and queries must tokenize alike everywhere
+    TOKENIZER_VERSION = 2
+    code_columns = ['code', 'hs_code', 'kod', 'hs_kod', 'код']
+    text_columns = ['description', 'name', 'tavsif', 'nomi', 'наименование', 'описание']
+    
+    def __init__(self, index_dir: Path):
+        meta = json.loads((index_dir / 'meta.json').read_text(encoding='utf-8'))
+        self.codes = meta['codes']
+        self.descriptions = meta['descriptions']
+        self.vocabulary = {term: position for position, term in enumerate(meta['terms'])}
+        self.indptr = np.load(index_dir / 'indptr.npy', mmap_mode='r')
+        self.indices = np.load(index_dir / 'indices.npy', mmap_mode='r')
+        self.weights = np.load(index_dir / 'data.npy', mmap_mode='r')
+        self.matrix = None
+        if SCIPY_AVAILABLE:
+            self.matrix = scipy_sparse.csr_matrix((self.weights, self.indices, self.indptr), shape=(len(self.vocabulary), len(self.codes)), copy=False)
+    
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return [lemma for lemma in cls.normalizer.normalize(str(text))['lemmas'] if len(lemma) > 1]
+    
+    @staticmethod
+    def _source_signature(source: Path) -> Dict:
+        stat = source.stat()
+        return {'path': str(source.resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    
+    @classmethod
+    def open(cls, source: Path, index_dir: Optional[Path] = None) -> 'HSNomenclatureIndex':
+        """Load the index of a nomenclature file, rebuilding it when the file has changed"""
+        source = Path(source)
+        index_dir = Path(index_dir) if index_dir else DATA_DIR / 'hs_index'
+        meta_path = index_dir / 'meta.json'
+        
+        meta = json.loads(meta_path.read_text(encoding='utf-8')) if meta_path.exists() else {}
+        if meta.get('source') != cls._source_signature(source) or meta.get('tokenizer') != cls.TOKENIZER_VERSION:
+            cls.build(source, index_dir)
+        return cls(index_dir)
+    
+    @classmethod
+    def open_default(cls) -> Optional['HSNomenclatureIndex']:
+        """Index of HS_NOMENCLATURE_PATH, or None when no nomenclature file is installed"""
+        if not HS_NOMENCLATURE_PATH.exists():
+            return None
+        return cls.open(HS_NOMENCLATURE_PATH)
+    
+    @classmethod
+    def _pick_column(cls, columns: List[str], candidates: List[str], fallback: int) -> str:
+        lowered = {str(column).strip().lower(): column for column in columns}
+        for candidate in candidates:
+            if candidate in lowered:
+                return lowered[candidate]
+        return columns[fallback]
+    
+    @classmethod
+    def build(cls, source: Path, index_dir: Path, k1: float = 1.2, b: float = 0.75):
+        """Precompute BM25 postings of a nomenclature file (code and description columns)"""
+        table = read_products_file(source, source.name).dropna(how='all')
+        columns = list(table.columns)
+        code_column = cls._pick_column(columns, cls.code_columns, 0)
+        text_column = cls._pick_column(columns, cls.text_columns, 1)
+        
+        codes = [re.sub(r'\D', '', str(code)) for code in table[code_column]]
+        descriptions = [str(text).strip() for text in table[text_column]]
+        entries = [(code, text) for code, text in zip(codes, descriptions) if code and text]
+        codes = [code for code, _ in entries]
+        descriptions = [text for _, text in entries]
+        
+        headings = {code: text for code, text in entries if len(code) == 4}
+        documents = [
+            cls.tokenize(text if len(code) <= 4 else f"{headings.get(code[:4], '')} {text}")
+            for code, text in entries
+        ]
+        
+        # Term-major postings with BM25 weights
+        lengths = np.array([len(tokens) for tokens in documents], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 1.0
+        postings = {}
+        for doc_id, tokens in enumerate(documents):
+            for term, count in pd.Series(tokens, dtype=object).value_counts().items():
+                postings.setdefault(term, []).append((doc_id, count))
+        
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indices, data = [], []
+        for position, term in enumerate(terms):
+            doc_ids, counts = zip(*postings[term])
+            doc_ids = np.array(doc_ids, dtype=np.int32)
+            counts = np.array(counts, dtype=np.float32)
+            idf = np.log(1 + (len(documents) - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norm = k1 * (1 - b + b * lengths[doc_ids] / average_length)
+            indices.append(doc_ids)
+            data.append((idf * counts * (k1 + 1) / (counts + norm)).astype(np.float32))
+            indptr[position + 1] = indptr[position] + len(doc_ids)
+        
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.save(index_dir / 'indptr.npy', indptr)
+        np.save(index_dir / 'indices.npy', np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32))
+        np.save(index_dir / 'data.npy', np.concatenate(data) if data else np.zeros(0, dtype=np.float32))
+        (index_dir / 'meta.json').write_text(json.dumps({
+            'source': cls._source_signature(source),
+            'tokenizer': cls.TOKENIZER_VERSION,
+            'codes': codes,
+            'descriptions': descriptions,
+            'terms': terms
+        }, ensure_ascii=False), encoding='utf-8')
+    
+    def _score_chunk(self, descriptions: List[str]) -> np.ndarray:
+        """Dense (descriptions x entries) BM25 scores of one chunk"""
+        rows, columns = [], []
+        for row, description in enumerate(descriptions):
+            terms = {self.vocabulary[token] for token in self.tokenize(description) if token in self.vocabulary}
+            rows.extend([row] * len(terms))
+            columns.extend(terms)
+        
+        if self.matrix is not None:
+            query = scipy_sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(descriptions), len(self.vocabulary)))
+            return (query @ self.matrix).toarray()
+        
+        # Same product without scipy: gather the postings of every (row, term) pair
+        starts, ends = self.indptr[columns], self.indptr[np.array(columns, dtype=np.int64) + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.zeros((len(descriptions), len(self.codes)), dtype=np.float32)
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        cells = np.repeat(np.array(rows, dtype=np.int64), lengths) * len(self.codes) + self.indices[positions]
+        scores = np.bincount(cells, weights=self.weights[positions], minlength=len(descriptions) * len(self.codes))
+        return scores.reshape(len(descriptions), len(self.codes))
+    
+    def suggest_batch(self, descriptions: List[str], k: int = 3, chunk_size: int = 512) -> List[List[Dict]]:
+        """Top-k nomenclature entries for every description"""
+        suggestions = []
+        for start in range(0, len(descriptions), chunk_size):
+            scores = self._score_chunk(list(descriptions[start:start + chunk_size]))
+            top = min(k, scores.shape[1])
+            if top == 0:
+                suggestions.extend([] for _ in range(scores.shape[0]))
+                continue
+            
+            best = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+            for row, candidates in enumerate(best):
+                ranked = sorted(candidates, key=lambda doc_id: -scores[row, doc_id])
+                suggestions.append([
+                    {'code': self.codes[doc_id], 'heading': self.codes[doc_id][:4], 'description': self.descriptions[doc_id], 'score': round(float(scores[row, doc_id]), 2)}
+                    for doc_id in ranked if scores[row, doc_id] > 0
+                ])
+        return suggestions
+    
+    def suggest(self, description: str, k: int = 5) -> List[Dict]:
+        return self.suggest_batch([description], k)[0]
+
+def format_hs_suggestions(suggestions: List[Dict]) -> str:
+    """Compact 'code (score)' list for result tables"""
+    return '; '.join(f"{item['code']} ({item['score']:.1f})" for item in suggestions)
+
+# ========================= PRODUCT CATALOG =========================
+
+PRODUCT_CATALOG_PATH = Path(os.environ.get('CUSTOMS_PRODUCT_CATALOG', DATA_DIR / 'product_catalog.csv'))
+
+class ProductCatalogIndex:
+    """Exact GTIN/EAN/UPC and model-number lookups in a local product catalog dump, memory-mapped from disk.
+    
+    GTINs (padded to 14 digits) and 64-bit hashes of normalized model numbers
+    are kept as sorted .npy arrays next to the entries' JSON records, so every
+    process opens the same files read-only and shares them through the page
+    cache; one lookup is a binary search over the key array.
+    """
+    
+    FORMAT_VERSION = 1
+    gtin_columns = ['gtin', 'ean', 'upc', 'barcode', 'shtrix_kod', 'shtrixkod', 'штрихкод']
+    model_columns = ['model', 'mpn', 'model_number', 'part_number', 'artikul', 'артикул']
+    brand_columns = ['brand', 'brend', 'manufacturer', 'бренд', 'производитель']
+    name_columns = ['name', 'title', 'nomi', 'tovar_nomi', 'наименование']
+    category_columns = ['category', 'kategoriya', 'категория']
+    
+    gtin_pattern = re.compile(r'(?<!\d)(\d{8}(?:\d{4,6})?)(?!\d)')
+    key_pattern = re.compile(r'[^A-Z0-9]')
+    token_pattern = re.compile(r'[A-Za-z0-9][A-Za-z0-9\-/.]*[A-Za-z0-9]')
+    unit_pattern = re.compile(r'\d+(?:\.\d+)?(?:GB|TB|MB|MAH|MP|HZ|GHZ|MHZ|W|WH|MM|CM|M|KG|G|ML|L|INCH|K|CORE|CORES|GEN|ST|ND|RD|TH)')
+    
+    def __init__(self, index_dir: Path):
+        meta = json.loads((index_dir / 'meta.json').read_text(encoding='utf-8'))
+        self.entries = meta['entries']
+        # Plain ndarray views of the mapped files skip np.memmap's per-call overhead
+        arrays = {name: np.load(index_dir / f'{name}.npy', mmap_mode='r').view(np.ndarray) for name in ['gtin_keys', 'gtin_rows', 'model_keys', 'model_rows', 'offsets']}
+        self.gtin_keys, self.gtin_rows = arrays['gtin_keys'], arrays['gtin_rows']
+        self.model_keys, self.model_rows = arrays['model_keys'], arrays['model_rows']
+        self.offsets = arrays['offsets']
+        with open(index_dir / 'records.bin', 'rb') as records:
+            self.records = mmap.mmap(records.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(records.fileno()).st_size else b''
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def valid_gtin(code: str) -> bool:
+        """GS1 check digit of an 8, 12, 13 or 14 digit code"""
+        if len(code) not in (8, 12, 13, 14) or not code.isdigit():
+            return False
+        digits = [int(digit) for digit in reversed(code[:-1])]
+        total = sum(digit * (3 if position % 2 == 0 else 1) for position, digit in enumerate(digits))
+        return (10 - total % 10) % 10 == int(code[-1])
+    
+    @staticmethod
+    def model_key(model: str) -> str:
+        return ProductCatalogIndex.key_pattern.sub('', str(model).upper())
+    
+    @staticmethod
+    def model_hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    
+    @classmethod
+    def detect_gtins(cls, text: str) -> List[str]:
+        """Codes with a valid check digit, padded to GTIN-14"""
+        return list(dict.fromkeys(code.zfill(14) for code in cls.gtin_pattern.findall(str(text)) if cls.valid_gtin(code)))
+    
+    @classmethod
+    def detect_models(cls, text: str) -> List[str]:
+        """Normalized model-number candidates: mixed letter/digit tokens and adjacent token pairs, longest first"""
+        tokens = cls.token_pattern.findall(str(text))
+        candidates = tokens + [f'{first}{second}' for first, second in zip(tokens, tokens[1:])]
+        keys = []
+        for candidate in candidates:
+            key = cls.model_key(candidate)
+            if len(key) >= 4 and not key.isdigit() and not key.isalpha() and not cls.unit_pattern.fullmatch(key):
+                keys.append(key)
+        return sorted(dict.fromkeys(keys), key=len, reverse=True)
+    
+    @staticmethod
+    def _source_signature(source: Path) -> Dict:
+        stat = source.stat()
+        return {'path': str(source.resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    
+    @classmethod
+    def open(cls, source: Path, index_dir: Optional[Path] = None) -> 'ProductCatalogIndex':
+        """Load the index of a catalog dump, rebuilding it when the dump has changed"""
+        source = Path(source)
+        index_dir = Path(index_dir) if index_dir else DATA_DIR / 'catalog_index'
+        meta_path = index_dir / 'meta.json'
+        
+        meta = json.loads(meta_path.read_text(encoding='utf-8')) if meta_path.exists() else {}
+        if meta.get('source') != cls._source_signature(source) or meta.get('format') != cls.FORMAT_VERSION:
+            cls.build(source, index_dir)
+        return cls(index_dir)
+    
+    @classmethod
+    def open_default(cls) -> Optional['ProductCatalogIndex']:
+        """Index of PRODUCT_CATALOG_PATH, or None when no catalog dump is installed"""
+        if not PRODUCT_CATALOG_PATH.exists():
+            return None
+        return cls.open(PRODUCT_CATALOG_PATH)
+    
+    @staticmethod
+    def _find_column(columns: List[str], candidates: List[str]) -> Optional[str]:
+        lowered = {str(column).strip().lower(): column for column in columns}
+        return next((lowered[candidate] for candidate in candidates if candidate in lowered), None)
+    
+    @staticmethod
+    def _cell(value) -> str:
+        """Cell text; barcodes read as floats lose their '.0'"""
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value).strip()
+    
+    @classmethod
+    def build(cls, source: Path, index_dir: Path):
+        """Write sorted GTIN and model-hash keys and the JSON records of a catalog dump"""
+        table = read_products_file(source, source.name).dropna(how='all')
+        columns = list(table.columns)
+        gtin_column = cls._find_column(columns, cls.gtin_columns)
+        model_column = cls._find_column(columns, cls.model_columns)
+        brand_column = cls._find_column(columns, cls.brand_columns)
+        name_column = cls._find_column(columns, cls.name_columns)
+        category_column = cls._find_column(columns, cls.category_columns)
+        known = {gtin_column, model_column, brand_column, name_column, category_column}
+        spec_columns = [column for column in columns if column not in known]
+        
+        gtin_keys, gtin_rows, model_keys, model_rows = [], [], [], []
+        offsets = [0]
+        index_dir.mkdir(parents=True, exist_ok=True)
+        with open(index_dir / 'records.bin', 'wb') as records:
+            for row in table.itertuples(index=False):
+                values = dict(zip(columns, row))
+                gtin = re.sub(r'\D', '', cls._cell(values.get(gtin_column)))
+                model = cls._cell(values.get(model_column))
+                gtin = gtin.zfill(14) if 8 <= len(gtin) <= 14 and cls.valid_gtin(gtin.zfill(14)) else ''  # Leading zeros may be lost in the dump
+                if not gtin and len(cls.model_key(model)) < 4:
+                    continue
+                
+                entry = {
+                    'gtin': gtin,
+                    'model': model,
+                    'brand': cls._cell(values.get(brand_column)),
+                    'name': cls._cell(values.get(name_column)),
+                    'category': cls._cell(values.get(category_column)),
+                    'specs': {str(column): cls._cell(values[column]) for column in spec_columns if cls._cell(values[column])}
+                }
+                row_id = len(offsets) - 1
+                if gtin:
+                    gtin_keys.append(int(gtin))
+                    gtin_rows.append(row_id)
+                if len(cls.model_key(model)) >= 4:
+                    model_keys.append(cls.model_hash(cls.model_key(model)))
+                    model_rows.append(row_id)
+                data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+                records.write(data)
+                offsets.append(offsets[-1] + len(data))
+        
+        # First entry wins for duplicate keys
+        for name, keys, rows, dtype in [('gtin', gtin_keys, gtin_rows, np.int64), ('model', model_keys, model_rows, np.uint64)]:
+            keys, first = np.unique(np.array(keys, dtype=dtype), return_index=True)
+            np.save(index_dir / f'{name}_keys.npy', keys)
+            np.save(index_dir / f'{name}_rows.npy', np.array(rows, dtype=np.int32)[first])
+        np.save(index_dir / 'offsets.npy', np.array(offsets, dtype=np.int64))
+        (index_dir / 'meta.json').write_text(json.dumps({
+            'source': cls._source_signature(source),
+            'format': cls.FORMAT_VERSION,
+            'entries': len(offsets) - 1
+        }, ensure_ascii=False), encoding='utf-8')
+    
+    def _entry(self, row: int) -> Dict:
+        start, end = self.offsets[row:row + 2].tolist()
+        return json.loads(self.records[start:end])
+    
+    @staticmethod
+    def _search(keys: np.ndarray, wanted: np.ndarray) -> List[int]:
+        """Position of every wanted key in a sorted key array, -1 when absent"""
+        if not len(wanted) or not len(keys):
+            return [-1] * len(wanted)
+        positions = np.searchsorted(keys, wanted)
+        found = keys[np.minimum(positions, len(keys) - 1)] == wanted
+        return np.where(found, positions, -1).tolist()
+    
+    def lookup(self, description: str) -> Optional[Dict]:
+        """Catalog entry of the first GTIN, else of the longest model number, found in a description"""
+        gtins = self.detect_gtins(description)
+        for gtin, position in zip(gtins, self._search(self.gtin_keys, np.array([int(gtin) for gtin in gtins], dtype=np.int64))):
+            if position >= 0:
+                self.hits += 1
+                return {**self._entry(self.gtin_rows[position]), 'match': 'gtin', 'matched': gtin}
         
-        # Color
-        color_matches = re.findall(r'\b(Black|White|Red|Blue|Green|Yellow|Orange|Purple|Pink|Gray|Grey|Silver|Gold|Rose|Space|Midnight|Starlight|Alpine|Sierra|Pacific|Phantom|Mystic|Prism|Aura|Titanium|Ceramic)\b', all_text, re.IGNORECASE)
-        attributes['color'] = list(set(color_matches))
+        keys = self.detect_models(description)
+        for key, position in zip(keys, self._search(self.model_keys, np.array([self.model_hash(key) for key in keys], dtype=np.uint64))):
+            if position >= 0:
+                entry = self._entry(self.model_rows[position])
+                if self.model_key(entry['model']) == key:  # Rules out hash collisions
+                    self.hits += 1
+                    return {**entry, 'match': 'model', 'matched': entry['model']}
         
-        # Material
-        material_matches = re.findall(r'\b(Aluminum|Steel|Plastic|Glass|Carbon|Fiber|Leather|Silicone|Rubber|Wood|Metal|Ceramic|Titanium)\b', all_text, re.IGNORECASE)
-        attributes['material'] = list(set(material_matches))
+        self.misses += 1
+        return None
+
+# ========================= SHARED ENGINES =========================
+
+class SharedEngines:
+    """Enhancer, scraper and enrichment cache built once per process and shared by every session, tab and job.
+    
+    Both engines only read their compiled rules after construction, so they are safe to share
+    between threads; the scraper's session keeps one connection pool for all of them.
+    """
+    
+    def __init__(self, pool_size: int = 32):
+        self.stats = {}
+        self.enhancer = self._build('enhancer', ProductDescriptionEnhancer)
+        self.scraper = self._build('scraper', lambda: CustomsReadyProductScraper(self.enhancer))
+        self.cache = self._build('enrichment_cache', EnrichmentCache)
+        self.scraper.enrichment_cache = self.cache
+        self.scraper.source_yield = self._build('source_yield', SourceYieldStore)
+        self.load_hs_index()
+        self.load_catalog()
         
-        # Dimensions
-        dimension_matches = re.findall(r'\b(\d+\.?\d*\s*(?:mm|cm|inch|"))\b', all_text, re.IGNORECASE)
-        attributes['dimensions'] = list(set(dimension_matches))
+        PIPELINE_METRICS.register_cache('normalizer', lambda: tuple(self.enhancer.normalizer.normalize.cache_info()[:2]))
+        PIPELINE_METRICS.register_cache('query_templates', lambda: tuple(self.scraper._template_targets.cache_info()[:2]))
+        PIPELINE_METRICS.register_cache('enrichment', lambda: (self.cache.hits, self.cache.misses))
+        PIPELINE_METRICS.register_cache('catalog', lambda: (self.catalog.hits, self.catalog.misses) if self.catalog is not None else (0, 0))
         
-        # Weight
-        weight_matches = re.findall(r'\b(\d+\.?\d*\s*(?:g|kg|lbs|oz))\b', all_text, re.IGNORECASE)
-        attributes['weight'] = list(set(weight_matches))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.scraper.session.mount('https://', adapter)
+        self.scraper.session.mount('http://', adapter)
+        
+        # First analysis pays for lazy regex and tokenizer setup
+        started = time.perf_counter()
+        self.enhancer.analyze_description_completeness("Samsung Galaxy S24 Ultra 512GB Titanium Black 2024")
+        self.stats['warmup'] = {'seconds': time.perf_counter() - started, 'memory_bytes': 0}
+    
+    def load_hs_index(self):
+        """(Re)load the HS nomenclature index; None when no nomenclature file is installed"""
+        self.hs_index = self._build('hs_index', HSNomenclatureIndex.open_default)
+    
+    def load_catalog(self):
+        """(Re)load the product catalog index; None when no catalog dump is installed"""
+        self.catalog = self._build('catalog', ProductCatalogIndex.open_default)
+        self.scraper.catalog = self.catalog
+    
+    def _build(self, name: str, factory: Callable):
+        """Construct a component, recording its build time and the memory it keeps"""
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
         
-        return attributes
+        component = factory()
+        
+        self.stats[name] = {
+            'seconds': time.perf_counter() - started,
+            'memory_bytes': max(tracemalloc.get_traced_memory()[0] - before, 0)
+        }
+        if not tracing:
+            tracemalloc.stop()
+        return component
+    
+    def report(self) -> pd.DataFrame:
+        """Build cost per component for the admin panel"""
+        return pd.DataFrame([
+            {'Komponent': name, 'Qurish (ms)': round(stat['seconds'] * 1000, 1), 'Xotira (KB)': round(stat['memory_bytes'] / 1024, 1)}
+            for name, stat in self.stats.items()
+        ])
+
+def process_peak_memory_mb() -> Optional[float]:
+    """Peak resident memory of this server process"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+@st.cache_resource
+def get_engines() -> SharedEngines:
+    """One set of engines per server process"""
+    return SharedEngines()
+
+# ========================= NEAR-DUPLICATE CLUSTERING =========================
+
+class NearDuplicateClusterer:
+    """Groups near-duplicate descriptions into product families with MinHash LSH.
+    
+    Descriptions are compared as character shingles of their lowercased
+    alphanumerics, so "Apple iphone15 pro 256 gb Black" and "iPhone 15 Pro
+    256GB black" shingle alike. LSH bands propose candidate pairs and a pair
+    joins a family when its exact shingle Jaccard similarity reaches the
+    threshold and both name the same model numbers (numbers not followed by
+    a unit): "iPhone 14" and "iPhone 15" stay apart, "256GB" and "512GB"
+    variants do not.
+    """
+    
+    PRIME = (1 << 31) - 1
+    UNITS = {'gb', 'tb', 'mb', 'mah', 'mp', 'inch', 'in', 'mm', 'cm', 'm', 'kg', 'g', 'lbs', 'oz', 'w', 'hz', 'ml', 'l'}
+    
+    def __init__(self, normalizer: Optional[TextNormalizer] = None, threshold: float = 0.6, shingle_size: int = 3, bands: int = 16, rows: int = 4, seed: int = 1):
+        self.normalizer = normalizer or TextNormalizer()
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = rows
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, self.PRIME, bands * rows, dtype=np.uint64)
+        self.b = generator.integers(0, self.PRIME, bands * rows, dtype=np.uint64)
+    
+    def _shingles(self, text: str) -> set:
+        if len(text) <= self.shingle_size:
+            return {text} if text else set()
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+    
+    def _model_numbers(self, tokens: Tuple[str, ...]) -> frozenset:
+        return frozenset(
+            token for position, token in enumerate(tokens)
+            if token.isdigit() and (position + 1 == len(tokens) or tokens[position + 1] not in self.UNITS)
+        )
+    
+    def _signature(self, shingles: set) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) % self.PRIME for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % self.PRIME).min(axis=1)
+    
+    def families(self, descriptions: List[str]) -> List[int]:
+        """Family of every description, named by the position of its first member"""
+        # Identical texts are clustered once
+        normalized = [self.normalizer.normalize(str(description))['tokens'] for description in descriptions]
+        keys = [(''.join(tokens), self._model_numbers(tokens)) for tokens in normalized]
+        unique = list(dict.fromkeys(keys))
+        unique_index = {key: index for index, key in enumerate(unique)}
+        parent = list(range(len(unique)))
+        
+        def find(index: int) -> int:
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+        
+        shingles = [self._shingles(text) for text, _ in unique]
+        
+        # Only descriptions naming the same model numbers share buckets
+        buckets = {}
+        for index, (row_shingles, (_, model_numbers)) in enumerate(zip(shingles, unique)):
+            if not row_shingles:
+                continue
+            signature = self._signature(row_shingles)
+            for band in range(self.bands):
+                key = (band, model_numbers, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                buckets.setdefault(key, []).append(index)
+        
+        checked = set()
+        for members in buckets.values():
+            for position, index in enumerate(members[1:], start=1):
+                for other in members[:position]:
+                    if find(index) == find(other) or (other, index) in checked:
+                        continue
+                    checked.add((other, index))
+                    similarity = len(shingles[index] & shingles[other]) / len(shingles[index] | shingles[other])
+                    if similarity >= self.threshold:
+                        roots = sorted((find(index), find(other)))
+                        parent[roots[1]] = roots[0]
+                        break
+        
+        # Name each family by the first row that belongs to it
+        first_row = {}
+        families = []
+        for row, key in enumerate(keys):
+            root = find(unique_index[key])
+            families.append(first_row.setdefault(root, row))
+        return families
+
+# ========================= BATCH PIPELINE =========================
+
+# Worker threads per stage; network-bound stages get more
+DEFAULT_STAGE_CONCURRENCY = {
+    'analysis': 1,
+    'plan': 1,
+    'search': 2,
+    'fetch': 4,
+    'parse': max(os.cpu_count() or 1, 2),  # Worker processes in hybrid mode
+    'extract': 1
+}
+
+# Upper bounds (seconds) of the per-item latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class StageStats:
+    """Item counts, busy time, latency histogram and HTTP traffic of one pipeline stage.
+    
+    With `totals` set, every observation is also added to that (process-wide)
+    StageStats, so monitoring sees a batch while it runs.
+    """
+    
+    def __init__(self, name: str, workers: int, totals: Optional['StageStats'] = None):
+        self.name = name
+        self.workers = workers
+        self.totals = totals
+        self.items = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.requests = 0
+        self.failed_requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float, error: bool = False):
+        with self._lock:
+            self.items += 1
+            self.busy_time += seconds
+            self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if error:
+                self.errors += 1
+        if self.totals is not None:
+            self.totals.record(seconds, error)
+    
+    def record_response(self, content: Optional[bytes]):
+        """Count one HTTP request of the stage; None is a failed request"""
+        with self._lock:
+            self.requests += 1
+            if content is None:
+                self.failed_requests += 1
+            else:
+                self.bytes += len(content)
+        if self.totals is not None:
+            self.totals.record_response(content)
+    
+    def quantile(self, q: float) -> float:
+        """Latency quantile in seconds, as the upper bound of the bucket it falls in"""
+        target = q * self.items
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return 0.0
+    
+    def summary(self, elapsed: float) -> Dict:
+        """Observed throughput and the throughput the stage could sustain at full load"""
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'errors': self.errors,
+            'throughput': self.items / elapsed if elapsed > 0 else 0.0,
+            'capacity': self.items * self.workers / self.busy_time if self.busy_time > 0 else 0.0,
+            'utilization': self.busy_time / (elapsed * self.workers) if elapsed > 0 else 0.0,
+            'mean_ms': self.busy_time / self.items * 1000 if self.items else 0.0,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p95_ms': self.quantile(0.95) * 1000,
+            'requests': self.requests,
+            'failed_requests': self.failed_requests,
+            'bytes': self.bytes
+        }
+
+def cache_stats_row(name: str, hits: int, misses: int) -> Dict:
+    return {'cache': name, 'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+class MetricsRegistry:
+    """Process-wide totals of every pipeline run and cache, for the sidebar panel and Prometheus"""
+    
+    def __init__(self):
+        self.stages = {}
+        self.caches = {}  # Name -> callable returning (hits, misses)
+        self.cache_counts = {}
+        self._lock = threading.Lock()
+    
+    def stage(self, name: str) -> StageStats:
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats(name, 0)
+            return self.stages[name]
+    
+    def register_cache(self, name: str, info: Callable[[], Tuple[int, int]]):
+        self.caches[name] = info
+    
+    def record_cache(self, name: str, hits: int, misses: int):
+        """Add hits and misses of a cache that keeps no counters of its own"""
+        with self._lock:
+            previous = self.cache_counts.get(name, (0, 0))
+            self.cache_counts[name] = (previous[0] + hits, previous[1] + misses)
+    
+    def cache_rows(self) -> List[Dict]:
+        counts = {name: info() for name, info in self.caches.items()}
+        counts.update(self.cache_counts)
+        return [cache_stats_row(name, hits, misses) for name, (hits, misses) in counts.items()]
+    
+    def stage_rows(self) -> List[Dict]:
+        return [
+            {key: value for key, value in stats.summary(0).items() if key not in ('workers', 'throughput', 'capacity', 'utilization')}
+            for stats in list(self.stages.values())
+        ]
+    
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = [
+            '# HELP customs_stage_seconds Time spent on one item in a pipeline stage',
+            '# TYPE customs_stage_seconds histogram'
+        ]
+        stages = list(self.stages.values())
+        for stats in stages:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'customs_stage_seconds_bucket{{stage="{stats.name}",le="{le}"}} {cumulative}')
+            lines.append(f'customs_stage_seconds_sum{{stage="{stats.name}"}} {stats.busy_time}')
+            lines.append(f'customs_stage_seconds_count{{stage="{stats.name}"}} {stats.items}')
+        
+        counters = [
+            ('customs_stage_errors_total', 'Items that failed in a pipeline stage', 'errors'),
+            ('customs_stage_http_requests_total', 'HTTP requests made by a pipeline stage', 'requests'),
+            ('customs_stage_http_failures_total', 'HTTP requests without a successful response', 'failed_requests'),
+            ('customs_stage_bytes_total', 'Response bytes downloaded by a pipeline stage', 'bytes')
+        ]
+        for metric, help_text, attribute in counters:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            lines += [f'{metric}{{stage="{stats.name}"}} {getattr(stats, attribute)}' for stats in stages]
+        
+        cache_rows = self.cache_rows()
+        for metric, help_text, key in [('customs_cache_hits_total', 'Cache hits', 'hits'), ('customs_cache_misses_total', 'Cache misses', 'misses')]:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            lines += [f'{metric}{{cache="{row["cache"]}"}} {row[key]}' for row in cache_rows]
+        return '\n'.join(lines) + '\n'
+
+PIPELINE_METRICS = MetricsRegistry()
+
+class BatchPipeline:
+    """Staged batch processing: analysis -> query planning -> search -> fetch -> parse -> extraction.
+    
+    Stages run in their own worker threads connected by bounded queues, so
+    network waits of one product overlap with parsing and regex work of
+    another. A product loops from extraction back to search until its
+    missing elements are filled. At most `max_in_flight` products are
+    being scraped at once, which bounds every queue.
+    """
+    
+    STAGES = ['analysis', 'plan', 'search', 'fetch', 'parse', 'extract']
+    
+    def __init__(self, enhancer: ProductDescriptionEnhancer, scraper: CustomsReadyProductScraper, budget: Optional[BatchBudget] = None, concurrency: Optional[Dict[str, int]] = None, max_in_flight: int = 32, search_delay: float = 1.0, dedupe: bool = True):
+        self.enhancer = enhancer
+        self.scraper = scraper
+        self.budget = budget
+        self.concurrency = {**DEFAULT_STAGE_CONCURRENCY, **(concurrency or {})}
+        self.search_delay = search_delay  # Politeness delay per search worker
+        self.max_in_flight = max_in_flight
+        
+        self.queues = {stage: queue.Queue(maxsize=max_in_flight) for stage in self.STAGES}
+        # Products wait for a scraping slot in order of lowest completeness
+        self.queues['plan'] = queue.PriorityQueue()
+        self.in_flight = threading.Semaphore(max_in_flight)
+        self.done = queue.Queue()
+        self.stats = {stage: StageStats(stage, self.concurrency[stage], PIPELINE_METRICS.stage(stage)) for stage in self.STAGES}
+        # Re-analysis of enhanced descriptions runs inside the extract stage (and for family members)
+        self.stats['reanalysis'] = StageStats('reanalysis', self.concurrency['extract'], PIPELINE_METRICS.stage('reanalysis'))
+        self.enhanced = set()  # Positions whose scraped enhancement was applied
+        self._sequence = itertools.count()
+        self.dedupe = dedupe
+        self.shared = set()  # Positions completed from their family leader's scrape
+        self._family_lock = threading.Lock()
+        self.latencies = {}  # Position -> seconds from analysis (or from getting a scraping slot) to finish
+        self.catalog_hits = set()  # Positions filled from the product catalog without scraping
+        self.catalog_misses = set()
+    
+    def run(self, df: pd.DataFrame, completed: Optional[Dict[int, Dict]] = None, on_row: Optional[Callable[[int, List[Dict]], None]] = None) -> Tuple[List[Dict], List[Dict]]:
+        """Process every row; `on_row` is called on the calling thread as rows finish. `completed` holds finished rows by position"""
+        completed = completed or {}
+        rows = list(zip(df['ID'], df['Tovar_nomi']))
+        self.results = [None] * len(rows)
+        self.completed = completed
+        self._group_families(rows)
+        started = time.monotonic()
+        
+        handlers = {
+            'analysis': self._analyze,
+            'plan': self._plan,
+            'search': self._search,
+            'fetch': self._fetch,
+            'parse': self._parse,
+            'extract': self._extract
+        }
+        workers = []
+        for stage in self.STAGES:
+            for _ in range(self.concurrency[stage]):
+                worker = threading.Thread(target=self._worker, args=(stage, handlers[stage]), daemon=True)
+                worker.start()
+                workers.append(worker)
+        
+        feeder = threading.Thread(target=self._feed, args=(rows,), daemon=True)
+        feeder.start()
+        
+        try:
+            for _ in range(len(rows)):
+                position = self.done.get()
+                if on_row:
+                    on_row(position, self.results)
+        finally:
+            self._stop(workers)
+        
+        elapsed = time.monotonic() - started
+        return self.results, [stats.summary(elapsed) for stats in self.stats.values()]
+    
+    def _group_families(self, rows: List[Tuple]):
+        """Cluster near-duplicate rows so each product family is scraped once"""
+        descriptions = [str(description) for _, description in rows]
+        self.families = NearDuplicateClusterer(self.enhancer.normalizer).families(descriptions) if self.dedupe else list(range(len(rows)))
+        self.leaders = {}  # Family -> task of the member being scraped for it
+        self.followers = {}  # Family -> tasks waiting for their leader
+        self.finished_families = set()
+    
+    def _feed(self, rows: List[Tuple]):
+        for position, (row_id, description) in enumerate(rows):
+            self.queues['analysis'].put({'position': position, 'id': row_id, 'description': description})
+    
+    def _stop(self, workers: List[threading.Thread]):
+        for stage in self.STAGES:
+            for _ in range(self.concurrency[stage]):
+                if stage == 'plan':
+                    self.queues[stage].put((float('inf'), next(self._sequence), None))
+                else:
+                    self.queues[stage].put(None)
+        for worker in workers:
+            worker.join(timeout=5)
+    
+    def _worker(self, stage: str, handler: Callable[[Dict], None]):
+        while True:
+            if stage == 'plan':
+                self.in_flight.acquire()
+                task = self.queues[stage].get()[2]
+            else:
+                task = self.queues[stage].get()
+            if task is None:
+                return
+            
+            started = time.monotonic()
+            try:
+                handler(task)
+                self.stats[stage].record(time.monotonic() - started)
+            except Exception as e:
+                self.stats[stage].record(time.monotonic() - started, error=True)
+                position = task['position']
+                if self.results[position] is None:
+                    analysis = self.enhancer.analyze_description_completeness('')
+                    self.results[position] = build_result_row(task['id'], task['description'], analysis)
+                self.results[position]['Qoshimcha_malumotlar'] = f"Scraping xatoligi: {str(e)}"
+                self._finish(task, scraped=stage != 'analysis')
+    
+    def _finish(self, task: Dict, scraped: bool):
+        self.latencies[task['position']] = time.monotonic() - task['started']
+        if scraped:
+            self.in_flight.release()
+        self.done.put(task['position'])
+        self._release_followers(task)
+    
+    def _join_family(self, task: Dict) -> bool:
+        """Attach a product to its family's leader; False when it becomes the leader itself"""
+        family = self.families[task['position']]
+        with self._family_lock:
+            leader = self.leaders.setdefault(family, task)
+            if leader is task:
+                return False
+            if family not in self.finished_families:
+                self.followers.setdefault(family, []).append(task)
+                return True
+        
+        self._complete_follower(task, leader)
+        return True
+    
+    def _release_followers(self, task: Dict):
+        """Complete the members that waited for this product's scrape"""
+        family = self.families[task['position']]
+        with self._family_lock:
+            if self.leaders.get(family) is not task:
+                return
+            self.finished_families.add(family)
+            followers = self.followers.pop(family, [])
+        
+        for follower in followers:
+            self._complete_follower(follower, task)
+    
+    def _complete_follower(self, task: Dict, leader: Dict):
+        """Project the leader's collected information onto a family member"""
+        position = task['position']
+        try:
+            if leader['position'] in self.enhanced:
+                collected = self.scraper._project_collected(leader['collected'], task['description'])
+                enhancement_result = self.scraper._build_enhancement_result(task['description'], collected)
+                self._apply(position, enhancement_result)
+                notes = [self.results[position]['Qoshimcha_malumotlar'], f"O'xshash tovar (ID {leader['id']}) ma'lumotlari asosida"]
+                self.results[position]['Qoshimcha_malumotlar'] = ' | '.join(note for note in notes if note)
+                self.enhanced.add(position)
+                self.shared.add(position)
+            else:
+                self.results[position]['Qoshimcha_malumotlar'] = self.results[leader['position']]['Qoshimcha_malumotlar']
+        except Exception as e:
+            self.results[position]['Qoshimcha_malumotlar'] = f"Scraping xatoligi: {str(e)}"
+        self._finish(task, scraped=False)
+    
+    def _analyze(self, task: Dict):
+        """Analyze a row; returns True when it needs scraping"""
+        task['started'] = time.monotonic()
+        position = task['position']
+        analysis = self.enhancer.analyze_description_completeness(task['description'])
+        task['analysis'] = analysis
+        
+        if position in self.completed:
+            self.results[position] = {**self.completed[position], 'ID': task['id']}
+        else:
+            self.results[position] = build_result_row(task['id'], task['description'], analysis)
+            if analysis['enhancement_needed']:
+                catalog_result = self.scraper._catalog_enhancement(task['description'])
+                if catalog_result is None:
+                    if self.scraper.catalog is not None:
+                        self.catalog_misses.add(position)
+                    if not self._join_family(task):
+                        self.queues['plan'].put((analysis['completeness_score'], next(self._sequence), task))
+                    return True
+                
+                # Exact catalog hits skip scraping
+                self._apply(position, catalog_result)
+                self.enhanced.add(position)
+                self.catalog_hits.add(position)
+        
+        self._finish(task, scraped=False)
+        return False
+    
+    def _plan(self, task: Dict):
+        self._prepare(task)
+        self._route(task)
+    
+    def _prepare(self, task: Dict):
+        """Plan the search queries of a product"""
+        task['started'] = time.monotonic()
+        missing_elements = task['analysis']['missing_elements']
+        category = task['analysis']['product_category']
+        task['plan'] = self.scraper._plan_search_queries(task['description'], category, missing_elements)
+        task['unfilled'] = [element for element in missing_elements if element in self.scraper.query_targets]
+        task['fillable'] = list(task['unfilled'])
+        task['collected'] = {'records': [], 'sources': [], 'structured_data': {}, 'requests_made': 0}
+    
+    def _should_search(self, task: Dict) -> bool:
+        budget_allows = not self.budget or self.budget.allows(task['collected']['requests_made'])
+        return bool(task['plan'] and task['unfilled'] and budget_allows)
+    
+    def _route(self, task: Dict):
+        """Send a product back to search, or finish it once nothing is left to do"""
+        if self._should_search(task):
+            self.queues['search'].put(task)
+            return
+        
+        self._complete(task)
+        self._finish(task, scraped=True)
+    
+    def _complete(self, task: Dict):
+        """Apply what was collected for a product to its result row"""
+        position = task['position']
+        if task['collected']['requests_made'] == 0 and self.budget and self.budget.exhausted():
+            if self.budget.cancelled.is_set():
+                self.results[position]['Qoshimcha_malumotlar'] = "Bekor qilindi - faqat tahlil natijasi"
+            else:
+                self.results[position]['Qoshimcha_malumotlar'] = "Byudjet tugadi - faqat tahlil natijasi"
+        else:
+            enhancement_result = self.scraper._build_enhancement_result(task['description'], task['collected'])
+            self._apply(position, enhancement_result)
+            self.enhanced.add(position)
+    
+    def _apply(self, position: int, enhancement_result: Dict):
+        """Apply an enhancement to a result row, timing the re-analysis it includes"""
+        started = time.monotonic()
+        apply_enhancement(self.results[position], enhancement_result, self.enhancer)
+        self.stats['reanalysis'].record(time.monotonic() - started)
+    
+    def _acquire(self, task: Dict) -> bool:
+        """Reserve one outbound request for the product"""
+        if self.budget and not self.budget.acquire(task['collected']['requests_made']):
+            return False
+        task['collected']['requests_made'] += 1
+        return True
+    
+    def _search(self, task: Dict):
+        # The budget may have run out while the product was queued
+        if not self._should_search(task):
+            self._route(task)
+            return
+        
+        query = task['plan'].pop(0)['query']
+        content = self.scraper._http_get(self.scraper._search_url(query), timeout=10, acquire=lambda: self._acquire(task))
+        self.stats['search'].record_response(content)
+        task['links'] = self.scraper._parse_search_results(content) if content is not None else []  # Ranked candidates for hedging
+        self.queues['fetch'].put(task)
+        time.sleep(self.search_delay)
+    
+    def _fetch(self, task: Dict):
+        task['pages'] = self.scraper._fetch_hedged(task.pop('links'), self.scraper.pages_per_search, lambda: self._acquire(task), self.stats['fetch'].record_response)
+        self.queues['parse'].put(task)
+    
+    def _parse(self, task: Dict):
+        task['page_records'] = []
+        for result, content in task.pop('pages'):
+            record = self.scraper._page_record(content)
+            if record:
+                task['page_records'].append((result, record))
+        self.queues['extract'].put(task)
+    
+    def _extract(self, task: Dict):
+        self._absorb(task, task.pop('page_records'))
+        self._route(task)
+    
+    def _absorb(self, task: Dict, page_records: List[Tuple[Dict, Dict]]):
+        """Add page records to a product and re-check what is still unfilled"""
+        collected = task['collected']
+        for result, record in page_records:
+            self.scraper._record_yield(task['description'], task['fillable'], result['link'], record)
+        
+        for result, record in page_records:
+            collected['records'].append(record)
+            collected['sources'].append({
+                'title': result['title'],
+                'url': result['link']
+            })
+            
+            # Stop as soon as nothing is left to fill
+            task['unfilled'] = self.scraper._unfilled_elements(task['description'], collected, task['unfilled'])
+            if not task['unfilled']:
+                break
+        
+        task['plan'] = self.scraper._order_search_plan(task['plan'], task['unfilled'])
+
+_pool_parser = None
+
+def _pool_page_record(content: bytes) -> Optional[Dict]:
+    """Process pool entry point: parse a page and return only its compact record"""
+    global _pool_parser
+    if _pool_parser is None:
+        _pool_parser = PageParser()
+    return _pool_parser._page_record(content)
+
+def _pool_search_results(content: bytes) -> List[Dict]:
+    """Process pool entry point: parse a search results page"""
+    global _pool_parser
+    if _pool_parser is None:
+        _pool_parser = PageParser()
+    return _pool_parser._parse_search_results(content)
+
+def _parse_pool_context():
+    """Start method of the parse processes: fork where the platform has it.
+    
+    Under Streamlit this file runs as a replaced __main__ that a spawned or
+    forkserver child cannot import, so the pool functions above could not
+    be found there. A forked child already has them. Where fork does not
+    exist (Windows) the default start method is used, which works for the
+    command line entry points. Python 3.12+ warns when a process with
+    threads forks; the children only run the parser and never use the
+    parent's threads or connections.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+class HybridBatchPipeline(BatchPipeline):
+    """Batch pipeline with network I/O on an asyncio event loop and parsing in a process pool.
+    
+    Searches and page downloads are awaited on one event loop (with aiohttp
+    when installed, otherwise the requests session in the loop's thread
+    pool). BeautifulSoup parsing and the extractor regexes run in worker
+    processes, one per `parse` slot, each with its own PageParser. Page
+    HTML is sent to a worker and only the compact page record comes back.
+    Workers are forked (see _parse_pool_context).
+    """
+    
+    def run(self, df: pd.DataFrame, completed: Optional[Dict[int, Dict]] = None, on_row: Optional[Callable[[int, List[Dict]], None]] = None) -> Tuple[List[Dict], List[Dict]]:
+        self.completed = completed or {}
+        self.on_row = on_row
+        rows = list(zip(df['ID'], df['Tovar_nomi']))
+        self.results = [None] * len(rows)
+        self._group_families(rows)
+        started = time.monotonic()
+        
+        with ProcessPoolExecutor(max_workers=self.concurrency['parse'], mp_context=_parse_pool_context()) as pool:
+            asyncio.run(self._run_async(rows, pool))
+        
+        elapsed = time.monotonic() - started
+        return self.results, [stats.summary(elapsed) for stats in self.stats.values()]
+    
+    def _finish(self, task: Dict, scraped: bool):
+        self.latencies[task['position']] = time.monotonic() - task['started']
+        if self.on_row:
+            self.on_row(task['position'], self.results)
+        self._release_followers(task)
+    
+    async def _run_async(self, rows: List[Tuple], pool: ProcessPoolExecutor):
+        self.loop = asyncio.get_running_loop()
+        self.pool = pool
+        self.limits = {stage: asyncio.Semaphore(self.concurrency[stage]) for stage in ('search', 'fetch', 'parse')}
+        
+        # Analysis is cheap and stays in this process
+        for position, (row_id, description) in enumerate(rows):
+            task = {'position': position, 'id': row_id, 'description': description}
+            started = time.monotonic()
+            self._analyze(task)
+            self.stats['analysis'].record(time.monotonic() - started)
+        
+        # Least complete products are scheduled first
+        waiting = []
+        while not self.queues['plan'].empty():
+            waiting.append(self.queues['plan'].get()[2])
+        
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        
+        # A mounted cassette lives on the requests session, so recorded and replayed runs use it
+        if AIOHTTP_AVAILABLE and self.scraper.cassette is None:
+            async with aiohttp.ClientSession(headers=self.scraper.headers) as session:
+                self.http = session
+                await asyncio.gather(*(self._process(task, in_flight) for task in waiting))
+        else:
+            self.http = None
+            await asyncio.gather(*(self._process(task, in_flight) for task in waiting))
+    
+    async def _get(self, url: str, timeout: float, acquire: Optional[Callable[[], bool]] = None) -> Optional[bytes]:
+        if self.http is None:
+            return await self.loop.run_in_executor(None, self.scraper._http_get, url, timeout, acquire)
+        
+        # Same adaptive timeout, cool-off and charging as CustomsReadyProductScraper._http_get
+        tracker = self.scraper.host_latency
+        if not tracker.available(url):
+            return None
+        if acquire is not None and not acquire():
+            return None
+        started = time.monotonic()
+        try:
+            async with self.http.get(url, timeout=aiohttp.ClientTimeout(total=tracker.timeout(url, timeout))) as response:
+                content = await response.read() if response.status == 200 else None
+                tracker.record(url, time.monotonic() - started, response.status < 500, timeout)
+                return content
+        except Exception:
+            tracker.record(url, time.monotonic() - started, False, timeout)
+            return None
+    
+    async def _fetch_hedged(self, task: Dict, links: List[Dict]) -> List[Tuple[Dict, bytes]]:
+        """Download the top results concurrently; hedging works as in CustomsReadyProductScraper._fetch_hedged,
+        except that downloads left running at the end are cancelled"""
+        tracker = self.scraper.host_latency
+        wanted = self.scraper.pages_per_search
+        if self.scraper.source_yield is not None:
+            links = self.scraper.source_yield.rank(links)
+        waiting = [(rank, result) for rank, result in enumerate(links) if tracker.available(result['link'])]
+        running = {}  # Fetch -> (rank, result, hedge deadline)
+        pages = []
+        
+        def start_next():
+            while waiting and not tracker.available(waiting[0][1]['link']):
+                waiting.pop(0)
+            if not waiting or not self._acquire(task):
+                return
+            rank, result = waiting.pop(0)
+            fetch = asyncio.ensure_future(self._timed('fetch', self._get(result['link'], 8)))
+            hedge_after = tracker.hedge_after(result['link'])
+            running[fetch] = (rank, result, time.monotonic() + hedge_after if hedge_after is not None else None)
+        
+        for _ in range(wanted):
+            start_next()
+        
+        while running and len(pages) < wanted:
+            deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+            timeout = max(min(deadlines) - time.monotonic(), 0.0) if deadlines else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            
+            for fetch in done:
+                rank, result, _ = running.pop(fetch)
+                content = fetch.result()
+                self.stats['fetch'].record_response(content)
+                if content is not None:
+                    pages.append((rank, result, content))
+                elif len(pages) + len(running) < wanted:
+                    start_next()
+            
+            now = time.monotonic()
+            for fetch, (rank, result, deadline) in list(running.items()):
+                if deadline is not None and deadline <= now:
+                    running[fetch] = (rank, result, None)
+                    start_next()
+        
+        for fetch in running:
+            fetch.cancel()
+        return [(result, content) for _, result, content in sorted(pages, key=lambda page: page[0])[:wanted]]
+    
+    async def _timed(self, stage: str, awaitable):
+        """Await a search, fetch or parse step within its stage's concurrency limit"""
+        async with self.limits[stage]:
+            started = time.monotonic()
+            try:
+                result = await awaitable
+            except Exception:
+                self.stats[stage].record(time.monotonic() - started, error=True)
+                raise
+            self.stats[stage].record(time.monotonic() - started)
+            return result
+    
+    async def _process(self, task: Dict, in_flight: asyncio.Semaphore):
+        async with in_flight:
+            try:
+                started = time.monotonic()
+                self._prepare(task)
+                self.stats['plan'].record(time.monotonic() - started)
+                
+                while self._should_search(task):
+                    query = task['plan'].pop(0)['query']
+                    content = await self._timed('search', self._get(self.scraper._search_url(query), 10, lambda: self._acquire(task)))
+                    self.stats['search'].record_response(content)
+                    links = []
+                    if content is not None:
+                        links = await self._timed('parse', self.loop.run_in_executor(self.pool, _pool_search_results, content))
+                    
+                    downloaded = await self._fetch_hedged(task, links)
+                    records = await asyncio.gather(*(
+                        self._timed('parse', self.loop.run_in_executor(self.pool, _pool_page_record, page))
+                        for _, page in downloaded
+                    ))
+                    page_records = [(result, record) for (result, _), record in zip(downloaded, records) if record]
+                    
+                    started = time.monotonic()
+                    self._absorb(task, page_records)
+                    self.stats['extract'].record(time.monotonic() - started)
+                    
+                    if self._should_search(task):
+                        await asyncio.sleep(self.search_delay)
+                
+                self._complete(task)
+            
+            except Exception as e:
+                self.results[task['position']]['Qoshimcha_malumotlar'] = f"Scraping xatoligi: {str(e)}"
+            
+            self._finish(task, scraped=True)
+
+
+# ========================= MAIN FUNCTIONS =========================
+
+def validate_uploaded_file(df: pd.DataFrame) -> Tuple[bool, str]:
+    """Validate uploaded file structure"""
+    required_columns = ['ID', 'Tovar_nomi']
+    
+    if not all(col in df.columns for col in required_columns):
+        return False, "Faylda 'ID' va 'Tovar_nomi' ustunlari mavjud emas"
+    
+    if df.empty:
+        return False, "Fayl bo'sh"
+    
+    if df['ID'].duplicated().any():
+        return False, "ID ustunida takrorlanuvchi qiymatlar mavjud"
+    
+    empty_descriptions = df['Tovar_nomi'].isna().sum()
+    if empty_descriptions > 0:
+        return False, f"{empty_descriptions} ta bo'sh tovar tavsifi mavjud"
+    
+    return True, "Fayl tuzilishi to'g'ri"
+
+PRODUCT_FILE_TYPES = ['xlsx', 'xls', 'csv', 'gz', 'zst', 'parquet', 'arrow', 'feather', 'ipc']
+
+# Download formats of the report tab: label, file extension, MIME type
+EXPORT_FORMATS = {
+    name: spec for name, spec in {
+        'parquet': ('Parquet', 'parquet', 'application/vnd.apache.parquet'),
+        'csv.gz': ('CSV (gzip)', 'csv.gz', 'application/gzip'),
+        'csv.zst': ('CSV (zstd)', 'csv.zst', 'application/zstd')
+    }.items()
+    if (name != 'parquet' or PYARROW_AVAILABLE) and (name != 'csv.zst' or ZSTD_AVAILABLE)
+}
+
+def file_format(file_name: str) -> str:
+    """'parquet', 'arrow', 'csv' or 'excel', from a file name. Any .gz or .zst file is read as compressed CSV"""
+    name = str(file_name).lower()
+    if name.endswith('.parquet'):
+        return 'parquet'
+    if name.endswith(('.arrow', '.feather', '.ipc')):
+        return 'arrow'
+    if name.endswith(('.csv', '.gz', '.zst')):
+        return 'csv'
+    return 'excel'
+
+def _csv_compression(file_name: str) -> Optional[str]:
+    return {'gz': 'gzip', 'zst': 'zstd'}.get(str(file_name).lower().rsplit('.', 1)[-1])
+
+def read_products_file(source, file_name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read an uploaded or local products file; `columns` limits reading to those of them present.
+    
+    Parquet and Arrow IPC files are read with pyarrow, local ones memory-mapped,
+    and converted block by block so Arrow buffers are released as they go.
+    """
+    file_type = file_format(file_name)
+    wanted = (lambda column: column in columns) if columns else None
+    if file_type == 'csv':
+        compression = _csv_compression(file_name)
+        if compression == 'zstd' and not ZSTD_AVAILABLE:
+            raise ValueError("Zstandard bilan siqilgan fayllarni o'qish uchun zstandard kutubxonasi kerak")
+        return pd.read_csv(source, usecols=wanted, compression=compression)
+    if file_type == 'excel':
+        return pd.read_excel(source, usecols=wanted)
+    
+    if not PYARROW_AVAILABLE:
+        raise ValueError("Parquet va Arrow fayllarni o'qish uchun pyarrow kutubxonasi kerak")
+    local = isinstance(source, (str, Path))
+    if file_type == 'parquet':
+        parquet = pyarrow.parquet.ParquetFile(str(source) if local else source, memory_map=local)
+        table = parquet.read(columns=[name for name in parquet.schema_arrow.names if wanted(name)] if wanted else None)
+    else:
+        if local:
+            source = pyarrow.memory_map(str(source))
+        try:
+            table = pyarrow.ipc.open_file(source).read_all()
+        except pyarrow.ArrowInvalid:
+            source.seek(0)
+            table = pyarrow.ipc.open_stream(source).read_all()
+        if wanted:
+            table = table.select([name for name in table.column_names if wanted(name)])
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+def write_results_file(results_df: pd.DataFrame, target, file_name: Optional[str] = None):
+    """Write results to a local file or buffer in the format given by the extension of `file_name` (by default of the path)"""
+    name = str(file_name or target)
+    file_type = file_format(name)
+    if file_type == 'csv':
+        results_df.to_csv(target, index=False, compression=_csv_compression(name))
+    elif file_type == 'parquet':
+        results_df.to_parquet(target, index=False, compression='zstd')
+    elif file_type == 'arrow':
+        pyarrow.feather.write_feather(pyarrow.Table.from_pandas(results_df, preserve_index=False), target, compression='zstd')
+    else:
+        results_df.to_excel(target, index=False, sheet_name='Asosiy_natijalar')
+
+def results_summary(results_df: pd.DataFrame) -> pd.DataFrame:
+    """Summary sheet of a batch: readiness counts and average completeness"""
+    initial_scores = percent_values(results_df['Dastlabki_toliqlik'])
+    final_scores = percent_values(results_df['Yakuniy_toliqlik'])
+    return pd.DataFrame({
+        'Metrika': [
+            'Jami tovarlar',
+            'Yuqori tayyorlik (HIGH)',
+            'O\'rta tayyorlik (MEDIUM)',
+            'Past tayyorlik (LOW)',
+            'Takomillashtirilgan tovarlar',
+            'O\'rtacha dastlabki to\'liqlik',
+            'O\'rtacha yakuniy to\'liqlik',
+            'O\'rtacha yaxshilanish'
+        ],
+        'Qiymat': [
+            len(results_df),
+            len(results_df[results_df['Yakuniy_tayyorlik'] == 'HIGH']),
+            len(results_df[results_df['Yakuniy_tayyorlik'] == 'MEDIUM']),
+            len(results_df[results_df['Yakuniy_tayyorlik'] == 'LOW']),
+            int((final_scores > initial_scores).sum()),
+            f"{initial_scores.mean():.1f}%",
+            f"{final_scores.mean():.1f}%",
+            f"{(final_scores - initial_scores).mean():.1f}%"
+        ]
+    })
+
+READINESS_DTYPE = pd.CategoricalDtype(['LOW', 'MEDIUM', 'HIGH'], ordered=True)
+
+def compact_results(results_df: pd.DataFrame) -> pd.DataFrame:
+    """Results as kept in session state: readiness levels, element lists, scores and other
+    repeated texts as categoricals, remaining texts as Arrow strings"""
+    columns = {}
+    for column in results_df.columns:
+        values = results_df[column]
+        if column in ('Bojxona_tayyorligi', 'Yakuniy_tayyorlik'):
+            values = values.astype(READINESS_DTYPE)
+        elif pd.api.types.is_string_dtype(values.dtype) and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+            if values.nunique(dropna=False) <= len(values) // 2:
+                values = values.astype('category')
+            elif values.dtype == object and PYARROW_AVAILABLE:
+                values = values.astype(pd.StringDtype('pyarrow'))
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            values = pd.to_numeric(values, downcast='integer')
+        columns[column] = values
+    
+    compact = pd.DataFrame(columns, index=results_df.index, copy=False)
+    compact.attrs = dict(results_df.attrs)
+    return compact
+
+def percent_values(column: pd.Series) -> pd.Series:
+    """Numbers of a 'NN.N%' column; categorical columns parse each distinct value once"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        parsed = column.cat.categories.astype(str).str.rstrip('%').astype(float).to_numpy()
+        codes = column.cat.codes.to_numpy()
+        return pd.Series(np.where(codes >= 0, parsed[codes], np.nan), index=column.index)
+    return column.astype(str).str.rstrip('%').astype(float)
+
+def build_result_row(row_id, description: str, analysis: Dict) -> Dict:
+    """Create an analysis-only result row"""
+    return {
+        'ID': row_id,
+        'Asl_tavsif': description,
+        'Dastlabki_toliqlik': f"{analysis['completeness_score']:.1f}%",
+        'Bojxona_tayyorligi': analysis['customs_readiness'],
+        'Topilgan_elementlar': ', '.join(analysis['found_elements'].keys()),
+        'Yetishmayotgan_elementlar': ', '.join(analysis['missing_elements']),
+        'Toldirilgan_tavsif': description,
+        'Qoshimcha_malumotlar': '',
+        'Yakuniy_toliqlik': f"{analysis['completeness_score']:.1f}%",
+        'Yakuniy_tayyorlik': analysis['customs_readiness'],
+        'Scraping_manbalar': 0,
+        'Ishonch_darajasi': '0%',
+        'Tavsiyalar': '; '.join(analysis['recommendations'][:3])
+    }
+
+def apply_enhancement(result_row: Dict, enhancement_result: Dict, enhancer: ProductDescriptionEnhancer) -> Dict:
+    """Update a result row with the scraped enhancement"""
+    
+    # Update with enhanced information
+    result_row['Toldirilgan_tavsif'] = enhancement_result['enhanced_description']
+    result_row['Qoshimcha_malumotlar'] = '; '.join(enhancement_result['improvements_made'])
+    result_row['Scraping_manbalar'] = len(enhancement_result['sources_used'])
+    result_row['Ishonch_darajasi'] = f"{enhancement_result['confidence_score']:.1f}%"
+    
+    # Re-analyze enhanced description
+    enhanced_analysis = enhancer.analyze_description_completeness(enhancement_result['enhanced_description'])
+    result_row['Yakuniy_toliqlik'] = f"{enhanced_analysis['completeness_score']:.1f}%"
+    result_row['Yakuniy_tayyorlik'] = enhanced_analysis['customs_readiness']
+    
+    # Add technical details if found
+    if enhancement_result['technical_details']:
+        tech_summary = []
+        for key, values in enhancement_result['technical_details'].items():
+            if values:
+                tech_summary.append(f"{key}: {', '.join(values[:2])}")
+        
+        if tech_summary:
+            result_row['Qoshimcha_malumotlar'] += f" | Texnik: {'; '.join(tech_summary[:3])}"
+    
+    if enhancement_result.get('timed_out_patterns'):
+        result_row['Qoshimcha_malumotlar'] += f" | Regex vaqti tugadi: {', '.join(enhancement_result['timed_out_patterns'])}"
+    
+    return result_row
+
+def process_products_for_customs(df: pd.DataFrame, enhancer: ProductDescriptionEnhancer, scraper: CustomsReadyProductScraper, budget: Optional[BatchBudget] = None, checkpoint: Optional[BatchCheckpoint] = None, progress_callback: Optional[Callable[[int, int, str], None]] = None, result_callback: Optional[Callable[[List[Dict]], None]] = None, stage_concurrency: Optional[Dict[str, int]] = None, execution_mode: str = 'threads', hs_index: Optional[HSNomenclatureIndex] = None, dedupe: bool = True, search_delay: float = 1.0) -> pd.DataFrame:
+    """Process products to make them customs-ready"""
+    
+    # Without a callback, report progress in the Streamlit page
+    progress_bar = None
+    if progress_callback is None:
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        
+        def progress_callback(done: int, total: int, description: str):
+            progress_bar.progress(done / total)
+            status_text.text(f"Tahlil qilinmoqda: {done}/{total} - {description}")
+    
+    # Rows completed by an earlier, interrupted run of the same file. Rows are
+    # checkpointed at their place in the file: the frame's integer index
+    # (kept by queue shards), else their position in the frame
+    file_positions = df.index.tolist() if pd.api.types.is_integer_dtype(df.index) else list(range(len(df)))
+    saved = checkpoint.load() if checkpoint else {}
+    completed = {
+        position: saved[(file_position, str(row_id))]
+        for position, (file_position, row_id) in enumerate(zip(file_positions, df['ID']))
+        if (file_position, str(row_id)) in saved
+    }
+    
+    total_products = len(df)
+    finished = [0]
+    normalizer_before = enhancer.normalizer.normalize.cache_info()
+    
+    pipeline_class = HybridBatchPipeline if execution_mode == 'hybrid' else BatchPipeline
+    pipeline = pipeline_class(enhancer, scraper, budget, stage_concurrency, search_delay=search_delay, dedupe=dedupe)
+    
+    def on_row(position: int, results: List[Dict]):
+        finished[0] += 1
+        row = results[position]
+        if checkpoint and position in pipeline.enhanced:
+            checkpoint.save(file_positions[position], row)
+        
+        progress_callback(finished[0], total_products, row['Asl_tavsif'])
+        
+        # Rows still being analyzed are None
+        if result_callback:
+            result_callback(results)
+    results, stage_stats = pipeline.run(df, completed, on_row)
+    
+    # Clear progress indicators
+    if progress_bar is not None:
+        progress_bar.empty()
+        status_text.empty()
+    
+    results_df = pd.DataFrame(results)
+    
+    # HS code suggestions for the whole batch in one scoring pass
+    if hs_index is not None and len(results_df):
+        suggestions = hs_index.suggest_batch(results_df['Toldirilgan_tavsif'].tolist())
+        results_df['HS_taklif'] = [format_hs_suggestions(items) for items in suggestions]
+    
+    results_df.attrs['stage_stats'] = stage_stats
+    if scraper.source_yield is not None:
+        scraper.source_yield.flush()
+    
+    # Normalization cache of the enhancer (shared with concurrent runs) and scrapes saved by family sharing
+    normalizer_after = enhancer.normalizer.normalize.cache_info()
+    family_hits, family_misses = len(pipeline.shared), len(pipeline.leaders)
+    PIPELINE_METRICS.record_cache('product_families', family_hits, family_misses)
+    results_df.attrs['cache_stats'] = [
+        cache_stats_row('normalizer', normalizer_after.hits - normalizer_before.hits, normalizer_after.misses - normalizer_before.misses),
+        cache_stats_row('product_families', family_hits, family_misses)
+    ]
+    if scraper.catalog is not None:
+        results_df.attrs['cache_stats'].append(cache_stats_row('catalog', len(pipeline.catalog_hits), len(pipeline.catalog_misses)))
+    results_df.attrs['row_latencies'] = [pipeline.latencies.get(position) for position in range(len(results))]
+    results_df.attrs['families'] = {'rows': len(results), 'families': len(set(pipeline.families)), 'shared': len(pipeline.shared)}
+    return results_df
+
+# ========================= BATCH PROFILING =========================
+
+PROFILE_MODES = ('deterministic', 'sampling')
+
+class BatchProfiler:
+    """Run a batch under cProfile or a stack sampler, with tracemalloc tracing allocations.
+    
+    The block's own thread and every thread started inside it are
+    profiled (pipeline stage workers included); the parse processes of
+    hybrid mode are not. Reports are written to `output_dir`:
+    <name>.profile.txt (top functions), <name>.prof (pstats, deterministic
+    mode) or <name>.folded (collapsed stacks for flame graphs, sampling
+    mode) and <name>.memory.txt (top allocation sites).
+    """
+    
+    def __init__(self, output_dir: Path, name: str, mode: str = 'deterministic', sample_interval: float = 0.005, top: int = 40, trace_frames: int = 10):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.output_dir = Path(output_dir)
+        self.name = name
+        self.mode = mode
+        self.sample_interval = sample_interval
+        self.top = top
+        self.trace_frames = trace_frames
+        self.reports = []
+        self._lock = threading.Lock()
+    
+    def __enter__(self) -> 'BatchProfiler':
+        self.own_tracing = not tracemalloc.is_tracing()
+        if self.own_tracing:
+            tracemalloc.start(self.trace_frames)
+        
+        if self.mode == 'deterministic':
+            self.profiles = [cProfile.Profile()]
+            # From 3.12 cProfile runs on sys.monitoring: one profiler sees every thread and a second one cannot be enabled
+            self.per_thread = sys.version_info < (3, 12)
+            if self.per_thread:
+                threading.setprofile(self._profile_thread)
+            self.profiles[0].enable()
+        else:
+            self.samples = {}
+            self.sample_count = 0
+            self._stop_sampling = threading.Event()
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        self.elapsed = time.perf_counter() - self.started
+        if self.mode == 'deterministic':
+            self.profiles[0].disable()
+            if self.per_thread:
+                threading.setprofile(None)
+        else:
+            self._stop_sampling.set()
+            self._sampler.join()
+        
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if self.own_tracing:
+            tracemalloc.stop()
+        
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.mode == 'deterministic':
+            self._write_deterministic()
+        else:
+            self._write_sampling()
+        self._write_memory(snapshot, peak)
+        return False
+    
+    def _profile_thread(self, frame, event, arg):
+        """First profile event of a new thread: give the thread its own cProfile"""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is active; leave the thread unprofiled rather than kill it
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self.profiles.append(profile)
+    
+    def _sample(self):
+        own_thread = threading.get_ident()
+        while not self._stop_sampling.wait(self.sample_interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+                self.sample_count += 1
+    
+    def _header(self) -> str:
+        return f"{self.mode} profile, {self.elapsed:.2f} s, {datetime.now().isoformat(timespec='seconds')}\n\n"
+    
+    def _write(self, suffix: str, text: str) -> Path:
+        path = self.output_dir / f"{self.name}{suffix}"
+        path.write_text(text, encoding='utf-8')
+        self.reports.append(path)
+        return path
+    
+    def _write_deterministic(self):
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        
+        prof_path = self.output_dir / f"{self.name}.prof"
+        stats.dump_stats(prof_path)
+        self.reports.append(prof_path)
+        
+        report = io.StringIO()
+        report.write(self._header() + f"{len(self.profiles)} threads\n")
+        for sort_key in ('cumulative', 'tottime'):
+            stats.stream = report
+            stats.sort_stats(sort_key).print_stats(self.top)
+        self._write('.profile.txt', report.getvalue())
+    
+    def _write_sampling(self):
+        self._write('.folded', ''.join(f"{stack} {count}\n" for stack, count in self.samples.items()))
+        
+        own, inclusive = {}, {}
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for function in set(frames):
+                inclusive[function] = inclusive.get(function, 0) + count
+        
+        total = max(self.sample_count, 1)
+        lines = [self._header() + f"{self.sample_count} samples every {self.sample_interval * 1000:.0f} ms (waiting threads included)\n"]
+        for title, counts in (('Own time', own), ('Including callees', inclusive)):
+            lines.append(f"\n{title}:")
+            for function, count in sorted(counts.items(), key=lambda item: -item[1])[:self.top]:
+                lines.append(f"{count / total * 100:6.1f}% {count:8d}  {function}")
+        self._write('.profile.txt', '\n'.join(lines) + '\n')
+    
+    def _write_memory(self, snapshot: tracemalloc.Snapshot, peak: int):
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        lines = [self._header() + f"Peak traced memory: {peak / 1024 / 1024:.1f} MB\n", "Top allocation sites still held at the end:"]
+        for statistic in snapshot.statistics('lineno')[:self.top]:
+            lines.append(f"{statistic.size / 1024:10.1f} KB {statistic.count:8d} blocks  {statistic.traceback[0]}")
+        
+        lines.append("\nTop allocation tracebacks:")
+        for statistic in snapshot.statistics('traceback')[:10]:
+            lines.append(f"\n{statistic.size / 1024:.1f} KB in {statistic.count} blocks")
+            lines.extend(statistic.traceback.format())
+        self._write('.memory.txt', '\n'.join(lines) + '\n')
+
+# ========================= BACKGROUND JOBS =========================
+
+class JobStore:
+    """On-disk store of batch jobs: status, progress and result location.
+    
+    Several processes (the Streamlit app, `serve`) may run jobs from the
+    same store. A process claims a job before running it and renews the
+    claim while it runs, the way ShardQueue leases shards; a claim not
+    renewed for `lease` seconds belongs to a process that stopped.
+    """
+    
+    def __init__(self, root: Optional[Path] = None, lease: float = 60):
+        self.root = Path(root) if root else DATA_DIR / 'jobs'
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / 'jobs.db'
+        self.lease = lease
+        
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, file_name TEXT, file_hash TEXT, status TEXT NOT NULL, '
+                'processed INTEGER DEFAULT 0, total INTEGER DEFAULT 0, settings TEXT, '
+                'result_path TEXT, error TEXT, created_at TEXT, updated_at TEXT, worker TEXT, heartbeat_at REAL, owner TEXT)'
+            )
+            # Stores created before claims and owners were added lack their columns
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in (('worker', 'TEXT'), ('heartbeat_at', 'REAL'), ('owner', 'TEXT')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    def job_dir(self, job_id: str) -> Path:
+        return self.root / job_id
+    
+    def create(self, df: pd.DataFrame, file_name: str, file_hash: str, settings: Dict, owner: Optional[str] = None) -> str:
+        """Store the input of a new job and register it as queued"""
+        job_id = uuid.uuid4().hex[:12]
+        self.job_dir(job_id).mkdir(parents=True, exist_ok=True)
+        df.to_pickle(self.job_dir(job_id) / 'input.pkl')
+        
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (job_id, file_name, file_hash, status, total, settings, created_at, updated_at, owner) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, file_name, file_hash, 'queued', len(df), json.dumps(settings), now, now, owner)
+            )
+        return job_id
+    
+    def update(self, job_id: str, **fields):
+        """Update status, progress or result fields of a job"""
+        fields['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        columns = ', '.join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f'UPDATE jobs SET {columns} WHERE job_id = ?', (*fields.values(), job_id))
+    
+    def transition(self, job_id: str, expected: str, **fields) -> bool:
+        """Update a job only if its status is still `expected`; returns whether it was"""
+        fields['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        columns = ', '.join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            cursor = conn.execute(f'UPDATE jobs SET {columns} WHERE job_id = ? AND status = ?', (*fields.values(), job_id, expected))
+        return cursor.rowcount == 1
+    
+    def claim(self, job_id: str, worker_id: str, abandoned_by: Optional[str] = None) -> bool:
+        """Claim a queued job, or a running one whose claim has expired or is still held by
+        `abandoned_by` (a worker known to have stopped); false if another worker holds it"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, heartbeat_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND (status = 'queued' OR (status = 'running' AND "
+                "(heartbeat_at IS NULL OR heartbeat_at < ? OR (? IS NOT NULL AND worker = ?))))",
+                (worker_id, now, datetime.now().isoformat(timespec='seconds'), job_id, now - self.lease, abandoned_by, abandoned_by)
+            )
+        return cursor.rowcount == 1
+    
+    def renew(self, job_id: str, worker_id: str, **fields) -> Optional[str]:
+        """Extend a worker's claim, updating `fields` too; returns the job status, or None if the claim was lost"""
+        fields['heartbeat_at'] = time.time()
+        fields['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        columns = ', '.join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f'UPDATE jobs SET {columns} WHERE job_id = ? AND worker = ?', (*fields.values(), job_id, worker_id))
+            row = conn.execute('SELECT status FROM jobs WHERE job_id = ? AND worker = ?', (job_id, worker_id)).fetchone()
+        return row['status'] if row else None
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def list(self, limit: int = 20, owner: Optional[str] = None) -> List[Dict]:
+        """Latest jobs, or only those of `owner`"""
+        with self._connect() as conn:
+            if owner is None:
+                rows = conn.execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?', (owner, limit)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def unfinished(self, stopped: Optional[Callable[[Optional[str]], bool]] = None) -> List[Dict]:
+        """Jobs to resume: queued ones, and running ones whose claim has expired or whose worker `stopped` says is gone.
+        
+        A job that was being cancelled by a process that stopped is marked
+        cancelled instead.
+        """
+        expired = time.time() - self.lease
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running', 'cancelling') ORDER BY created_at").fetchall()
+        
+        def orphaned(job: Dict) -> bool:
+            return job['heartbeat_at'] is None or job['heartbeat_at'] < expired or bool(stopped and stopped(job['worker']))
+        
+        jobs = []
+        for job in map(dict, rows):
+            if job['status'] == 'cancelling' and orphaned(job):
+                self.transition(job['job_id'], 'cancelling', status='cancelled')
+            elif job['status'] == 'queued' or (job['status'] == 'running' and orphaned(job)):
+                jobs.append(job)
+        return jobs
+    
+    def load_input(self, job_id: str) -> pd.DataFrame:
+        return pd.read_pickle(self.job_dir(job_id) / 'input.pkl')
+    
+    def save_partial(self, job_id: str, results: List[Dict]):
+        """Write the rows processed so far, replacing the previous snapshot atomically"""
+        partial_path = self.job_dir(job_id) / 'partial.pkl'
+        temp_path = partial_path.with_suffix('.tmp')
+        pd.DataFrame([row for row in results if row is not None]).to_pickle(temp_path)
+        os.replace(temp_path, partial_path)
+    
+    def profile_reports(self, job_id: str) -> List[Path]:
+        """Profiler output of a job run with profiling enabled"""
+        return sorted(path for path in self.job_dir(job_id).glob('results.*') if path.suffix != '.pkl')
+    
+    def load_results(self, job_id: str) -> Optional[pd.DataFrame]:
+        """Final results, or the latest partial snapshot of a job still running"""
+        job = self.get(job_id)
+        if not job:
+            return None
+        if job['result_path']:
+            return pd.read_pickle(job['result_path'])
+        
+        partial_path = self.job_dir(job_id) / 'partial.pkl'
+        if partial_path.exists():
+            return pd.read_pickle(partial_path)
+        return None
+
+# Tells this run of the process from an earlier one that had the same PID (a restarted container)
+PROCESS_BOOT_ID = uuid.uuid4().hex[:8]
+
+def _process_running(pid: int) -> bool:
+    """Whether a local process exists; assumed so where that cannot be checked cheaply (Windows)"""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobManager:
+    """Local worker pool that runs queued batch jobs off the Streamlit request thread.
+    
+    Claims are tagged host:pid:boot-id. On start, and then every third of
+    the lease, the manager renews the claims of its running jobs and picks
+    up jobs left behind: queued ones, ones whose claim expired, and ones
+    claimed by an earlier run on this host (a different boot ID, or a PID
+    that no longer exists) without waiting for their lease to expire.
+    """
+    
+    def __init__(self, store: Optional[JobStore] = None, max_workers: Optional[int] = None):
+        self.store = store or JobStore()
+        self.max_workers = max_workers or int(os.environ.get('CUSTOMS_JOB_WORKERS', 2))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='customs-job')
+        self.partial_interval = 2.0  # Seconds between partial result snapshots
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{PROCESS_BOOT_ID}"
+        self._budgets = {}
+        self._scheduled = set()  # Jobs submitted to the executor and not finished yet
+        self._lock = threading.Lock()
+        
+        # Jobs interrupted by a restart resume from their checkpoint; another
+        # process resuming the same job at the same time loses the claim
+        self._resume_unfinished()
+        threading.Thread(target=self._watch, daemon=True, name='job-watch').start()
+    
+    def submit(self, df: pd.DataFrame, file_name: str, file_hash: str, settings: Dict, owner: Optional[str] = None) -> str:
+        """Queue a batch and return its job ID"""
+        job_id = self.store.create(df, file_name, file_hash, settings, owner)
+        self._schedule(job_id)
+        return job_id
+    
+    def _schedule(self, job_id: str, abandoned_by: Optional[str] = None):
+        with self._lock:
+            if job_id in self._scheduled:
+                return
+            self._scheduled.add(job_id)
+        self.executor.submit(self._run_job, job_id, abandoned_by)
+    
+    def _stopped(self, worker: Optional[str]) -> bool:
+        """Whether a claim was made by an earlier run on this host"""
+        if not worker or worker.count(':') < 2:
+            return False
+        host, pid, boot_id = worker.rsplit(':', 2)
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            return boot_id != PROCESS_BOOT_ID
+        return not _process_running(int(pid))
+    
+    def _resume_unfinished(self):
+        for job in self.store.unfinished(self._stopped):
+            self._schedule(job['job_id'], job['worker'] if job['status'] == 'running' else None)
+    
+    def _watch(self):
+        """Keep the claims of running jobs alive and pick up jobs other processes left behind"""
+        while True:
+            time.sleep(self.store.lease / 3)
+            try:
+                for job_id, budget in list(self._budgets.items()):
+                    if self.store.renew(job_id, self.worker_id) == 'cancelling':
+                        budget.cancel()
+                self._resume_unfinished()
+            except Exception:
+                pass
+    
+    def cancel(self, job_id: str):
+        """Cancel a queued job, or stop a running one keeping the rows done so far"""
+        job = self.store.get(job_id)
+        if not job:
+            return
+        
+        if job['status'] == 'queued' and self.store.transition(job_id, 'queued', status='cancelled'):
+            return
+        if job_id in self._budgets:
+            self._budgets[job_id].cancel()
+        # A job run by another process stops when it next renews its claim
+        self.store.transition(job_id, 'running', status='cancelling')
+    
+    def _run_job(self, job_id: str, abandoned_by: Optional[str] = None):
+        try:
+            self._run_claimed(job_id, abandoned_by)
+        finally:
+            with self._lock:
+                self._scheduled.discard(job_id)
+    
+    def _run_claimed(self, job_id: str, abandoned_by: Optional[str]):
+        job = self.store.get(job_id)
+        settings = json.loads(job['settings'] or '{}')
+        budget = BatchBudget(settings.get('time_limit'), settings.get('max_requests'), settings.get('per_product_requests'))
+        self._budgets[job_id] = budget
+        
+        # Only a job still queued (or abandoned) is started; one cancelled meanwhile or run by another process is skipped
+        if not self.store.claim(job_id, self.worker_id, abandoned_by):
+            self._budgets.pop(job_id, None)
+            return
+        
+        try:
+            df = self.store.load_input(job_id)
+            engines = get_engines()
+            enhancer, scraper = engines.enhancer, engines.scraper
+            checkpoint = BatchCheckpoint(job['file_hash']) if settings.get('checkpoint', True) else None
+            
+            last_progress = [0.0]
+            last_snapshot = [0.0]
+            
+            def report_progress(done: int, total: int, description: str):
+                if done == total or time.monotonic() - last_progress[0] >= 0.5:
+                    if self.store.renew(job_id, self.worker_id, processed=done, total=total) == 'cancelling':
+                        budget.cancel()
+                    last_progress[0] = time.monotonic()
+            
+            def snapshot_results(results: List[Dict]):
+                if time.monotonic() - last_snapshot[0] >= self.partial_interval:
+                    self.store.save_partial(job_id, results)
+                    last_snapshot[0] = time.monotonic()
+            
+            # Profile reports are written next to the job's results
+            profiler = BatchProfiler(self.store.job_dir(job_id), 'results', settings['profile']) if settings.get('profile') else contextlib.nullcontext()
+            with profiler:
+                results_df = process_products_for_customs(df, enhancer, scraper, budget, checkpoint, report_progress, snapshot_results, settings.get('stage_concurrency'), settings.get('execution_mode', 'threads'), engines.hs_index, settings.get('dedupe', True))
+            
+            result_path = self.store.job_dir(job_id) / 'results.pkl'
+            results_df.to_pickle(result_path)
+            status = 'cancelled' if budget.cancelled.is_set() else 'done'
+            self.store.update(job_id, status=status, result_path=str(result_path))
+            # A finished job has its results; only a cancelled one may be resumed from its checkpoint
+            if checkpoint is not None and status == 'done':
+                checkpoint.clear()
+            
+        except Exception as e:
+            self.store.update(job_id, status='failed', error=str(e))
+        
+        finally:
+            self._budgets.pop(job_id, None)
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """One job manager per server process, shared by every session"""
+    return JobManager()
+
+# ========================= DISTRIBUTED WORKERS =========================
+
+class ShardQueue:
+    """Durable SQLite work queue that splits batches into shards for headless workers.
+    
+    Workers on any host that can open the database file claim a shard,
+    process it and store the results. A claim whose heartbeat is older
+    than the lease expires and the shard goes to the next worker. Every
+    claim counts as an attempt, so a shard that keeps failing or keeps
+    losing its claim (say, by crashing its worker) is marked failed after
+    `max_attempts` attempts.
+    """
+    
+    def __init__(self, db_path: Optional[Path] = None, lease: float = 300, max_attempts: int = 3):
+        self.db_path = Path(db_path) if db_path else DATA_DIR / 'shards.db'
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS batches ('
+                'batch_id TEXT PRIMARY KEY, file_name TEXT, file_hash TEXT, total_shards INTEGER, '
+                'settings TEXT, created_at TEXT)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS shards ('
+                'batch_id TEXT NOT NULL, shard_no INTEGER NOT NULL, status TEXT NOT NULL, '
+                'attempts INTEGER DEFAULT 0, worker TEXT, heartbeat_at REAL, '
+                'input BLOB NOT NULL, result BLOB, error TEXT, '
+                'PRIMARY KEY (batch_id, shard_no))'
+            )
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    @staticmethod
+    def _dump_frame(df: pd.DataFrame) -> bytes:
+        # JSON with a table schema rather than pickle: the database file is shared between hosts
+        return df.to_json(orient='table', force_ascii=False, default_handler=str).encode('utf-8')
+    
+    @staticmethod
+    def _load_frame(blob: bytes) -> pd.DataFrame:
+        return pd.read_json(io.StringIO(bytes(blob).decode('utf-8')), orient='table')
+    
+    def submit(self, df: pd.DataFrame, file_name: str, file_hash: str, shard_size: int = 500, settings: Optional[Dict] = None) -> str:
+        """Split a batch into shards and queue them"""
+        batch_id = uuid.uuid4().hex[:12]
+        shards = [df.iloc[start:start + shard_size] for start in range(0, len(df), shard_size)]
+        
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO batches (batch_id, file_name, file_hash, total_shards, settings, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (batch_id, file_name, file_hash, len(shards), json.dumps(settings or {}), datetime.now().isoformat(timespec='seconds'))
+            )
+            conn.executemany(
+                'INSERT INTO shards (batch_id, shard_no, status, input) VALUES (?, ?, ?, ?)',
+                [(batch_id, shard_no, 'pending', self._dump_frame(shard)) for shard_no, shard in enumerate(shards)]
+            )
+            conn.execute('COMMIT')
+        return batch_id
+    
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Claim a pending shard, or one whose claim has expired"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            while True:
+                row = conn.execute(
+                    "SELECT s.batch_id, s.shard_no, s.status, s.attempts, s.input, b.file_hash, b.settings "
+                    "FROM shards s JOIN batches b ON b.batch_id = s.batch_id "
+                    "WHERE s.status = 'pending' OR (s.status = 'claimed' AND s.heartbeat_at < ?) "
+                    "ORDER BY b.created_at, s.shard_no LIMIT 1",
+                    (now - self.lease,)
+                ).fetchone()
+                
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+                if row['status'] == 'pending' or row['attempts'] < self.max_attempts:
+                    break
+                
+                # Expired claim on its last attempt: the shard likely takes its workers down with it
+                conn.execute(
+                    "UPDATE shards SET status = 'failed', error = ? WHERE batch_id = ? AND shard_no = ?",
+                    (f"Claim expired on attempt {row['attempts']} of {self.max_attempts}", row['batch_id'], row['shard_no'])
+                )
+                logger.warning("Shard %s/%s failed: claim expired on attempt %s", row['batch_id'], row['shard_no'], row['attempts'])
+            
+            conn.execute(
+                "UPDATE shards SET status = 'claimed', worker = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                "WHERE batch_id = ? AND shard_no = ?",
+                (worker_id, now, row['batch_id'], row['shard_no'])
+            )
+            conn.execute('COMMIT')
+        
+        return {
+            'batch_id': row['batch_id'],
+            'shard_no': row['shard_no'],
+            'attempts': row['attempts'] + 1,
+            'file_hash': row['file_hash'],
+            'settings': json.loads(row['settings'] or '{}'),
+            'df': self._load_frame(row['input'])
+        }
+    
+    def heartbeat(self, shard: Dict, worker_id: str):
+        """Extend the claim of a shard still being processed"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE shards SET heartbeat_at = ? WHERE batch_id = ? AND shard_no = ? AND worker = ?",
+                (time.time(), shard['batch_id'], shard['shard_no'], worker_id)
+            )
+    
+    def complete(self, shard: Dict, worker_id: str, results_df: pd.DataFrame):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE shards SET status = 'done', result = ?, error = NULL "
+                "WHERE batch_id = ? AND shard_no = ? AND worker = ?",
+                (self._dump_frame(results_df), shard['batch_id'], shard['shard_no'], worker_id)
+            )
+    
+    def fail(self, shard: Dict, worker_id: str, error: str):
+        """Give a failed shard back to the queue, or mark it failed after too many attempts"""
+        status = 'failed' if shard['attempts'] >= self.max_attempts else 'pending'
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE shards SET status = ?, error = ? WHERE batch_id = ? AND shard_no = ? AND worker = ?",
+                (status, error, shard['batch_id'], shard['shard_no'], worker_id)
+            )
+    
+    def status(self, batch_id: str) -> Dict[str, int]:
+        """Shard counts by status"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) FROM shards WHERE batch_id = ? GROUP BY status', (batch_id,)).fetchall()
+        return {status: count for status, count in rows}
+    
+    def batches(self) -> List[Dict]:
+        with self._connect() as conn:
+            rows = conn.execute('SELECT * FROM batches ORDER BY created_at DESC').fetchall()
+        return [dict(row) for row in rows]
+    
+    def merge(self, batch_id: str) -> pd.DataFrame:
+        """Results of every finished shard, in the input's ID order"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT result FROM shards WHERE batch_id = ? AND status = 'done' ORDER BY shard_no",
+                (batch_id,)
+            ).fetchall()
+        frames = [self._load_frame(row['result']) for row in rows]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def run_worker(shard_queue: ShardQueue, worker_id: Optional[str] = None, exit_when_idle: bool = False, poll_interval: float = 5.0, profile: Optional[str] = None):
+    """Claim and process shards until stopped (or until the queue is empty)"""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    engines = get_engines()
+    enhancer, scraper = engines.enhancer, engines.scraper
+    
+    while True:
+        shard = shard_queue.claim(worker_id)
+        if shard is None:
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        
+        logger.info("[%s] %s/%s: %s ta tovar (urinish %s)", worker_id, shard['batch_id'], shard['shard_no'], len(shard['df']), shard['attempts'])
+        settings = shard['settings']
+        last_heartbeat = [time.monotonic()]
+        
+        def keep_claim(done: int, total: int, description: str):
+            if time.monotonic() - last_heartbeat[0] >= shard_queue.lease / 3:
+                shard_queue.heartbeat(shard, worker_id)
+                last_heartbeat[0] = time.monotonic()
+        
+        try:
+            budget = BatchBudget(None, None, settings.get('per_product_requests'))
+            checkpoint = BatchCheckpoint(shard['file_hash']) if settings.get('checkpoint', True) else None
+            profiler = BatchProfiler(shard_queue.db_path.parent / 'profiles', f"{shard['batch_id']}-{shard['shard_no']}", profile) if profile else contextlib.nullcontext()
+            with profiler:
+                results_df = process_products_for_customs(
+                    shard['df'], enhancer, scraper, budget, checkpoint, keep_claim, None,
+                    settings.get('stage_concurrency'), settings.get('execution_mode', 'threads'), engines.hs_index,
+                    settings.get('dedupe', True)
+                )
+            shard_queue.complete(shard, worker_id, results_df)
+            # Other shards of the same file may still be running, so only this shard's rows are forgotten
+            if checkpoint is not None:
+                checkpoint.clear(shard['df'].index.tolist())
+        
+        except Exception as e:
+            logger.exception("[%s] %s/%s xatolik bilan tugadi", worker_id, shard['batch_id'], shard['shard_no'])
+            shard_queue.fail(shard, worker_id, str(e))
+
+# ========================= HTTP API =========================
+
+class MicroBatcher:
+    """Groups concurrent single-item calls into one call of a batch function.
+    
+    Requests that arrive while a batch is being processed are drained
+    together into the next batch, so a lone request is never delayed and
+    a burst of requests shares one batch call. Items are checked by
+    `validate` before they are queued, and a batch call that still fails
+    is retried item by item, so each caller only ever gets its own error.
+    """
+    
+    def __init__(self, batch_function: Callable[[List], List], max_batch: int = 256, validate: Optional[Callable[[object], None]] = None):
+        self.batch_function = batch_function
+        self.max_batch = max_batch
+        self.validate = validate
+        self.queue = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True, name='micro-batcher').start()
+    
+    def submit(self, item):
+        """Process one item and wait for its result"""
+        if self.validate:
+            self.validate(item)
+        future = Future()
+        self.queue.put((item, future))
+        return future.result()
+    
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                results = self.batch_function([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._run_each(batch)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+    
+    def _run_each(self, batch: List[Tuple]):
+        """Retry a failed batch one item at a time"""
+        for item, future in batch:
+            try:
+                future.set_result(self.batch_function([item])[0])
+            except Exception as e:
+                future.set_exception(e)
+
+class AnalyzerService:
+    """Analysis and enhancement behind the HTTP API"""
+    
+    def __init__(self, enhancement_workers: int = 4, enhancement_ttl: float = 3600, max_enhancements: int = 1000):
+        engines = get_engines()
+        self.enhancer = engines.enhancer
+        self.scraper = engines.scraper
+        self.batcher = MicroBatcher(self.enhancer.analyze_descriptions_batch, validate=self._check_description)
+        self.enhancement_pool = ThreadPoolExecutor(max_workers=enhancement_workers, thread_name_prefix='enhance')
+        self.enhancements = {}
+        self.finished = {}  # Job ID -> monotonic finish time, oldest first
+        self.enhancement_ttl = enhancement_ttl  # Seconds a finished enhancement stays available
+        self.max_enhancements = max_enhancements
+        self._lock = threading.Lock()
+        self.job_manager = None  # Created on the first bulk enhancement
+    
+    @staticmethod
+    def _check_description(description):
+        if not isinstance(description, str):
+            raise TypeError(f"description must be a string, not {type(description).__name__}")
+    
+    def analyze(self, description: str) -> Dict:
+        return self.batcher.submit(description)
+    
+    def analyze_bulk(self, descriptions: List[str]) -> List[Dict]:
+        if not isinstance(descriptions, list):
+            raise TypeError("descriptions must be a list of strings")
+        for description in descriptions:
+            self._check_description(description)
+        return self.enhancer.analyze_descriptions_batch(descriptions)
+    
+    def submit_enhancement(self, description: str, missing_elements: Optional[List[str]] = None) -> str:
+        """Start enhancing one description; returns its job ID"""
+        self._check_description(description)
+        if missing_elements is not None and not (isinstance(missing_elements, list) and all(isinstance(element, str) for element in missing_elements)):
+            raise TypeError("missing_elements must be a list of strings")
+        if missing_elements is None:
+            missing_elements = self.analyze(description)['missing_elements']
+        
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._prune()
+            self.enhancements[job_id] = {'job_id': job_id, 'status': 'running', 'result': None, 'error': None}
+        self.enhancement_pool.submit(self._enhance, job_id, description, missing_elements)
+        return job_id
+    
+    def _enhance(self, job_id: str, description: str, missing_elements: List[str]):
+        try:
+            result = self.scraper.enhance_product_description(description, missing_elements)
+            update = {'status': 'done', 'result': result}
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e)}
+        with self._lock:
+            self.enhancements[job_id].update(update)
+            self.finished[job_id] = time.monotonic()
+    
+    def _prune(self):
+        """Forget finished enhancements past their TTL, then the oldest finished ones beyond the cap (lock held)"""
+        expired = time.monotonic() - self.enhancement_ttl
+        evict = [job_id for job_id, finished_at in self.finished.items() if finished_at < expired]
+        overflow = len(self.enhancements) - len(evict) - self.max_enhancements + 1
+        if overflow > 0:
+            expired_ids = set(evict)
+            evict += [job_id for job_id in self.finished if job_id not in expired_ids][:overflow]
+        for job_id in evict:
+            del self.finished[job_id]
+            del self.enhancements[job_id]
+    
+    def _jobs(self) -> JobManager:
+        """The batch job manager, created under the lock on first use"""
+        with self._lock:
+            if self.job_manager is None:
+                self.job_manager = JobManager()
+            return self.job_manager
+    
+    def enhancement(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self.enhancements.get(job_id)
+            return dict(job) if job else None
+    
+    def submit_batch(self, items: List[Dict], settings: Optional[Dict] = None) -> str:
+        """Queue a bulk enhancement as a background batch job"""
+        df = pd.DataFrame(items)
+        is_valid, validation_message = validate_uploaded_file(df)
+        if not is_valid:
+            raise ValueError(validation_message)
+        for description in df['Tovar_nomi']:
+            self._check_description(description)
+        
+        file_hash = BatchCheckpoint.hash_file(df.to_csv(index=False).encode('utf-8'))
+        return self._jobs().submit(df, 'api', file_hash, settings or {})
+    
+    def batch(self, job_id: str) -> Optional[Dict]:
+        job_manager = self._jobs()
+        job = job_manager.store.get(job_id)
+        if not job:
+            return None
+        
+        results_df = job_manager.store.load_results(job_id)
+        job['results'] = results_df.to_dict(orient='records') if results_df is not None else []
+        return job
+
+class AnalyzerRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints:
+    
+    POST /analyze          {"description": "..."}
+    POST /analyze/bulk     {"descriptions": ["...", ...]}
+    POST /enhance          {"description": "...", "missing_elements": [...]}  -> 202 {"job_id"}
+    GET  /enhance/<job_id>
+    POST /enhance/bulk     {"items": [{"ID": ..., "Tovar_nomi": "..."}], "settings": {...}}  -> 202 {"job_id"}
+    GET  /jobs/<job_id>
+    GET  /health
+    GET  /metrics          Prometheus text format
+    """
+    
+    protocol_version = 'HTTP/1.1'  # Keep-alive for high request rates
+    disable_nagle_algorithm = True  # Small responses go out without waiting for ACKs
+    service: AnalyzerService = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+    
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        
+        if parts == ['health']:
+            self._send(200, {'status': 'ok'})
+        elif parts == ['metrics']:
+            send_prometheus(self)
+        elif len(parts) == 2 and parts[0] in ('enhance', 'jobs'):
+            if parts[0] == 'enhance':
+                job = self.service.enhancement(parts[1])
+            else:
+                job = self.service.batch(parts[1])
+            
+            if job:
+                self._send(200, job)
+            else:
+                self._send(404, {'error': 'job not found'})
+        else:
+            self._send(404, {'error': 'not found'})
+    
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+            
+            if self.path == '/analyze':
+                self._send(200, self.service.analyze(payload['description']))
+            elif self.path == '/analyze/bulk':
+                self._send(200, self.service.analyze_bulk(payload['descriptions']))
+            elif self.path == '/enhance':
+                job_id = self.service.submit_enhancement(payload['description'], payload.get('missing_elements'))
+                self._send(202, {'job_id': job_id})
+            elif self.path == '/enhance/bulk':
+                job_id = self.service.submit_batch(payload['items'], payload.get('settings'))
+                self._send(202, {'job_id': job_id})
+            else:
+                self._send(404, {'error': 'not found'})
+        
+        except (KeyError, ValueError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            self._send(500, {'error': f"{type(e).__name__}: {e}"})
+
+def send_prometheus(handler: BaseHTTPRequestHandler):
+    body = PIPELINE_METRICS.render_prometheus().encode('utf-8')
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics for the Streamlit process, where interactive batches run"""
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            send_prometheus(self)
+        else:
+            self.send_error(404)
+
+@st.cache_resource
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread, once per process"""
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class AnalyzerHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Many clients connect at once under load
+
+def serve_api(host: str = '127.0.0.1', port: int = 8600) -> AnalyzerHTTPServer:
+    """Create the API server; call serve_forever() on the result"""
+    handler = type('BoundAnalyzerRequestHandler', (AnalyzerRequestHandler,), {'service': AnalyzerService()})
+    return AnalyzerHTTPServer((host, port), handler)
+
+def run_load_test(url: str, requests_count: int = 10000, concurrency: int = 32, descriptions: Optional[List[str]] = None) -> Dict:
+    """Send concurrent /analyze requests over keep-alive connections and report latency percentiles"""
+    parsed = urlparse(url)
+    descriptions = descriptions or [
+        'iPhone', 'Samsung Galaxy S24 Ultra 512GB', 'BMW X5 xDrive40i 2024 Black', 'Coca Cola',
+        'MacBook Pro M3 16 inch', 'Nike Air Max 270', 'Sony WH-1000XM5', 'Tesla Model 3'
+    ]
+    if requests_count < 1 or concurrency < 1:
+        raise ValueError("requests_count and concurrency must be at least 1")
+    # Never more workers than requests; the remainder goes one each to the first workers
+    concurrency = min(concurrency, requests_count)
+    per_worker = [requests_count // concurrency + (index < requests_count % concurrency) for index in range(concurrency)]
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    
+    def worker(index: int):
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+        for number in range(per_worker[index]):
+            body = json.dumps({'description': descriptions[(index + number) % len(descriptions)]})
+            started = time.perf_counter()
+            try:
+                connection.request('POST', '/analyze', body, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[index] += 1
+            except Exception:
+                errors[index] += 1
+                connection.close()
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+            latencies[index].append(time.perf_counter() - started)
+        connection.close()
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    all_latencies = np.array([latency for worker_latencies in latencies for latency in worker_latencies]) * 1000
+    return {
+        'requests': len(all_latencies),
+        'errors': sum(errors),
+        'requests_per_second': len(all_latencies) / elapsed,
+        'p50_ms': float(np.percentile(all_latencies, 50)),
+        'p95_ms': float(np.percentile(all_latencies, 95)),
+        'p99_ms': float(np.percentile(all_latencies, 99))
+    }
+
+# ========================= OFFLINE REPLAY HARNESS =========================
+
+CASSETTE_DIR = DATA_DIR / 'cassettes'
+# Tracked in the repository, like the micro-benchmark baseline, so runs can be compared across commits
+BENCHMARK_LOG = Path(__file__).parent / 'benchmarks' / 'e2e.jsonl'
+
+class Cassette:
+    """Recorded HTTP responses (search and product pages), keyed by the requested URL"""
+    
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'url TEXT PRIMARY KEY, status INTEGER NOT NULL, headers TEXT NOT NULL, '
+                'body BLOB NOT NULL, elapsed REAL NOT NULL, recorded_at TEXT NOT NULL)'
+            )
+    
+    @classmethod
+    def named(cls, name: str) -> 'Cassette':
+        """Cassette stored as data/cassettes/<name>.db"""
+        return cls(CASSETTE_DIR / f"{name}.db")
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    def record(self, url: str, status: int, headers: Dict, body: bytes, elapsed: float):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (url, status, headers, body, elapsed, recorded_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, status, json.dumps(headers), body, elapsed, datetime.now().isoformat(timespec='seconds'))
+            )
+    
+    def load(self) -> Dict[str, Dict]:
+        """Every recorded response, for serving from memory"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT url, status, headers, body, elapsed FROM responses').fetchall()
+        return {
+            url: {'status': status, 'headers': json.loads(headers), 'body': body, 'elapsed': elapsed}
+            for url, status, headers, body, elapsed in rows
+        }
+    
+    def __len__(self) -> int:
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+class CassetteAdapter(HTTPAdapter):
+    """Transport adapter under the scraper session that records responses or sends requests to a replay server.
+    
+    Each redirect hop passes through the adapter on its own, so hops are
+    recorded under their own URLs together with the Location header and
+    replay follows the same chain.
+    """
+    
+    REPLAYED_HEADERS = ('Content-Type', 'Location')
+    
+    def __init__(self, cassette: Optional[Cassette] = None, replay_url: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+        self.replay_url = replay_url
+        self.requests = 0
+        self._lock = threading.Lock()
+    
+    def send(self, request, **kwargs):
+        with self._lock:
+            self.requests += 1
+        
+        if self.replay_url:
+            request.url = f"{self.replay_url}/replay?url={quote(request.url, safe='')}"
+            return super().send(request, **kwargs)
+        
+        started = time.monotonic()
+        response = super().send(request, **kwargs)
+        headers = {name: response.headers[name] for name in self.REPLAYED_HEADERS if name in response.headers}
+        if 'Location' in headers:
+            # Relative redirects would otherwise resolve against the replay server
+            headers['Location'] = urljoin(request.url, headers['Location'])
+        self.cassette.record(request.url, response.status_code, headers, response.content, time.monotonic() - started)
+        return response
+
+def attach_cassette(scraper: CustomsReadyProductScraper, cassette: Optional[Cassette] = None, replay_url: Optional[str] = None) -> CassetteAdapter:
+    """Record the scraper's traffic into `cassette`, or replay it from the server at `replay_url`"""
+    adapter = CassetteAdapter(cassette, replay_url, pool_connections=32, pool_maxsize=32)
+    scraper.session.mount('https://', adapter)
+    scraper.session.mount('http://', adapter)
+    scraper.cassette = adapter
+    return adapter
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    """GET /replay?url=<recorded URL> -> the recorded response, after the injected latency"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        url = parse_qs(parsed.query).get('url', [''])[0]
+        recorded = self.server.responses.get(url) if parsed.path == '/replay' else None
+        delay, failed = self.server.plan(recorded)
+        time.sleep(delay)
+        
+        if failed:
+            status, headers, body = 503, {}, b''
+        elif recorded is None:
+            status, headers, body = 404, {}, b''
+        else:
+            status, headers, body = recorded['status'], recorded['headers'], recorded['body']
+        
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class ReplayHTTPServer(ThreadingHTTPServer):
+    """Local stand-in for search and vendor sites, serving a cassette with injected latency and failures.
+    
+    Every response waits `latency` seconds plus uniform jitter, or the
+    recorded response time when `recorded_latency` is set. A `failure_rate`
+    share of requests gets HTTP 503 instead; URLs missing from the cassette
+    get 404.
+    """
+    
+    daemon_threads = True
+    request_queue_size = 256
+    
+    def __init__(self, address: Tuple[str, int], cassette: Cassette, latency: float = 0.0, jitter: float = 0.0, recorded_latency: bool = False, failure_rate: float = 0.0, seed: int = 0):
+        super().__init__(address, ReplayRequestHandler)
+        self.responses = cassette.load()
+        self.latency = latency
+        self.jitter = jitter
+        self.recorded_latency = recorded_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.counts = {'served': 0, 'missing': 0, 'failed': 0}
+        self._lock = threading.Lock()
+    
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def plan(self, recorded: Optional[Dict]) -> Tuple[float, bool]:
+        """Delay and injected failure for one request"""
+        with self._lock:
+            if self.recorded_latency and recorded is not None:
+                delay = recorded['elapsed']
+            else:
+                delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.failure_rate
+            self.counts['failed' if failed else 'missing' if recorded is None else 'served'] += 1
+        return delay, failed
+
+def record_cassette(df: pd.DataFrame, cassette: Cassette, per_product_requests: int = 0, dedupe: bool = True) -> pd.DataFrame:
+    """Run a batch against the live sites, saving every response into the cassette"""
+    enhancer = ProductDescriptionEnhancer()
+    scraper = CustomsReadyProductScraper(enhancer)
+    attach_cassette(scraper, cassette)
+    budget = BatchBudget(None, None, per_product_requests)
+    return process_products_for_customs(df, enhancer, scraper, budget, progress_callback=lambda done, total, description: None, dedupe=dedupe)
+
+def run_e2e_benchmark(df: pd.DataFrame, cassette: Cassette, label: str = '', latency: float = 0.0, jitter: float = 0.0, recorded_latency: bool = False, failure_rate: float = 0.0, execution_mode: str = 'threads', per_product_requests: int = 0, dedupe: bool = True, search_delay: float = 0.0, seed: int = 0) -> Dict:
+    """Run process_products_for_customs over a corpus against the replay server and measure it.
+    
+    Uses fresh engines without the enrichment cache, so every run scrapes
+    the same way. The politeness delay between searches defaults to 0 since
+    nothing leaves the machine.
+    """
+    server = ReplayHTTPServer(('127.0.0.1', 0), cassette, latency, jitter, recorded_latency, failure_rate, seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
     
-    def _extract_additional_specs(self, collected_info: Dict) -> Dict:
-        """Extract additional specifications"""
-        all_text = ' '.join(collected_info.get('raw_text', []))
+    try:
+        enhancer = ProductDescriptionEnhancer()
+        scraper = CustomsReadyProductScraper(enhancer)
+        adapter = attach_cassette(scraper, replay_url=server.url)
+        budget = BatchBudget(None, None, per_product_requests)
         
-        specs = {
-            'operating_system': [],
-            'year': [],
-            'special_features': [],
-            'country_origin': []
+        started = time.perf_counter()
+        results_df = process_products_for_customs(
+            df, enhancer, scraper, budget, progress_callback=lambda done, total, description: None,
+            execution_mode=execution_mode, dedupe=dedupe, search_delay=search_delay
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+    
+    latencies = np.array([latency for latency in results_df.attrs['row_latencies'] if latency is not None]) * 1000
+    initial = results_df['Dastlabki_toliqlik'].str.rstrip('%').astype(float)
+    final = results_df['Yakuniy_toliqlik'].str.rstrip('%').astype(float)
+    corpus_hash = hashlib.sha256(pd.util.hash_pandas_object(df[['ID', 'Tovar_nomi']], index=False).values.tobytes()).hexdigest()[:16]
+    
+    return {
+        'label': label,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'corpus': corpus_hash,
+        'cassette': cassette.db_path.stem,
+        'settings': {
+            'execution_mode': execution_mode, 'latency_ms': latency * 1000, 'jitter_ms': jitter * 1000,
+            'recorded_latency': recorded_latency, 'failure_rate': failure_rate,
+            'per_product_requests': per_product_requests, 'dedupe': dedupe, 'search_delay': search_delay
+        },
+        'products': len(results_df),
+        'elapsed_s': elapsed,
+        'products_per_second': len(results_df) / elapsed if elapsed > 0 else 0.0,
+        'requests': adapter.requests,
+        'requests_per_product': adapter.requests / len(results_df) if len(results_df) else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+        'enhanced': int((results_df['Scraping_manbalar'] > 0).sum()),
+        'completeness_before': float(initial.mean()),
+        'completeness_after': float(final.mean()),
+        'completeness_gained': float((final - initial).mean()),
+        'replay': server.counts
+    }
+
+BENCHMARK_METRICS = ['products_per_second', 'requests_per_product', 'p50_ms', 'p95_ms', 'completeness_gained']
+
+def save_benchmark_result(report: Dict, log_path: Path = BENCHMARK_LOG) -> Optional[Dict]:
+    """Append a run to the benchmark log; returns the previous run of the same corpus, cassette and settings"""
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    previous = None
+    if log_path.exists():
+        for line in log_path.read_text(encoding='utf-8').splitlines():
+            run = json.loads(line)
+            if (run['corpus'], run['cassette'], run['settings']) == (report['corpus'], report['cassette'], report['settings']):
+                previous = run
+    
+    with log_path.open('a', encoding='utf-8') as log:
+        log.write(json.dumps(report, ensure_ascii=False) + '\n')
+    return previous
+
+def compare_benchmarks(report: Dict, previous: Dict) -> pd.DataFrame:
+    """Side-by-side metrics of two runs with the relative change"""
+    return pd.DataFrame([
+        {
+            'metric': metric,
+            'previous': previous[metric],
+            'current': report[metric],
+            'change_%': (report[metric] - previous[metric]) / previous[metric] * 100 if previous[metric] else None
         }
-        
-        # Operating System
-        os_matches = re.findall(r'\b(Android|iOS|Windows|macOS|Linux|Chrome OS)\s*(\d+\.?\d*)?\b', all_text, re.IGNORECASE)
-        specs['operating_system'] = [f"{match[0]} {match[1]}" if match[1] else match[0] for match in os_matches]
-        
-        # Year
-        year_matches = re.findall(r'\b(20[0-9]{2})\b', all_text)
-        specs['year'] = list(set(year_matches))
-        
-        # Special Features
-        feature_matches = re.findall(r'\b(Waterproof|Wireless|Fast Charging|Face ID|Touch ID|Fingerprint|Dual SIM|Triple Camera|Quad Camera|AI|Smart|Pro|Max|Ultra|Premium|Limited Edition)\b', all_text, re.IGNORECASE)
-        specs['special_features'] = list(set(feature_matches))
-        
-        # Country of Origin
-        country_matches = re.findall(r'\b(?:Made in|Manufactured in|Origin|Country of origin|Assembled in)\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\b', all_text, re.IGNORECASE)
-        specs['country_origin'] = list(set([match for match in country_matches]))
-        
-        return specs
+        for metric in BENCHMARK_METRICS
+    ])
+
+# ========================= MICRO BENCHMARKS =========================
+
+# Kept in the repository, next to the code it measures, so CI runs compare against it
+MICROBENCH_BASELINE = Path(__file__).parent / 'benchmarks' / 'micro_baseline.json'
+MICROBENCH_SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+def synthetic_descriptions(count: int, seed: int = 0) -> List[str]:
+    """Product descriptions with the mix of brands, models, specs and filler words seen in declarations"""
+    rng = random.Random(seed)
+    brands = ['Apple', 'Samsung', 'Xiaomi', 'Sony', 'LG', 'Lenovo', 'HP', 'Nike', 'Adidas', 'BMW', 'Toyota', 'Bosch', 'Philips', 'Artel', 'Coca Cola', '']
+    products = [
+        'smartphone', 'phone', 'laptop', 'tablet', 'headphones', 'TV', 'refrigerator', 'washing machine', 'air conditioner',
+        'sneakers', 'jacket', 'T-shirt', 'car', 'tires', 'brake pads', 'juice', 'chocolate', 'tea', 'coffee beans',
+        'vacuum cleaner', 'microwave oven', 'drill', 'monitor', 'printer', 'watch', 'bag', 'sofa', 'chair'
+    ]
+    models = ['iPhone {n} Pro', 'Galaxy S{n} Ultra', 'Redmi Note {n}', 'ThinkPad X{n}', 'WH-{n}000XM5', 'Air Max {n}0', 'X{n}', 'Model {n}', '']
+    specs = ['{n}GB', '{n}TB', '{n}.{m} inch', '{n}MP', '{n}000mAh', '{n} kg', '{n}{m}0 g', '{n}{m}x{m}0 cm', '{n}{m}0W', '{n}{m}0 ml', '5G', 'WiFi', 'Bluetooth']
+    colors = ['black', 'white', 'silver', 'blue', 'red', 'gold', 'grey', '']
+    materials = ['cotton', 'leather', 'plastic', 'steel', 'aluminum', 'glass', 'wood', '']
+    filler = ['new', 'original', 'for sale', 'dona', 'yangi', 'sifatli', 'komplekt', 'import', 'made in China', 'model', '2023', '2024']
     
-    def _track_improvements(self, original: str, enhanced: str) -> List[str]:
-        """Track what improvements were made"""
-        improvements = []
-        
-        if len(enhanced) > len(original) * 1.2:
-            improvements.append("Tavsif uzaytirildi")
-        
-        if any(brand in enhanced.lower() for brand in ['apple', 'samsung', 'bmw', 'mercedes', 'nike', 'adidas']):
-            improvements.append("Brend qo'shildi")
-        
-        if any(spec in enhanced.lower() for spec in ['gb', 'tb', 'inch', 'mp', 'mah']):
-            improvements.append("Texnik xususiyatlar qo'shildi")
+    descriptions = []
+    for _ in range(count):
+        n, m = rng.randint(1, 20), rng.randint(0, 9)
+        parts = [rng.choice(brands), rng.choice(products)]
+        if rng.random() < 0.6:
+            parts.append(rng.choice(models).format(n=n))
+        parts.extend(rng.choice(specs).format(n=n, m=m) for _ in range(rng.randint(0, 3)))
+        if rng.random() < 0.5:
+            parts.append(rng.choice(colors))
+        if rng.random() < 0.3:
+            parts.append(rng.choice(materials))
+        parts.extend(rng.sample(filler, rng.randint(0, 2)))
+        descriptions.append(' '.join(part for part in parts if part))
+    return descriptions
+
+def anonymized_descriptions(descriptions: List[str], count: int, min_rows: int = 5, seed: int = 0) -> List[str]:
+    """Resample real descriptions into a shareable corpus.
+    
+    Words used by fewer than `min_rows` descriptions (names, serials, shop
+    codes) are replaced with random words of the same shape; common
+    vocabulary is kept, so the corpus exercises the same dictionary and
+    pattern paths as the original.
+    """
+    rng = random.Random(seed)
+    tokenized = [str(description).split() for description in descriptions]
+    document_frequency = {}
+    for words in tokenized:
+        for word in set(words):
+            document_frequency[word] = document_frequency.get(word, 0) + 1
+    
+    def mask(word: str) -> str:
+        return ''.join(
+            str(rng.randint(0, 9)) if char.isdigit()
+            else rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') if char.isupper()
+            else rng.choice('abcdefghijklmnopqrstuvwxyz') if char.isalpha()
+            else char
+            for char in word
+        )
+    
+    return [
+        ' '.join(word if document_frequency[word] >= min_rows else mask(word) for word in rng.choice(tokenized))
+        for _ in range(count)
+    ]
+
+def synthetic_pages(count: int, seed: int = 0) -> List[bytes]:
+    """Product pages with title, meta description, spec table, feature list and filler text"""
+    rng = random.Random(seed)
+    descriptions = synthetic_descriptions(count * 4, seed)
+    pages = []
+    for index in range(count):
+        title, *others = descriptions[index * 4:index * 4 + 4]
+        rows = ''.join(f"<tr><td>{name}</td><td>{rng.choice(others)}</td></tr>" for name in ['Model', 'Memory', 'Display', 'Weight', 'Color', 'Material'])
+        features = ''.join(f"<li>{feature}</li>" for feature in others)
+        filler = ' '.join(rng.choice(descriptions) for _ in range(rng.randint(50, 400)))
+        pages.append(
+            f"<html><head><title>{title}</title><meta name=\"description\" content=\"{others[0]}\"></head>"
+            f"<body><h1>{title}</h1><table class=\"specifications\">{rows}</table><ul class=\"features\">{features}</ul>"
+            f"<p>{filler}</p><p>Made in China. Dimensions: 15 x 7 x 0.8 cm. Weight: 180 g. Android 14, 2024.</p></body></html>".encode('utf-8')
+        )
+    return pages
+
+def cassette_pages(cassette: Cassette) -> List[bytes]:
+    """Saved HTML pages of a cassette (successful responses only)"""
+    return [
+        response['body'] for response in cassette.load().values()
+        if response['status'] == 200 and 'html' in response['headers'].get('Content-Type', 'text/html')
+    ]
+
+def _measure_stage(function: Callable, items: List, memory_items: int, reset: Callable[[], None], repeats: int = 5) -> Dict:
+    """Throughput and per-call latency over all items, peak traced memory over the first `memory_items`.
+    
+    Timings are the median of `repeats` runs, each from a cold cache, so
+    one noisy run does not make or hide a regression.
+    """
+    runs = []
+    for _ in range(max(1, repeats)):
+        reset()
+        latencies = np.empty(len(items))
+        results = []
+        started = time.perf_counter()
+        for index, item in enumerate(items):
+            call_started = time.perf_counter()
+            results.append(function(item))
+            latencies[index] = time.perf_counter() - call_started
+        elapsed = time.perf_counter() - started
+        results = None
         
-        if any(color in enhanced.lower() for color in ['black', 'white', 'red', 'blue', 'silver', 'gold']):
-            improvements.append("Rang ma'lumoti qo'shildi")
+        latencies *= 1e6
+        runs.append({
+            'throughput': len(items) / elapsed if elapsed > 0 else 0.0,
+            'p50_us': float(np.percentile(latencies, 50)),
+            'p95_us': float(np.percentile(latencies, 95)),
+            'p99_us': float(np.percentile(latencies, 99))
+        })
+    
+    # Results are kept as the pipeline keeps them, so their size counts towards the peak
+    reset()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    kept = [function(item) for item in items[:memory_items]]
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    if not was_tracing:
+        tracemalloc.stop()
+    del kept
+    
+    return {
+        'items': len(items),
+        **{metric: float(np.median([run[metric] for run in runs])) for metric in runs[0]},
+        'repeats': len(runs),
+        'peak_memory_mb': peak / 1024 / 1024,
+        'memory_items': min(len(items), memory_items)
+    }
+
+def run_microbenchmarks(corpora: Dict[str, List[str]], pages: List[bytes], memory_items: int = 20000, repeats: int = 5) -> List[Dict]:
+    """Benchmark the analyzer, the category classifier, page parsing and the extractors.
+    
+    Each stage starts with a cold normalization cache. Description stages
+    run over every corpus; page parsing and the `_extract_*` methods run
+    over the saved pages, extracting from two pages per product as the
+    pipeline does.
+    """
+    enhancer = ProductDescriptionEnhancer()
+    scraper = CustomsReadyProductScraper(enhancer)
+    
+    def extract(collected_info: Dict) -> Tuple:
+        return (
+            scraper._extract_brand_model(collected_info),
+            scraper._extract_technical_details(collected_info),
+            scraper._extract_physical_attributes(collected_info),
+            scraper._extract_additional_specs(collected_info)
+        )
+    
+    stages = []
+    for corpus, descriptions in corpora.items():
+        stages.append(('analyze', corpus, enhancer.analyze_description_completeness, descriptions))
+        stages.append(('category', corpus, scraper._determine_product_category, descriptions))
+    
+    stages.append(('parse_page', 'pages', scraper._page_record, pages))
+    records = [record for record in (scraper._page_record(page) for page in pages) if record]
+    collected = [{'records': records[index:index + 2], 'sources': []} for index in range(0, len(records), 2)]
+    stages.append(('extract', 'pages', extract, collected))
+    
+    report = []
+    for stage, corpus, function, items in stages:
+        report.append({'stage': stage, 'corpus': corpus, **_measure_stage(function, items, memory_items, enhancer.normalizer.normalize.cache_clear, repeats)})
+    return report
+
+def check_microbench_regressions(report: List[Dict], baseline: Dict[str, Dict], threshold: float = 0.2) -> List[str]:
+    """Stages whose median throughput fell, or whose median p95 latency or peak memory grew, by more than `threshold`"""
+    regressions = []
+    for row in report:
+        previous = baseline.get(f"{row['stage']}@{row['corpus']}")
+        if not previous:
+            continue
+        if row['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append(f"{row['stage']}@{row['corpus']}: throughput {previous['throughput']:.0f} -> {row['throughput']:.0f}/s")
+        for metric in ('p95_us', 'peak_memory_mb'):
+            if previous[metric] > 0 and row[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f"{row['stage']}@{row['corpus']}: {metric} {previous[metric]:.1f} -> {row[metric]:.1f}")
+    return regressions
+
+def load_microbench_baseline(path: Path = MICROBENCH_BASELINE) -> Dict[str, Dict]:
+    return json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+
+def save_microbench_baseline(report: List[Dict], path: Path = MICROBENCH_BASELINE):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    baseline = {**load_microbench_baseline(path), **{f"{row['stage']}@{row['corpus']}": row for row in report}}
+    path.write_text(json.dumps(baseline, indent=2), encoding='utf-8')
+
+# ========================= INTERACTIVE FAST PATH =========================
+
+class InteractiveEnricher:
+    """Single-product answers for the Test tab: analysis and cached enrichment at once, live scraping in the background"""
+    
+    def __init__(self, engines: Optional[SharedEngines] = None, workers: int = 4, max_tracked: int = 256):
+        engines = engines or get_engines()
+        self.engines = engines
+        self.enhancer = engines.enhancer
+        self.scraper = engines.scraper
+        self.cache = engines.cache
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='interactive')
+        self.max_tracked = max_tracked
+        self.live = {}  # Cache key -> Future of the live enhancement
+        self._lock = threading.Lock()
+    
+    def start(self, description: str) -> Dict:
+        """Instant answer; live enrichment is started (or joined) when the description needs it"""
+        started = time.perf_counter()
+        analysis = self.enhancer.analyze_description_completeness(description)
+        cached = self.cache.get(description) if analysis['enhancement_needed'] else None
+        hs_suggestions = self.engines.hs_index.suggest(description) if self.engines.hs_index else []
         
-        if re.search(r'\b20[0-9]{2}\b', enhanced):
-            improvements.append("Yil ma'lumoti qo'shildi")
+        key = EnrichmentCache.key(description)
+        if analysis['enhancement_needed']:
+            with self._lock:
+                future = self.live.get(key)
+                if future is None or (future.done() and future.exception() is not None):
+                    self._prune()
+                    self.live[key] = self.executor.submit(self.scraper.enhance_product_description, description, analysis['missing_elements'])
         
-        return improvements
+        return {
+            'description': description,
+            'key': key,
+            'analysis': analysis,
+            'cached': cached,
+            'hs_suggestions': hs_suggestions,
+            'first_answer_ms': (time.perf_counter() - started) * 1000
+        }
     
-    def _calculate_confidence_score(self, collected_info: Dict) -> float:
-        """Calculate confidence score for the enhancement"""
-        score = 0
-        
-        # Base score for having sources
-        sources_count = len(collected_info.get('sources', []))
-        score += min(sources_count * 15, 60)
+    def _prune(self):
+        """Forget the oldest finished enhancements once too many are tracked"""
+        if len(self.live) < self.max_tracked:
+            return
+        for key in [key for key, future in self.live.items() if future.done()][:len(self.live) - self.max_tracked + 1]:
+            del self.live[key]
+    
+    def live_result(self, key: str) -> Optional[Dict]:
+        """{'status': running|done|failed, ...} of the live enrichment, None when none was started"""
+        with self._lock:
+            future = self.live.get(key)
+        if future is None:
+            return None
+        if not future.done():
+            return {'status': 'running'}
+        if future.exception() is not None:
+            return {'status': 'failed', 'error': str(future.exception())}
+        return {'status': 'done', 'result': future.result()}
+
+@st.cache_resource
+def get_interactive_enricher() -> InteractiveEnricher:
+    """One warm enricher per server process, shared by every session"""
+    return InteractiveEnricher()
+
+# ========================= MAIN APPLICATION =========================
+
+def session_owner() -> str:
+    """Owner recorded on the jobs of this session: the signed-in user, or the browser session"""
+    if st.user.get('is_logged_in') and st.user.get('email'):
+        return f"user:{st.user.get('email')}"
+    return f"session:{st.session_state.setdefault('session_owner', uuid.uuid4().hex)}"
+
+@st.fragment(run_every=2)
+def show_job_panel():
+    """Poll the job store and list this session's background batches"""
+    manager = get_job_manager()
+    jobs = manager.store.list(owner=session_owner())
+    if not jobs:
+        return
+    
+    st.markdown("### ⏳ Fon vazifalari")
+    
+    for job in jobs:
+        col1, col2 = st.columns([3, 1])
         
-        # Score for text content
-        text_length = len(' '.join(collected_info.get('raw_text', [])))
-        if text_length > 1000:
-            score += 20
-        elif text_length > 500:
-            score += 15
-        elif text_length > 200:
-            score += 10
+        with col1:
+            if job['status'] == 'done':
+                progress = 1.0
+            else:
+                progress = job['processed'] / job['total'] if job['total'] else 0
+            st.progress(min(progress, 1.0), text=f"{job['file_name']} ({job['job_id']}) - {job['status']} {job['processed']}/{job['total']}")
+            if job['error']:
+                st.error(job['error'])
+            
+            if job['status'] in ('done', 'cancelled'):
+                for report_path in manager.store.profile_reports(job['job_id']):
+                    st.download_button(f"🔬 {report_path.name}", report_path.read_bytes(), file_name=f"{job['job_id']}_{report_path.name}", key=f"profile_{job['job_id']}_{report_path.name}")
         
-        # Score for structured data
-        structured_data = collected_info.get('structured_data', {})
-        if structured_data:
-            score += 20
+        with col2:
+            if job['status'] in ('done', 'cancelled') and st.button("📂 Natijalarni ochish", key=f"open_{job['job_id']}"):
+                st.session_state.results = compact_results(manager.store.load_results(job['job_id']))
+                st.rerun()
+            
+            if job['status'] in ('queued', 'running') and st.button("⏹️ Bekor qilish", key=f"cancel_{job['job_id']}"):
+                manager.cancel(job['job_id'])
+                st.rerun(scope="fragment")
+            
+            if job['status'] in ('running', 'cancelling') and st.button("📂 Joriy natijalar", key=f"partial_{job['job_id']}"):
+                partial_df = manager.store.load_results(job['job_id'])
+                if partial_df is not None:
+                    st.session_state.results = compact_results(partial_df)
+                    st.rerun()
+    
+    # Stream the rows of this session's latest running job as they complete
+    active = [job for job in jobs if job['status'] in ('running', 'cancelling')]
+    if active:
+        partial_df = manager.store.load_results(active[0]['job_id'])
+        if partial_df is not None:
+            st.markdown(f"#### 📡 Jonli natijalar ({active[0]['job_id']})")
+            st.dataframe(partial_df, use_container_width=True)
+
+def show_metrics_panel():
+    """Process-wide stage and cache metrics of every batch run so far"""
+    with st.expander("📈 Metrikalar"):
+        stage_rows = PIPELINE_METRICS.stage_rows()
+        if stage_rows:
+            st.dataframe(pd.DataFrame(stage_rows).round(1), hide_index=True, use_container_width=True)
+        else:
+            st.caption("Hali batch ishga tushirilmagan")
+        cache_rows = PIPELINE_METRICS.cache_rows()
+        if cache_rows:
+            st.dataframe(pd.DataFrame(cache_rows).round(3), hide_index=True, use_container_width=True)
         
-        return min(score, 100)
+        metrics_port = os.environ.get('CUSTOMS_METRICS_PORT')
+        if metrics_port:
+            st.caption(f"Prometheus: http://<host>:{metrics_port}/metrics")
+        st.download_button("📥 Prometheus formatida", PIPELINE_METRICS.render_prometheus(), file_name='metrics.prom', mime='text/plain')
 
-# ========================= MAIN FUNCTIONS =========================
+def show_analysis(analysis: Dict):
+    """Completeness metrics, found/missing elements and recommendations of one description"""
+    st.markdown("#### 📊 Dastlabki tahlil")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric("To'liqlik darajasi", f"{analysis['completeness_score']:.1f}%")
+    
+    with col2:
+        st.metric("Bojxona tayyorligi", analysis['customs_readiness'])
+    
+    with col3:
+        st.metric("Takomillashtirish kerakmi", "Ha" if analysis['enhancement_needed'] else "Yo'q")
+    
+    # Show found and missing elements
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("**✅ Topilgan elementlar:**")
+        if analysis['found_elements']:
+            for element, items in analysis['found_elements'].items():
+                st.markdown(f"• {element}: {', '.join(str(item) for item in items[:3])}")
+        else:
+            st.markdown("• Hech narsa topilmadi")
+    
+    with col2:
+        st.markdown("**❌ Yetishmayotgan elementlar:**")
+        if analysis['missing_elements']:
+            for element in analysis['missing_elements']:
+                st.markdown(f"• {element}")
+        else:
+            st.markdown("• Hamma narsa mavjud")
+    
+    # Show recommendations
+    if analysis['recommendations']:
+        st.markdown("**💡 Tavsiyalar:**")
+        for rec in analysis['recommendations']:
+            st.markdown(f"• {rec}")
 
-def validate_uploaded_file(df: pd.DataFrame) -> Tuple[bool, str]:
-    """Validate uploaded file structure"""
-    required_columns = ['ID', 'Tovar_nomi']
+def show_hs_suggestions(suggestions: List[Dict], title: str):
+    """Top HS nomenclature matches of one description"""
+    if not suggestions:
+        return
+    st.markdown(f"**🏷️ {title}:**")
+    st.dataframe(
+        pd.DataFrame(suggestions).rename(columns={'code': 'Kod', 'heading': 'Pozitsiya', 'description': 'Tavsif', 'score': 'Ball'}),
+        hide_index=True, use_container_width=True
+    )
+
+def show_enhancement(description: str, original_analysis: Dict, enhancement_result: Dict, enhancer: ProductDescriptionEnhancer):
+    """Before/after comparison of one enhancement result"""
+    if enhancement_result['enhanced_description'] == description:
+        st.warning("⚠️ Qo'shimcha ma'lumot topilmadi")
+        return
     
-    if not all(col in df.columns for col in required_columns):
-        return False, "Faylda 'ID' va 'Tovar_nomi' ustunlari mavjud emas"
+    st.success("✅ Takomillashtirish muvaffaqiyatli!")
     
-    if df.empty:
-        return False, "Fayl bo'sh"
+    # Show before and after
+    st.markdown("**📝 Tavsif taqqoslash:**")
     
-    if df['ID'].duplicated().any():
-        return False, "ID ustunida takrorlanuvchi qiymatlar mavjud"
+    col1, col2 = st.columns(2)
     
-    empty_descriptions = df['Tovar_nomi'].isna().sum()
-    if empty_descriptions > 0:
-        return False, f"{empty_descriptions} ta bo'sh tovar tavsifi mavjud"
+    with col1:
+        st.markdown("**Asl tavsif:**")
+        st.info(description)
     
-    return True, "Fayl tuzilishi to'g'ri"
+    with col2:
+        st.markdown("**Takomillashtirilgan tavsif:**")
+        st.success(enhancement_result['enhanced_description'])
+    
+    # Show improvements
+    if enhancement_result['improvements_made']:
+        st.markdown("**🔄 Qilingan yaxshilanishlar:**")
+        for improvement in enhancement_result['improvements_made']:
+            st.markdown(f"• {improvement}")
+    
+    # Show technical details
+    if enhancement_result['technical_details']:
+        st.markdown("**⚙️ Topilgan texnik xususiyatlar:**")
+        for category, details in enhancement_result['technical_details'].items():
+            if details:
+                st.markdown(f"• {category}: {', '.join(details[:3])}")
+    
+    # Show sources
+    if enhancement_result['sources_used']:
+        st.markdown("**📚 Foydalanilgan manbalar:**")
+        for source in enhancement_result['sources_used'][:3]:
+            st.markdown(f'<div class="source-card">🔗 {source}</div>', unsafe_allow_html=True)
+    
+    # Re-analyze enhanced description
+    enhanced_analysis = enhancer.analyze_description_completeness(enhancement_result['enhanced_description'])
+    
+    st.markdown("#### 📈 Yakuniy natija")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        improvement = enhanced_analysis['completeness_score'] - original_analysis['completeness_score']
+        st.metric("To'liqlik yaxshilanishi", f"+{improvement:.1f}%")
+    
+    with col2:
+        st.metric("Yangi bojxona tayyorligi", enhanced_analysis['customs_readiness'])
+    
+    with col3:
+        st.metric("Scraping ishonch darajasi", f"{enhancement_result['confidence_score']:.1f}%")
+    
+    hs_index = get_engines().hs_index
+    if hs_index is not None:
+        show_hs_suggestions(hs_index.suggest(enhancement_result['enhanced_description']), "Takomillashtirilgan tavsif bo'yicha HS kodlar")
 
-def process_products_for_customs(df: pd.DataFrame, enhancer: ProductDescriptionEnhancer, scraper: CustomsReadyProductScraper) -> pd.DataFrame:
-    """Process products to make them customs-ready"""
+@st.fragment(run_every=1)
+def show_live_enrichment(key: str):
+    """Wait for the live enrichment, then rerun the page to show it"""
+    live = get_interactive_enricher().live_result(key)
+    if live is None or live['status'] != 'running':
+        st.rerun()
+    st.info("🔄 Google'dan qo'shimcha ma'lumot olinmoqda...")
+
+def show_test_result(request: Dict):
+    """Instant analysis and cached enrichment, replaced by the live result when it arrives"""
+    enricher = get_interactive_enricher()
+    analysis = request['analysis']
     
-    results = []
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    st.caption(f"⚡ Birinchi javob: {request['first_answer_ms']:.1f} ms")
+    show_analysis(analysis)
+    show_hs_suggestions(request.get('hs_suggestions', []), "HS kod takliflari")
     
-    total_products = len(df)
+    if not analysis['enhancement_needed']:
+        st.success("🎉 Tavsif allaqachon bojxona uchun tayyor!")
+        return
     
-    for idx, row in df.iterrows():
-        # Update progress
-        progress = (idx + 1) / total_products
-        progress_bar.progress(progress)
-        status_text.text(f"Tahlil qilinmoqda: {idx + 1}/{total_products} - {row['Tovar_nomi']}")
-        
-        # Analyze original description
-        analysis = enhancer.analyze_description_completeness(row['Tovar_nomi'])
-        
-        # Create result row
-        result_row = {
-            'ID': row['ID'],
-            'Asl_tavsif': row['Tovar_nomi'],
-            'Dastlabki_toliqlik': f"{analysis['completeness_score']:.1f}%",
-            'Bojxona_tayyorligi': analysis['customs_readiness'],
-            'Topilgan_elementlar': ', '.join(analysis['found_elements'].keys()),
-            'Yetishmayotgan_elementlar': ', '.join(analysis['missing_elements']),
-            'Toldirilgan_tavsif': row['Tovar_nomi'],
-            'Qoshimcha_malumotlar': '',
-            'Yakuniy_toliqlik': f"{analysis['completeness_score']:.1f}%",
-            'Yakuniy_tayyorlik': analysis['customs_readiness'],
-            'Scraping_manbalar': 0,
-            'Ishonch_darajasi': '0%',
-            'Tavsiyalar': '; '.join(analysis['recommendations'][:3])
-        }
-        
-        # If enhancement needed, use scraper
-        if analysis['enhancement_needed']:
-            try:
-                enhancement_result = scraper.enhance_product_description(row['Tovar_nomi'], analysis['missing_elements'])
-                
-                # Update with enhanced information
-                result_row['Toldirilgan_tavsif'] = enhancement_result['enhanced_description']
-                result_row['Qoshimcha_malumotlar'] = '; '.join(enhancement_result['improvements_made'])
-                result_row['Scraping_manbalar'] = len(enhancement_result['sources_used'])
-                result_row['Ishonch_darajasi'] = f"{enhancement_result['confidence_score']:.1f}%"
-                
-                # Re-analyze enhanced description
-                enhanced_analysis = enhancer.analyze_description_completeness(enhancement_result['enhanced_description'])
-                result_row['Yakuniy_toliqlik'] = f"{enhanced_analysis['completeness_score']:.1f}%"
-                result_row['Yakuniy_tayyorlik'] = enhanced_analysis['customs_readiness']
-                
-                # Add technical details if found
-                if enhancement_result['technical_details']:
-                    tech_summary = []
-                    for key, values in enhancement_result['technical_details'].items():
-                        if values:
-                            tech_summary.append(f"{key}: {', '.join(values[:2])}")
-                    
-                    if tech_summary:
-                        result_row['Qoshimcha_malumotlar'] += f" | Texnik: {'; '.join(tech_summary[:3])}"
-                
-            except Exception as e:
-                result_row['Qoshimcha_malumotlar'] = f"Scraping xatoligi: {str(e)}"
-        
-        results.append(result_row)
-        
-        # Rate limiting
-        time.sleep(0.5)
+    st.markdown("#### 🔍 Takomillashtirish (Web Scraping)")
+    live = enricher.live_result(request['key'])
     
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
+    if live and live['status'] == 'done':
+        show_enhancement(request['description'], analysis, live['result'], enricher.enhancer)
+        return
+    
+    if live and live['status'] == 'failed':
+        st.error(f"Jonli qidiruv xatosi: {live['error']}")
+    
+    if live and live['status'] == 'running':
+        show_live_enrichment(request['key'])
     
-    return pd.DataFrame(results)
+    if request['cached']:
+        st.caption("💾 Keshdagi natija - jonli qidiruv tugagach yangilanadi")
+        show_enhancement(request['description'], analysis, request['cached'], enricher.enhancer)
+    elif not live or live['status'] != 'running':
+        st.warning("⚠️ Qo'shimcha ma'lumot topilmadi")
 
-# ========================= MAIN APPLICATION =========================
+def configure_page():
+    """Page config and styles; kept out of module import so worker processes can import the app"""
+    # Sahifa konfiguratsiyasi
+    st.set_page_config(
+        page_title="Tovar tavsifi to'ldirish - Bojxona uchun",
+        page_icon="📝",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    
+    # CSS stillar
+    st.markdown("""
+    <style>
+        .main-header {
+            text-align: center;
+            color: #1f4e79;
+            font-size: 2.5rem;
+            margin-bottom: 1rem;
+        }
+        .sub-header {
+            text-align: center;
+            color: #666;
+            font-size: 1.2rem;
+            margin-bottom: 2rem;
+        }
+        .highlight-box {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 1.5rem;
+            border-radius: 10px;
+            margin: 1rem 0;
+        }
+        .completeness-high {
+            background: linear-gradient(135deg, #4CAF50 0%, #45a049 100%);
+            color: white;
+            padding: 1rem;
+            border-radius: 8px;
+            margin: 0.5rem 0;
+            font-weight: bold;
+        }
+        .completeness-medium {
+            background: linear-gradient(135deg, #ff9800 0%, #f57c00 100%);
+            color: white;
+            padding: 1rem;
+            border-radius: 8px;
+            margin: 0.5rem 0;
+            font-weight: bold;
+        }
+        .completeness-low {
+            background: linear-gradient(135deg, #f44336 0%, #d32f2f 100%);
+            color: white;
+            padding: 1rem;
+            border-radius: 8px;
+            margin: 0.5rem 0;
+            font-weight: bold;
+        }
+        .metric-card {
+            background: white;
+            padding: 1.5rem;
+            border-radius: 10px;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+            text-align: center;
+        }
+        .metric-value {
+            font-size: 2rem;
+            font-weight: bold;
+            color: #2e7bcf;
+        }
+        .analysis-card {
+            background: #f8f9fa;
+            padding: 1rem;
+            border-radius: 8px;
+            border-left: 4px solid #007bff;
+            margin: 0.5rem 0;
+        }
+        .enhancement-card {
+            background: linear-gradient(135deg, #e3f2fd 0%, #bbdefb 100%);
+            color: #1565c0;
+            padding: 1rem;
+            border-radius: 8px;
+            margin: 0.5rem 0;
+            font-weight: bold;
+        }
+        .source-card {
+            background: #fff3e0;
+            color: #e65100;
+            padding: 0.8rem;
+            border-radius: 6px;
+            margin: 0.3rem 0;
+            font-size: 0.9rem;
+        }
+    </style>
+    """, unsafe_allow_html=True)
 
 def main():
+    configure_page()
+    if os.environ.get('CUSTOMS_METRICS_PORT'):
+        start_metrics_server(int(os.environ['CUSTOMS_METRICS_PORT']))
+    
     # Header
     st.markdown('<h1 class="main-header">📝 BOJXONA UCHUN TOVAR TAVSIFI TO\'LDIRISH</h1>', unsafe_allow_html=True)
     st.markdown('<p class="sub-header">Tovar tavsiflarini bojxona xodimlari HS kodini oson aniqlay oladigan darajada to\'ldirish</p>', unsafe_allow_html=True)
@@ -979,6 +5010,27 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
         st.markdown("### 🎯 To'liqlik darajasi")
         completeness_threshold = st.slider("Minimal to'liqlik (%)", 60, 90, 75)
         
+        st.markdown("### ⏱️ Byudjet")
+        time_limit_minutes = st.number_input("Vaqt chegarasi (daqiqa, 0 = cheksiz)", min_value=0, value=0, step=5)
+        max_requests = st.number_input("Jami so'rovlar chegarasi (0 = cheksiz)", min_value=0, value=0, step=100)
+        per_product_requests = st.number_input("Bitta tovar uchun so'rovlar (0 = cheksiz)", min_value=0, value=0, step=1)
+        
+        with st.expander("🏭 Bosqichlar parallelligi"):
+            execution_mode = st.radio(
+                "Bajarish rejimi",
+                ['threads', 'hybrid'],
+                format_func=lambda mode: "Oqimlar (threads)" if mode == 'threads' else "Async I/O + jarayonlar (hybrid)",
+                help="hybrid: tarmoq so'rovlari event loop'da, HTML tahlili alohida jarayonlarda (parse = jarayonlar soni)"
+            )
+            stage_concurrency = {
+                stage: st.number_input(f"{stage}", min_value=1, max_value=32, value=workers, key=f"concurrency_{stage}")
+                for stage, workers in DEFAULT_STAGE_CONCURRENCY.items()
+            }
+        
+        st.markdown("### 💾 Checkpoint")
+        enable_checkpoint = st.checkbox("Uzilgan tahlilni davom ettirish", value=True, help="Tugallangan tovarlar diskka yoziladi va qayta ishga tushirilganda o'tkazib yuboriladi")
+        enable_dedupe = st.checkbox("O'xshash tovarlarni bir marta qidirish", value=True, help="Deyarli bir xil tavsiflar bitta oila sifatida bir marta scraping qilinadi, natija har bir a'zoning o'z xususiyatlariga moslanadi")
+        
         st.markdown("### 📊 Bojxona tayyorligi")
         st.info("""
         **HIGH (80%+):** Bojxona tayyor  
@@ -999,6 +5051,62 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
         for element in required_elements:
             st.markdown(f"• {element}")
         
+        with st.expander("🛠️ Admin: umumiy dvigatellar"):
+            engines = get_engines()
+            st.caption("Jarayon bo'yicha bir marta quriladi va barcha sessiyalar uchun umumiy")
+            st.dataframe(engines.report(), hide_index=True, use_container_width=True)
+            peak_memory = process_peak_memory_mb()
+            if peak_memory is not None:
+                st.metric("Jarayon xotirasi (eng yuqori)", f"{peak_memory:.0f} MB")
+            
+            profile_mode = st.selectbox(
+                "🔬 Batchni profilyorlash",
+                ['off', *PROFILE_MODES],
+                format_func={'off': "O'chiq", 'deterministic': "cProfile (aniq, sekinroq)", 'sampling': "Namuna olish (yengil)"}.get,
+                help="Keyingi batch profilyor va tracemalloc ostida ishlaydi; hisobotlar vazifa natijalari yonida saqlanadi"
+            )
+            
+            page_matcher = engines.scraper.page_matcher
+            st.caption(f"🧩 Regex dvigateli: {page_matcher.backend} (skan: {page_matcher.scan_timeout * 1000:.0f} ms, sahifa: {page_matcher.page_budget * 1000:.0f} ms)")
+            if page_matcher.timeouts:
+                st.warning("⏱️ Vaqti tugagan patternlar: " + ', '.join(f"{name} ({count})" for name, count in page_matcher.timeouts.items()))
+            
+            yield_report = engines.scraper.source_yield.report()
+            if len(yield_report):
+                st.caption(f"🎯 Manba domenlari foydaliligi (o'tkazib yuborilgan havolalar: {engines.scraper.source_yield.skipped})")
+                st.dataframe(yield_report.round(2), hide_index=True, use_container_width=True)
+            
+            host_report = engines.scraper.host_latency.report()
+            if len(host_report):
+                st.caption("🌐 Eng sekin va sovutilayotgan hostlar (adaptiv timeout, hedging)")
+                st.dataframe(host_report.round(1), hide_index=True, use_container_width=True)
+            
+            if engines.hs_index is not None:
+                st.success(f"🏷️ HS nomenklatura: {len(engines.hs_index.codes)} ta pozitsiya")
+            else:
+                st.warning(f"🏷️ HS nomenklatura topilmadi: {HS_NOMENCLATURE_PATH}")
+            nomenclature_file = st.file_uploader("HS nomenklatura fayli (kod, tavsif)", type=PRODUCT_FILE_TYPES, key='hs_nomenclature')
+            if nomenclature_file is not None and st.button("📥 Nomenklaturani yuklash"):
+                HS_NOMENCLATURE_PATH.parent.mkdir(parents=True, exist_ok=True)
+                nomenclature = read_products_file(nomenclature_file, nomenclature_file.name)
+                nomenclature.to_csv(HS_NOMENCLATURE_PATH, index=False)
+                engines.load_hs_index()
+                st.rerun()
+            
+            if engines.catalog is not None:
+                st.success(f"📦 Mahsulot katalogi: {engines.catalog.entries} ta yozuv (GTIN: {len(engines.catalog.gtin_keys)}, model: {len(engines.catalog.model_keys)})")
+            else:
+                st.warning(f"📦 Mahsulot katalogi topilmadi: {PRODUCT_CATALOG_PATH}")
+            catalog_file = st.file_uploader("Mahsulot katalogi (gtin, model, brand, name, category, xususiyatlar)", type=PRODUCT_FILE_TYPES, key='product_catalog')
+            if catalog_file is not None and st.button("📥 Katalogni yuklash"):
+                PRODUCT_CATALOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+                catalog = read_products_file(catalog_file, catalog_file.name)
+                catalog.to_csv(PRODUCT_CATALOG_PATH, index=False)
+                engines.load_catalog()
+                st.rerun()
+        
+        show_metrics_panel()
+        
         # NLP Information
         st.markdown("### 🧠 NLP haqida")
         st.info("""
@@ -1021,22 +5129,19 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
     tab1, tab2, tab3, tab4 = st.tabs(["📁 Fayl yuklash", "📊 Tahlil natijalari", "🎯 Bojxona tayyorligi", "🧪 Test"])
     
     with tab1:
-        st.markdown("### 📁 Excel/CSV fayl yuklash")
+        st.markdown("### 📁 Excel/CSV/Parquet fayl yuklash")
         
         # File uploader
         uploaded_file = st.file_uploader(
             "Faylni yuklang (ID va Tovar_nomi ustunlari bilan)",
-            type=['xlsx', 'xls', 'csv'],
-            help="Fayl namunasi: ID | Tovar_nomi"
+            type=PRODUCT_FILE_TYPES,
+            help="Fayl namunasi: ID | Tovar_nomi. Katta fayllar uchun Parquet, Arrow yoki siqilgan CSV (.csv.gz, .csv.zst)"
         )
         
         if uploaded_file:
             try:
-                # Read file
-                if uploaded_file.name.endswith('.csv'):
-                    df = pd.read_csv(uploaded_file)
-                else:
-                    df = pd.read_excel(uploaded_file)
+                # Read file; only the two columns the analysis uses
+                df = read_products_file(uploaded_file, uploaded_file.name, columns=['ID', 'Tovar_nomi'])
                 
                 # Validate file
                 is_valid, validation_message = validate_uploaded_file(df)
@@ -1060,7 +5165,7 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
                     
                     with col4:
                         # Quick completeness check
-                        enhancer = ProductDescriptionEnhancer()
+                        enhancer = get_engines().enhancer
                         quick_analysis = [enhancer.analyze_description_completeness(desc) for desc in df['Tovar_nomi'].head(10)]
                         avg_completeness = sum(a['completeness_score'] for a in quick_analysis) / len(quick_analysis)
                         st.markdown(f'<div class="metric-card"><div class="metric-value">{avg_completeness:.1f}%</div><div class="metric-label">O\'rtacha to\'liqlik</div></div>', unsafe_allow_html=True)
@@ -1097,22 +5202,32 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
                     with col2:
                         if st.button("🔍 Boshlash", type="primary"):
                             if enable_analysis:
-                                # Initialize components
-                                enhancer = ProductDescriptionEnhancer()
-                                scraper = CustomsReadyProductScraper()
+                                file_hash = BatchCheckpoint.hash_file(uploaded_file.getvalue())
+                                
+                                if enable_checkpoint:
+                                    restored = len(BatchCheckpoint(file_hash).load())
+                                    if restored:
+                                        st.info(f"💾 {restored} ta tovar avvalgi ishga tushirishdan tiklandi")
                                 
-                                # Process products
-                                with st.spinner("Tovarlar tahlil qilinmoqda va to'ldirilmoqda..."):
-                                    results_df = process_products_for_customs(df, enhancer, scraper)
-                                    
-                                    # Save to session state
-                                    st.session_state.results = results_df
-                                    st.session_state.original_df = df
+                                # Queue the batch on the background worker pool
+                                settings = {
+                                    'time_limit': time_limit_minutes * 60,
+                                    'max_requests': max_requests,
+                                    'per_product_requests': per_product_requests,
+                                    'checkpoint': enable_checkpoint,
+                                    'stage_concurrency': stage_concurrency,
+                                    'execution_mode': execution_mode,
+                                    'dedupe': enable_dedupe,
+                                    'profile': None if profile_mode == 'off' else profile_mode
+                                }
+                                job_id = get_job_manager().submit(df, uploaded_file.name, file_hash, settings, session_owner())
+                                st.session_state.original_job = job_id  # The original frame stays in the job store
                                 
-                                st.success("✅ Tahlil va to'ldirish tugallandi!")
-                                st.balloons()
+                                st.success(f"✅ Vazifa navbatga qo'shildi: {job_id}")
                             else:
                                 st.error("NLP tahlil sozlamalarda yoqilmagan")
+                    
+                    show_job_panel()
                 
                 else:
                     st.error(f"❌ {validation_message}")
@@ -1197,8 +5312,8 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
             st.markdown("### 📈 Takomillashtirish tahlili")
             
             # Parse completeness scores
-            initial_scores = results_df['Dastlabki_toliqlik'].str.replace('%', '').astype(float)
-            final_scores = results_df['Yakuniy_toliqlik'].str.replace('%', '').astype(float)
+            initial_scores = percent_values(results_df['Dastlabki_toliqlik'])
+            final_scores = percent_values(results_df['Yakuniy_toliqlik'])
             
             improved_count = len(final_scores[final_scores > initial_scores])
             avg_improvement = (final_scores - initial_scores).mean()
@@ -1215,6 +5330,20 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
             st.markdown("### 📋 Batafsil natijalar")
             st.dataframe(results_df, use_container_width=True)
             
+            families = results_df.attrs.get('families')
+            if families and families['shared']:
+                st.caption(f"🧬 {families['rows']} ta tovar {families['families']} ta oilaga guruhlandi; {families['shared']} tasi oila vakilining scraping natijasidan foydalandi")
+            
+            # Pipeline stage throughput
+            if results_df.attrs.get('stage_stats'):
+                with st.expander("🏭 Bosqichlar o'tkazuvchanligi"):
+                    stats_df = pd.DataFrame(results_df.attrs['stage_stats'])
+                    st.dataframe(stats_df, use_container_width=True)
+                    slowest = stats_df.loc[stats_df['capacity'].replace(0, float('inf')).idxmin(), 'stage']
+                    st.caption(f"Eng sekin bosqich: {slowest}")
+                    if results_df.attrs.get('cache_stats'):
+                        st.dataframe(pd.DataFrame(results_df.attrs['cache_stats']), use_container_width=True)
+            
         else:
             st.info("📤 Hozircha tahlil natijalari yo'q. Avval fayl yuklang va tahlil qiling.")
     
@@ -1223,11 +5352,28 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
         
         if 'results' in st.session_state:
             results_df = st.session_state.results
+            initial_scores = percent_values(results_df['Dastlabki_toliqlik'])
+            final_scores = percent_values(results_df['Yakuniy_toliqlik'])
             
             # Export functionality
             st.markdown("### 📥 Natijalarni eksport qilish")
             
             col1, col2, col3 = st.columns([1, 1, 1])
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            
+            # Columnar and compressed formats for large batches and automated pipelines
+            if EXPORT_FORMATS:
+                with col1:
+                    export_format = st.selectbox("Format", list(EXPORT_FORMATS), format_func=lambda name: EXPORT_FORMATS[name][0], key='export_format')
+                    _, extension, mime = EXPORT_FORMATS[export_format]
+                    export_output = io.BytesIO()
+                    write_results_file(results_df, export_output, f"natijalar.{extension}")
+                    st.download_button("📦 Natijalar", export_output.getvalue(), file_name=f"bojxona_natijalari_{timestamp}.{extension}", mime=mime)
+                
+                with col3:
+                    summary_output = io.BytesIO()
+                    write_results_file(results_summary(results_df).astype({'Qiymat': str}), summary_output, f"xulosa.{extension}")
+                    st.download_button("📦 Xulosa", summary_output.getvalue(), file_name=f"bojxona_xulosa_{timestamp}.{extension}", mime=mime)
             
             with col2:
                 # Create comprehensive Excel report
@@ -1237,30 +5383,7 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
                     results_df.to_excel(writer, index=False, sheet_name='Asosiy_natijalar')
                     
                     # Summary statistics
-                    summary_data = {
-                        'Metrika': [
-                            'Jami tovarlar',
-                            'Yuqori tayyorlik (HIGH)',
-                            'O\'rta tayyorlik (MEDIUM)',
-                            'Past tayyorlik (LOW)',
-                            'Takomillashtirilgan tovarlar',
-                            'O\'rtacha dastlabki to\'liqlik',
-                            'O\'rtacha yakuniy to\'liqlik',
-                            'O\'rtacha yaxshilanish'
-                        ],
-                        'Qiymat': [
-                            len(results_df),
-                            len(results_df[results_df['Yakuniy_tayyorlik'] == 'HIGH']),
-                            len(results_df[results_df['Yakuniy_tayyorlik'] == 'MEDIUM']),
-                            len(results_df[results_df['Yakuniy_tayyorlik'] == 'LOW']),
-                            len(results_df[results_df['Yakuniy_toliqlik'].str.replace('%', '').astype(float) > results_df['Dastlabki_toliqlik'].str.replace('%', '').astype(float)]),
-                            f"{results_df['Dastlabki_toliqlik'].str.replace('%', '').astype(float).mean():.1f}%",
-                            f"{results_df['Yakuniy_toliqlik'].str.replace('%', '').astype(float).mean():.1f}%",
-                            f"{(results_df['Yakuniy_toliqlik'].str.replace('%', '').astype(float) - results_df['Dastlabki_toliqlik'].str.replace('%', '').astype(float)).mean():.1f}%"
-                        ]
-                    }
-                    
-                    summary_df = pd.DataFrame(summary_data)
+                    summary_df = results_summary(results_df)
                     summary_df.to_excel(writer, index=False, sheet_name='Xulosa')
                     
                     # High readiness products (ready for customs)
@@ -1270,10 +5393,14 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
                     # Products needing more work
                     needs_work_df = results_df[results_df['Yakuniy_tayyorlik'] == 'LOW']
                     needs_work_df.to_excel(writer, index=False, sheet_name='Qoshimcha_ish_kerak')
+                    
+                    # Stage and cache metrics of the run that produced these results
+                    if results_df.attrs.get('stage_stats'):
+                        metrics_df = pd.concat([pd.DataFrame(results_df.attrs['stage_stats']), pd.DataFrame(results_df.attrs.get('cache_stats', []))], ignore_index=True)
+                        metrics_df.to_excel(writer, index=False, sheet_name='Metrikalar')
                 
                 output.seek(0)
                 
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"bojxona_tayyorligi_{timestamp}.xlsx"
                 
                 st.download_button(
@@ -1287,10 +5414,10 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
             # Top improved products
             st.markdown("### 🏆 Eng ko'p takomillashtirilgan tovarlar")
             
-            # Calculate improvement for each product
-            results_df['Yaxshilanish'] = results_df['Yakuniy_toliqlik'].str.replace('%', '').astype(float) - results_df['Dastlabki_toliqlik'].str.replace('%', '').astype(float)
-            
-            top_improved = results_df.nlargest(10, 'Yaxshilanish')[['ID', 'Asl_tavsif', 'Toldirilgan_tavsif', 'Yaxshilanish', 'Yakuniy_tayyorlik']]
+            # Improvement is derived on demand; the stored results are never modified
+            improvement = final_scores - initial_scores
+            top_rows = improvement.nlargest(10).index
+            top_improved = results_df.loc[top_rows, ['ID', 'Asl_tavsif', 'Toldirilgan_tavsif']].assign(Yaxshilanish=improvement[top_rows], Yakuniy_tayyorlik=results_df.loc[top_rows, 'Yakuniy_tayyorlik'])
             
             if len(top_improved) > 0:
                 st.dataframe(top_improved, use_container_width=True)
@@ -1301,8 +5428,8 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
             if st.button("🗑️ Barcha natijalarni tozalash"):
                 if 'results' in st.session_state:
                     del st.session_state.results
-                if 'original_df' in st.session_state:
-                    del st.session_state.original_df
+                if 'original_job' in st.session_state:
+                    del st.session_state.original_job
                 st.rerun()
                 
         else:
@@ -1324,121 +5451,13 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
         with col2:
             if st.button("🔍 Tahlil qilish", type="primary"):
                 if test_product:
-                    # Initialize enhancer
-                    enhancer = ProductDescriptionEnhancer()
-                    scraper = CustomsReadyProductScraper()
-                    
-                    # Analyze original
-                    with st.spinner("Dastlabki tahlil..."):
-                        original_analysis = enhancer.analyze_description_completeness(test_product)
-                    
-                    # Display original analysis
-                    st.markdown("#### 📊 Dastlabki tahlil")
-                    
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        st.metric("To'liqlik darajasi", f"{original_analysis['completeness_score']:.1f}%")
-                    
-                    with col2:
-                        st.metric("Bojxona tayyorligi", original_analysis['customs_readiness'])
-                    
-                    with col3:
-                        st.metric("Takomillashtirish kerakmi", "Ha" if original_analysis['enhancement_needed'] else "Yo'q")
-                    
-                    # Show found and missing elements
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("**✅ Topilgan elementlar:**")
-                        if original_analysis['found_elements']:
-                            for element, items in original_analysis['found_elements'].items():
-                                st.markdown(f"• {element}: {', '.join(str(item) for item in items[:3])}")
-                        else:
-                            st.markdown("• Hech narsa topilmadi")
-                    
-                    with col2:
-                        st.markdown("**❌ Yetishmayotgan elementlar:**")
-                        if original_analysis['missing_elements']:
-                            for element in original_analysis['missing_elements']:
-                                st.markdown(f"• {element}")
-                        else:
-                            st.markdown("• Hamma narsa mavjud")
-                    
-                    # Show recommendations
-                    if original_analysis['recommendations']:
-                        st.markdown("**💡 Tavsiyalar:**")
-                        for rec in original_analysis['recommendations']:
-                            st.markdown(f"• {rec}")
-                    
-                    # If enhancement needed, perform scraping
-                    if original_analysis['enhancement_needed']:
-                        st.markdown("#### 🔍 Takomillashtirish (Web Scraping)")
-                        
-                        with st.spinner("Google'dan qo'shimcha ma'lumot olinmoqda..."):
-                            enhancement_result = scraper.enhance_product_description(test_product, original_analysis['missing_elements'])
-                        
-                        if enhancement_result['enhanced_description'] != test_product:
-                            st.success("✅ Takomillashtirish muvaffaqiyatli!")
-                            
-                            # Show before and after
-                            st.markdown("**📝 Tavsif taqqoslash:**")
-                            
-                            col1, col2 = st.columns(2)
-                            
-                            with col1:
-                                st.markdown("**Asl tavsif:**")
-                                st.info(test_product)
-                            
-                            with col2:
-                                st.markdown("**Takomillashtirilgan tavsif:**")
-                                st.success(enhancement_result['enhanced_description'])
-                            
-                            # Show improvements
-                            if enhancement_result['improvements_made']:
-                                st.markdown("**🔄 Qilingan yaxshilanishlar:**")
-                                for improvement in enhancement_result['improvements_made']:
-                                    st.markdown(f"• {improvement}")
-                            
-                            # Show technical details
-                            if enhancement_result['technical_details']:
-                                st.markdown("**⚙️ Topilgan texnik xususiyatlar:**")
-                                for category, details in enhancement_result['technical_details'].items():
-                                    if details:
-                                        st.markdown(f"• {category}: {', '.join(details[:3])}")
-                            
-                            # Show sources
-                            if enhancement_result['sources_used']:
-                                st.markdown("**📚 Foydalanilgan manbalar:**")
-                                for source in enhancement_result['sources_used'][:3]:
-                                    st.markdown(f'<div class="source-card">🔗 {source}</div>', unsafe_allow_html=True)
-                            
-                            # Re-analyze enhanced description
-                            enhanced_analysis = enhancer.analyze_description_completeness(enhancement_result['enhanced_description'])
-                            
-                            st.markdown("#### 📈 Yakuniy natija")
-                            
-                            col1, col2, col3 = st.columns(3)
-                            
-                            with col1:
-                                improvement = enhanced_analysis['completeness_score'] - original_analysis['completeness_score']
-                                st.metric("To'liqlik yaxshilanishi", f"+{improvement:.1f}%")
-                            
-                            with col2:
-                                st.metric("Yangi bojxona tayyorligi", enhanced_analysis['customs_readiness'])
-                            
-                            with col3:
-                                st.metric("Scraping ishonch darajasi", f"{enhancement_result['confidence_score']:.1f}%")
-                            
-                        else:
-                            st.warning("⚠️ Qo'shimcha ma'lumot topilmadi")
-                            
-                    else:
-                        st.success("🎉 Tavsif allaqachon bojxona uchun tayyor!")
-                        
+                    st.session_state.test_request = get_interactive_enricher().start(test_product)
                 else:
                     st.warning("Test uchun tovar tavsifini kiriting")
         
+        if 'test_request' in st.session_state:
+            show_test_result(st.session_state.test_request)
+        
         # Example products for testing
         st.markdown("### 🎯 Test misollari")
         
@@ -1463,5 +5482,206 @@ python -c "import nltk; nltk.download('punkt'); nltk.download('stopwords'); nltk
                 
                 st.caption(description)
 
+# ========================= COMMAND LINE =========================
+
+def run_cli(argv: List[str]):
+    """Headless commands: python app.py <command> ..."""
+    parser = argparse.ArgumentParser(prog='app.py', description="Bojxona tovar tavsifi - headless rejim")
+    parser.add_argument('--queue', type=Path, help="Shard navbati (SQLite fayl)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    submit = commands.add_parser('submit', help="Faylni shardlarga bo'lib navbatga qo'shish")
+    submit.add_argument('input', type=Path)
+    submit.add_argument('--shard-size', type=int, default=500)
+    submit.add_argument('--per-product-requests', type=int, default=0)
+    submit.add_argument('--mode', choices=['threads', 'hybrid'], default='threads')
+    submit.add_argument('--no-dedupe', action='store_true', help="O'xshash tovarlarni alohida qidirish")
+    
+    worker = commands.add_parser('worker', help="Shardlarni qayta ishlovchi worker")
+    worker.add_argument('--worker-id')
+    worker.add_argument('--lease', type=float, default=300, help="Da'vo muddati (soniya)")
+    worker.add_argument('--exit-when-idle', action='store_true')
+    worker.add_argument('--profile', choices=PROFILE_MODES, help="Har bir shardni profilyorlash (hisobotlar navbat yonidagi profiles/ papkasida)")
+    
+    run = commands.add_parser('run', help="Faylni shu jarayonda qayta ishlab natijani yozish")
+    run.add_argument('input', type=Path)
+    run.add_argument('output', type=Path, help=".xlsx, .csv, .csv.gz, .csv.zst, .parquet yoki .arrow")
+    run.add_argument('--summary', type=Path, help="Xulosa jadvali fayli (format kengaytmadan)")
+    run.add_argument('--per-product-requests', type=int, default=0)
+    run.add_argument('--mode', choices=['threads', 'hybrid'], default='threads')
+    run.add_argument('--no-dedupe', action='store_true')
+    run.add_argument('--profile', choices=PROFILE_MODES, help="Profilyor va xotira hisobotlarini natija fayli yonida saqlash")
+    
+    status = commands.add_parser('status', help="Batch holati")
+    status.add_argument('batch_id', nargs='?')
+    
+    merge = commands.add_parser('merge', help="Natijalarni ID tartibida birlashtirish")
+    merge.add_argument('batch_id')
+    merge.add_argument('output', type=Path)
+    
+    serve = commands.add_parser('serve', help="HTTP API xizmati")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8600)
+    
+    loadtest = commands.add_parser('loadtest', help="/analyze uchun yuklama generatori")
+    loadtest.add_argument('--url', default='http://127.0.0.1:8600')
+    loadtest.add_argument('--requests', type=int, default=10000)
+    loadtest.add_argument('--concurrency', type=int, default=32)
+    loadtest.add_argument('--p99-target-ms', type=float, default=10.0, help="p99 kechikish maqsadi; oshsa chiqish kodi 1")
+    
+    record = commands.add_parser('record', help="Jonli qidiruv va sahifalarni kassetaga yozib olish")
+    record.add_argument('input', type=Path)
+    record.add_argument('--cassette', default='default')
+    record.add_argument('--per-product-requests', type=int, default=0)
+    
+    replay = commands.add_parser('replay', help="Kassetani mahalliy serverdan qayta ijro etish")
+    replay.add_argument('--cassette', default='default')
+    replay.add_argument('--host', default='127.0.0.1')
+    replay.add_argument('--port', type=int, default=8700)
+    
+    bench = commands.add_parser('bench', help="Kassetadan oflayn uchdan-uchgacha benchmark")
+    bench.add_argument('input', type=Path)
+    bench.add_argument('--cassette', default='default')
+    bench.add_argument('--label', default='')
+    bench.add_argument('--mode', choices=['threads', 'hybrid'], default='threads')
+    bench.add_argument('--per-product-requests', type=int, default=0)
+    bench.add_argument('--no-dedupe', action='store_true')
+    bench.add_argument('--search-delay', type=float, default=0.0)
+    bench.add_argument('--seed', type=int, default=0)
+    bench.add_argument('--log', type=Path, default=BENCHMARK_LOG, help="Natijalar yoziladigan JSONL fayl")
+    
+    microbench = commands.add_parser('microbench', help="Tahlilchi va ekstraktorlar uchun mikro-benchmark")
+    microbench.add_argument('--sizes', nargs='+', choices=list(MICROBENCH_SIZES), default=['1k', '100k'])
+    microbench.add_argument('--corpus', type=Path, help="Anonimlashtiriladigan haqiqiy tovarlar fayli")
+    microbench.add_argument('--pages', type=int, default=200, help="Sintetik HTML sahifalar soni")
+    microbench.add_argument('--cassette', help="Sahifalarni shu kassetadan olish")
+    microbench.add_argument('--threshold', type=float, default=0.2, help="Ruxsat etilgan regressiya ulushi")
+    microbench.add_argument('--repeats', type=int, default=5, help="Har bir bosqich necha marta o'lchanadi (mediana olinadi)")
+    microbench.add_argument('--baseline', type=Path, default=MICROBENCH_BASELINE, help="Asos fayli")
+    microbench.add_argument('--update-baseline', action='store_true')
+    
+    for command in (replay, bench):
+        command.add_argument('--latency-ms', type=float, default=0.0)
+        command.add_argument('--jitter-ms', type=float, default=0.0)
+        command.add_argument('--recorded-latency', action='store_true', help="Yozib olingan javob vaqtlarini takrorlash")
+        command.add_argument('--failure-rate', type=float, default=0.0, help="503 qaytaradigan so'rovlar ulushi")
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'submit':
+        df = read_products_file(args.input, args.input.name, columns=['ID', 'Tovar_nomi'])
+        is_valid, validation_message = validate_uploaded_file(df)
+        if not is_valid:
+            parser.error(validation_message)
+        
+        settings = {'per_product_requests': args.per_product_requests, 'execution_mode': args.mode, 'dedupe': not args.no_dedupe}
+        file_hash = BatchCheckpoint.hash_file(args.input.read_bytes())
+        batch_id = ShardQueue(args.queue).submit(df, args.input.name, file_hash, args.shard_size, settings)
+        print(batch_id)
+    
+    elif args.command == 'worker':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        run_worker(ShardQueue(args.queue, lease=args.lease), args.worker_id, args.exit_when_idle, profile=args.profile)
+    
+    elif args.command == 'run':
+        df = read_products_file(args.input, args.input.name, columns=['ID', 'Tovar_nomi'])
+        is_valid, validation_message = validate_uploaded_file(df)
+        if not is_valid:
+            parser.error(validation_message)
+        
+        engines = get_engines()
+        budget = BatchBudget(None, None, args.per_product_requests)
+        profiler = BatchProfiler(args.output.parent, args.output.stem, args.profile) if args.profile else contextlib.nullcontext()
+        with profiler:
+            results_df = process_products_for_customs(
+                df, engines.enhancer, engines.scraper, budget, progress_callback=lambda done, total, description: print(f"\r{done}/{total}", end='', flush=True),
+                execution_mode=args.mode, hs_index=engines.hs_index, dedupe=not args.no_dedupe
+            )
+        write_results_file(results_df, args.output)
+        print(f"\n{len(results_df)} ta tovar yozildi: {args.output}")
+        if args.summary:
+            write_results_file(results_summary(results_df).astype({'Qiymat': str}), args.summary)
+            print(f"Xulosa: {args.summary}")
+        for report_path in getattr(profiler, 'reports', []):
+            print(f"Profil: {report_path}")
+    
+    elif args.command == 'status':
+        shard_queue = ShardQueue(args.queue)
+        batches = [batch for batch in shard_queue.batches() if not args.batch_id or batch['batch_id'] == args.batch_id]
+        for batch in batches:
+            print(f"{batch['batch_id']} {batch['file_name']} {batch['total_shards']} shard: {shard_queue.status(batch['batch_id'])}")
+    
+    elif args.command == 'merge':
+        shard_queue = ShardQueue(args.queue)
+        counts = shard_queue.status(args.batch_id)
+        results_df = shard_queue.merge(args.batch_id)
+        write_results_file(results_df, args.output)
+        print(f"{len(results_df)} ta tovar yozildi: {args.output} {counts}")
+    
+    elif args.command == 'serve':
+        server = serve_api(args.host, args.port)
+        print(f"API: http://{args.host}:{args.port}")
+        server.serve_forever()
+    
+    elif args.command == 'loadtest':
+        if args.requests < 1 or args.concurrency < 1:
+            parser.error("--requests va --concurrency kamida 1 bo'lishi kerak")
+        report = run_load_test(args.url, args.requests, args.concurrency)
+        report['p99_target_ms'] = args.p99_target_ms
+        report['p99_target_met'] = report['p99_ms'] < args.p99_target_ms
+        print(json.dumps(report, indent=2))
+        if not report['p99_target_met']:
+            print(f"p99 maqsadi bajarilmadi: {report['p99_ms']:.1f} ms >= {args.p99_target_ms:.1f} ms", file=sys.stderr)
+            sys.exit(1)
+    
+    elif args.command == 'microbench':
+        corpora = {f"synthetic_{size}": synthetic_descriptions(MICROBENCH_SIZES[size]) for size in args.sizes}
+        if args.corpus:
+            real = read_products_file(args.corpus, args.corpus.name)['Tovar_nomi'].astype(str).tolist()
+            corpora.update({f"anonymized_{size}": anonymized_descriptions(real, MICROBENCH_SIZES[size]) for size in args.sizes})
+        pages = cassette_pages(Cassette.named(args.cassette)) if args.cassette else synthetic_pages(args.pages)
+        
+        report = run_microbenchmarks(corpora, pages, repeats=args.repeats)
+        print(pd.DataFrame(report).to_string(index=False, float_format=lambda value: f"{value:.1f}"))
+        
+        regressions = check_microbench_regressions(report, load_microbench_baseline(args.baseline), args.threshold)
+        if args.update_baseline:
+            save_microbench_baseline(report, args.baseline)
+            print(f"Asos yangilandi: {args.baseline}")
+        elif regressions:
+            print("Regressiya:\n" + '\n'.join(regressions))
+            sys.exit(1)
+    
+    elif args.command == 'record':
+        cassette = Cassette.named(args.cassette)
+        results_df = record_cassette(read_products_file(args.input, args.input.name), cassette, args.per_product_requests)
+        print(f"{len(results_df)} ta tovar, kassetada {len(cassette)} ta javob: {cassette.db_path}")
+    
+    elif args.command == 'replay':
+        server = ReplayHTTPServer(
+            (args.host, args.port), Cassette.named(args.cassette), args.latency_ms / 1000, args.jitter_ms / 1000,
+            args.recorded_latency, args.failure_rate
+        )
+        print(f"Replay: {server.url}/replay?url=... ({len(server.responses)} ta javob)")
+        server.serve_forever()
+    
+    elif args.command == 'bench':
+        cassette = Cassette.named(args.cassette)
+        if not len(cassette):
+            parser.error(f"Kasseta bo'sh: {cassette.db_path}")
+        report = run_e2e_benchmark(
+            read_products_file(args.input, args.input.name), cassette, args.label, args.latency_ms / 1000,
+            args.jitter_ms / 1000, args.recorded_latency, args.failure_rate, args.mode, args.per_product_requests,
+            not args.no_dedupe, args.search_delay, args.seed
+        )
+        previous = save_benchmark_result(report, args.log)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        if previous:
+            print(f"\nOldingi natija bilan taqqoslash ({previous['label'] or previous['timestamp']}):")
+            print(compare_benchmarks(report, previous).to_string(index=False))
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if st.runtime.exists():
+        main()
+    else:
+        run_cli(sys.argv[1:])
\ No newline at end of file
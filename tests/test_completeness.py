@@ -0,0 +1,35 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope='module')
+def enhancer():
+    return app.ProductDescriptionEnhancer()
+
+
+# Scores matched on the raw description before the shared normalizer
+@pytest.mark.parametrize('description, score, missing', [
+    ('HP EliteBook 840 G8 14" FHD', 62.5, ['physical_attributes', 'category_identifiers', 'year_model']),
+    ('Samsung 55" QLED TV 4K 2023', 87.5, ['physical_attributes']),
+    ("Dell monitor 27'' IPS", 79.17, ['physical_attributes', 'year_model']),
+    ('Apple iPhone 15 Pro 256GB Black smartphone 2024 model', 100, []),
+    ('Kindle e-reader 2nd gen 8GB', 87.5, ['physical_attributes']),
+])
+def test_completeness_score(enhancer, description, score, missing):
+    analysis = enhancer.analyze_description_completeness(description)
+    assert analysis['completeness_score'] == pytest.approx(score, abs=0.01)
+    assert analysis['missing_elements'] == missing
+
+
+@pytest.mark.parametrize('description', ['HP EliteBook 840 G8 14" FHD', "Dell monitor 27'' IPS", 'LG OLED TV 65″ 2023'])
+def test_inch_mark_is_a_screen_size(enhancer, description):
+    analysis = enhancer.analyze_description_completeness(description)
+    assert 'technical_specs' not in analysis['missing_elements']
+
+
+def test_batch_matches_single(enhancer):
+    descriptions = ['HP EliteBook 840 G8 14" FHD', 'Samsung 55" QLED TV 4K 2023', 'HP EliteBook 840 G8 14" FHD']
+    batch = enhancer.analyze_descriptions_batch(descriptions)
+    assert [analysis['completeness_score'] for analysis in batch] == pytest.approx(
+        [enhancer.analyze_description_completeness(description)['completeness_score'] for description in descriptions])